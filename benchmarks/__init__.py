@@ -0,0 +1,2 @@
+"""Benchmarks for pystocks. Run them as modules from the repo root, e.g.
+python -m benchmarks.run"""
@@ -0,0 +1,172 @@
+"""AsyncUpdater against a local HTTP stub serving Y! like CSV files with
+latency and random failures. Then, against a stub that never answers in
+time, checks that the default fetch path passes its timeout to the
+downloads and that the budget bounds the update even when a download
+ignores it, and that local adjustments are recomputed as update_db does.
+Exits with an error if any check fails.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_async [latency_seconds] [failure_rate]
+"""
+import io
+import os
+import sys
+import time
+import random
+import contextlib
+import tempfile
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+import pandas as pd
+from pystocks.dbstocks import DBstocks
+from pystocks.aioupdate import AsyncUpdater
+from benchmarks.stubs import canned_frame
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+
+def stub_server(latency, failure_rate, nrows=500):
+    """Starts a local server on a free port, returns (server, base url)"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            if random.random() < failure_rate:
+                self.send_response(503)
+                self.end_headers()
+                return None
+            body = canned_frame(nrows, seed=len(self.path)).to_csv().encode()
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                #  The client timed out.
+                return None
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1])
+
+
+def http_yahoo(url):
+    """Stand-in for DBstocks._fetch_yahoo downloading from url"""
+    def fetch(ticker, start, end, category='y', timeout=None):
+        res = requests.get(url + "/" + ticker + ".csv", timeout=timeout)
+        res.raise_for_status()
+        return pd.read_csv(io.StringIO(res.text), index_col="Date",
+                           parse_dates=True)
+    return fetch
+
+
+def http_fetcher(dbs, url):
+    yahoo = http_yahoo(url)
+
+    def fetch(ticker, start, end, timeout=None):
+        return dbs._yahoo_rows(yahoo(ticker, start, end, timeout=timeout))
+    return fetch
+
+
+def check_hanging(tmp, latency=6., timeout=0.5, budget=2.):
+    """Runs the default fetchers of AsyncUpdater against a stub answering
+    after latency seconds, then a fetcher ignoring its timeout. Returns
+    the errors found."""
+    server, url = stub_server(latency, 0.)
+    dbs = DBstocks(dbname=os.path.join(tmp, "hanging.db"), log=False)
+    dbs.dtickers = {'y': ['GGAL', 'YPFD'], 'yusa': ['GGAL_usa'],
+                    'bcra': ['dolar_bcra_a3500']}
+    dbs.bcra_urls = {'dolar_bcra_a3500': url + "/com3500.xls"}
+    dbs.bcra_cache = os.path.join(tmp, "bcra")
+    dbs._fetch_yahoo = http_yahoo(url)
+
+    errors = []
+    start = time.perf_counter()
+    report = AsyncUpdater(dbs, timeout=timeout, retries=1, backoff=0.1,
+                          budget=budget).run()
+    elapsed = time.perf_counter() - start
+    print("hanging stub, timeout %.1fs: %.3fs  %s" %
+          (timeout, elapsed, dict(Counter(i['status']
+                                          for i in report.values()))))
+    #  The download's own timeout may fire before the updater's.
+    if any(i['status'] != 'timeout' and 'Timeout' not in str(i['error'])
+           for i in report.values()):
+        errors.append("downloads did not time out: " + str(report))
+    if elapsed > budget + 1.:
+        errors.append("timed out downloads held the update %.3fs" % elapsed)
+
+    def ignore_timeout(ticker, start, end, timeout=None):
+        time.sleep(latency)
+
+    start = time.perf_counter()
+    report = AsyncUpdater(dbs, fetchers={'y': ignore_timeout,
+                                         'yusa': ignore_timeout,
+                                         'bcra': ignore_timeout},
+                          timeout=latency, budget=budget).run()
+    elapsed = time.perf_counter() - start
+    print("download ignoring its timeout, budget %.1fs: %.3fs  %s" %
+          (budget, elapsed, dict(Counter(i['status']
+                                          for i in report.values()))))
+    if elapsed > budget + 1.:
+        errors.append("budget of %.1fs not enforced: %.3fs" %
+                      (budget, elapsed))
+    dbs.close()
+    server.shutdown()
+    return errors
+
+
+def check_adjusted(tmp):
+    """Updates a db with a dividend event synchronously and asynchronously.
+    Returns the errors found."""
+    market = SyntheticMarket(ntickers=30, years=2)
+    prices = {}
+    for mode in ("sync", "async"):
+        dbs = make_db(os.path.join(tmp, mode + ".db"), market,
+                      until=market.dates[-20])
+        dbs.add_events("GGAL", [(market.dates[-100], 'dividend', 0.5)])
+        market.install(dbs)
+        if mode == "sync":
+            dbs.update_db()
+        else:
+            dbs.update_db_async()
+        prices[mode] = dbs.get_prices("ggal", "2000-01-01")
+        dbs.close()
+    try:
+        pd.testing.assert_frame_equal(prices['sync'], prices['async'])
+    except AssertionError as error:
+        return ["async update of an adjusted ticker: " + str(error)]
+    return []
+
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    server, url = stub_server(latency, failure_rate)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dbs = DBstocks(dbname=os.path.join(tmp, "async.db"), log=False)
+        fetch = http_fetcher(dbs, url)
+        updater = AsyncUpdater(dbs, fetchers={'y': fetch, 'yusa': fetch,
+                                              'bcra': fetch},
+                               rates={'y': 20., 'yusa': 20., 'bcra': 20.},
+                               timeout=5., retries=4, backoff=0.1,
+                               budget=60.)
+        start = time.perf_counter()
+        report = updater.run()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        status = Counter(i['status'] for i in report.values())
+        attempts = sum(i['attempts'] for i in report.values())
+        rows = sum(i['inserted'] for i in report.values())
+        print("%.3fs  %d tickers  %d attempts  %d rows  %s" %
+              (elapsed, len(report), attempts, rows, dict(status)))
+        errors = check_hanging(tmp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            errors += check_adjusted(tmp)
+
+    if errors:
+        raise SystemExit("\n".join(errors))
@@ -0,0 +1,99 @@
+"""Intraday bar store: bulk and daily appends of 1 minute bars, and range
+reads raw and downsampled to daily and weekly bars, over 10M+ bars of a
+synthetic market. Downsampled bars are checked against pandas resample.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_bars [tickers] [days] [repeat]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from pystocks.dbstocks import DBstocks
+from benchmarks.synthetic import SyntheticMarket
+
+
+def best(function, repeat):
+    """Best seconds of repeat calls to function, and its last result"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def pandas_ohlcv(bars, freq):
+    return bars.resample(freq, label='left', closed='left').agg(
+        {'start': 'first', 'max': 'max', 'min': 'min', 'close': 'last',
+         'volnom': 'sum'}).dropna()
+
+
+if __name__ == "__main__":
+    ntickers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 1400
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    daily = 5
+
+    market = SyntheticMarket(years=days / 252 + 1)
+    tickers = market.dtickers['y'][:ntickers]
+    with tempfile.TemporaryDirectory() as tmp:
+        dbs = DBstocks(dbname=os.path.join(tmp, "bars.db"), log=False)
+        bulk = appends = total = 0.
+        for ticker in tickers:
+            bars = market.bars(ticker, days=days)
+            cut = bars.index.searchsorted(market.dates[-daily])
+            start = time.perf_counter()
+            dbs.append_bars(ticker, bars.iloc[:cut])
+            bulk += time.perf_counter() - start
+
+            #  Then a session at a time, each overlapping the last one.
+            for day in range(daily, 0, -1):
+                session = bars.loc[market.dates[-day - 1]:
+                                   market.dates[-day].strftime("%Y-%m-%d")]
+                start = time.perf_counter()
+                counts = dbs.append_bars(ticker, session)
+                appends += time.perf_counter() - start
+            total += len(bars)
+            assert counts['appended'] == len(bars) // days
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, dirs, names in os.walk(dbs.bars.path)
+                   for name in names)
+
+        first = market.dates[-days].strftime("%Y-%m-%d")
+        month = market.dates[-21].strftime("%Y-%m-%d")
+        reads = {}
+        for name, start, freq in (("raw", first, None),
+                                  ("daily", first, 'D'),
+                                  ("weekly", first, 'W'),
+                                  ("month, 5min", month, '5min')):
+            reads[name] = best(lambda: [dbs.get_bars(i, start, freq=freq)
+                                        for i in tickers], repeat)
+        rows = sum(len(i) for i in reads['raw'][1])
+
+        #  Same bars from pandas, on the raw read of a ticker.
+        raw = reads['raw'][1][0]
+        for name, freq in (("daily", 'D'), ("weekly", 'W-MON')):
+            expected = pandas_ohlcv(raw, freq)
+            got = reads[name][1][0]
+            assert (got.index == expected.index).all(), name
+            assert np.allclose(got.to_numpy(), expected.to_numpy()), name
+        records = dbs.bars.records(tickers[0], first)
+        pandas_daily = best(lambda: pandas_ohlcv(raw, 'D'), repeat)[0]
+        daily_ticker = best(lambda: dbs.bars.resample(records, 'D'),
+                            repeat)[0]
+        dbs.close()
+
+    print("%d tickers, %d bars, %.1f MB" % (len(tickers), total, size / 2**20))
+    print("bulk append   %7.3fs  %6.1fM bars/s" % (bulk, total / bulk / 1e6))
+    print("daily appends %7.3fs  %6.2fms a session" %
+          (appends, appends / (daily * len(tickers)) * 1e3))
+    for name, (seconds, frames) in reads.items():
+        speed = ("%6.1fM bars/s" % (rows / seconds / 1e6)
+                 if name != "month, 5min" else " " * 13)
+        print("read %-12s %6.3fs  %s  %d rows out" %
+              (name, seconds, speed, sum(len(i) for i in frames)))
+    print("daily resample of a ticker in memory: %.4fs, pandas %.4fs "
+          "(%.1fx)" %
+          (daily_ticker, pandas_daily, pandas_daily / daily_ticker))
@@ -0,0 +1,45 @@
+"""Frame to row conversion: former iterrows() loop vs _yahoo_rows.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_convert [rows]
+"""
+import sys
+import time
+from pystocks.dbstocks import DBstocks
+from benchmarks.stubs import canned_frame
+
+
+def iterrows_values(data):
+    """The former get_data_from_yahoo conversion"""
+    data = data.reset_index()
+    values = []
+    for row in data.iterrows():
+        values.append({'close':   row[1].Close,
+                       'max':     row[1].High,
+                       'min':     row[1].Low,
+                       'start':   row[1].Open,
+                       'volnom':  row[1].Volume,
+                       'vol':     None,
+                       'close_h': row[1]['Adj Close'],
+                       'date':    row[1].Date})
+    return values
+
+
+def rows_per_second(func, data, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(data) / best
+
+
+if __name__ == "__main__":
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 7000
+    data = canned_frame(nrows)
+    dbs = DBstocks(dbname=":memory:", log=False)
+    print("iterrows:    %12.0f rows/s" % rows_per_second(iterrows_values,
+                                                         data))
+    print("_yahoo_rows: %12.0f rows/s" % rows_per_second(dbs._yahoo_rows,
+                                                         data))
@@ -0,0 +1,81 @@
+"""Import time of read-only usage, measured with python -X importtime in a
+fresh interpreter. Exits with an error if a heavy optional dependency is
+loaded, a db connection is opened before the first query, or the import
+takes longer than the limit.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_import [limit_ms] [repeat]
+"""
+import io
+import os
+import sys
+import tempfile
+import contextlib
+import subprocess
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+#  Read-only usage: construct the handles, then read prices.
+script = """
+import sys
+import pystocks.stats
+from pystocks.dbstocks import DBstocks
+dbs = DBstocks(dbname=sys.argv[1], log=False)
+connected = dbs.engine.pool.checkedin() + dbs.engine.pool.checkedout()
+stats = pystocks.stats.DBstats(dbs)
+print("connected", connected)
+dbs.get_prices("ggal", "2020-01-01")
+print("loaded", ",".join(sorted(i for i in sys.modules
+                                if i.split(".")[0] in sys.argv[2:])))
+"""
+
+#  Not needed to read prices.
+optional = ["yfinance", "requests", "matplotlib", "openpyxl", "xlrd"]
+
+
+def importtime(path):
+    """Returns ({module: cumulative us}, script output lines)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", script,
+                          path] + optional,
+                         capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [i.strip() for i in line[len("import time:"):].split("|")]
+        if parts[1].isdigit():
+            times[parts[2]] = int(parts[1])
+    return times, out.stdout.split("\n")
+
+
+if __name__ == "__main__":
+    limit = float(sys.argv[1]) if len(sys.argv) > 1 else 1000.
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    best = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "small.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            make_db(path, SyntheticMarket(rows=30)).close()
+        for i in range(repeat):
+            times, lines = importtime(path)
+            for module in ("pandas", "sqlalchemy", "pystocks.dbstocks",
+                           "pystocks.stats"):
+                if module in times:
+                    best[module] = min(best.get(module, times[module]),
+                                       times[module])
+    for module, us in best.items():
+        print("%-20s %8.1f ms" % (module, us / 1000.))
+
+    errors = []
+    if "connected 0" not in lines:
+        errors.append("a db connection was opened before the first query")
+    loaded = [i for i in lines if i.startswith("loaded")][0].split(" ", 1)
+    if len(loaded) > 1 and loaded[1]:
+        errors.append("optional modules loaded: " + loaded[1])
+    total = best.get("pystocks.stats", 0) / 1000.
+    if total > limit:
+        errors.append("import pystocks.stats took %.1f ms, over the %.1f ms "
+                      "limit" % (total, limit))
+    if errors:
+        raise SystemExit("\n".join(errors))
@@ -0,0 +1,64 @@
+"""Peak memory of streaming a large synthetic database with iter_prices vs
+loading it whole with get_panel, traced with tracemalloc from right before
+the read. Exits with an error if streaming goes over the limit.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_iter [rows] [limit_mb]
+"""
+import os
+import sys
+import subprocess
+import tempfile
+import tracemalloc
+from pystocks.dbstocks import DBstocks
+from benchmarks.stubs import stub_fetch
+
+
+def run(mode, path):
+    dbs = DBstocks(dbname=path, log=False)
+    tickers = dbs.dtickers['y']
+    columns = list(dbs.price_columns)
+    dbs.has_ticker(tickers[0])
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    rows = 0
+    if mode == "iter":
+        for chunk in dbs.iter_prices(tickers, columns=columns,
+                                     chunksize=20000, merge=True):
+            rows += len(chunk)
+    else:
+        rows = len(dbs.get_panel(tickers, columns))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%.1f %d" % ((peak - base) / 2**20, rows))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] in ("iter", "full"):
+        run(sys.argv[1], sys.argv[2])
+        raise SystemExit(0)
+
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else 64.
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.db")
+        dbs = DBstocks(dbname=path, log=False)
+        dbs._upsert_yahoo_data("1993-01-01", fetch=stub_fetch(0, nrows))
+
+        used = {}
+        for mode in ("iter", "full"):
+            out = subprocess.run([sys.executable, "-m",
+                                  "benchmarks.bench_iter", mode, path],
+                                 capture_output=True, text=True,
+                                 env=dict(os.environ,
+                                          PYTHONPATH=os.pathsep.join(
+                                                              sys.path)))
+            used[mode], dates = out.stdout.split()
+            used[mode] = float(used[mode])
+            print("%-4s peak memory growth: %8.1f MB  (%s dates)" %
+                  (mode, used[mode], dates))
+
+    if used["iter"] > limit:
+        raise SystemExit("iter_prices peak memory growth %.1f MB over the "
+                         "%.1f MB limit" % (used["iter"], limit))
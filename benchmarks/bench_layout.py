@@ -0,0 +1,51 @@
+"""Wide (a table per ticker) vs long (single prices table) layouts:
+full-market panel reads and date range scans.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_layout [rows]
+"""
+import os
+import sys
+import time
+import tempfile
+from pystocks.dbstocks import DBstocks
+from pystocks.migrate import migrate
+from benchmarks.stubs import stub_fetch
+
+
+def best_of(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 7000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wide = os.path.join(tmp, "wide.db")
+        long = os.path.join(tmp, "long.db")
+        dbs = DBstocks(dbname=wide, log=False, layout="wide")
+        dbs._upsert_yahoo_data("1993-01-01", fetch=stub_fetch(0, nrows))
+
+        start = time.perf_counter()
+        migrate(wide, long, log=False)
+        print("migration: %8.3fs" % (time.perf_counter() - start))
+
+        tickers = dbs.dtickers['y']
+        for layout, path in (("wide", wide), ("long", long)):
+            dbs = DBstocks(dbname=path, log=False, layout=layout)
+            panel = best_of(lambda: dbs.get_panel(tickers, "close_h",
+                                                  start="1991-01-01"))
+            scan = best_of(lambda: dbs.get_panel(tickers, "close_h",
+                                                 start="2010-01-01",
+                                                 end="2010-12-31"))
+            single = best_of(lambda: dbs.get_prices("GGAL", "1991-01-01"))
+            print("%-5s full panel: %7.3fs  1y scan: %7.3fs  "
+                  "single ticker: %7.3fs  size: %6.1f MB" %
+                  (layout, panel, scan, single,
+                   os.path.getsize(path) / 2.**20))
@@ -0,0 +1,30 @@
+"""Concurrent Y! update pipeline against an offline stub with simulated
+latency.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_pipeline [latency_seconds] [rows]
+"""
+import os
+import sys
+import time
+import tempfile
+from pystocks.dbstocks import DBstocks
+from benchmarks.stubs import stub_fetch
+
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    nrows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    fetch = stub_fetch(latency, nrows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in (1, 4, 8, 16):
+            dbs = DBstocks(dbname=os.path.join(tmp, str(workers) + ".db"),
+                           log=False)
+            start = time.perf_counter()
+            counts = dbs._upsert_yahoo_data("1993-01-01", workers=workers,
+                                            fetch=fetch)
+            elapsed = time.perf_counter() - start
+            rows = sum(i['inserted'] + i['updated'] for i in counts.values())
+            print("workers: %2d  %8.3fs  %d tickers  %d rows" %
+                  (workers, elapsed, len(counts), rows))
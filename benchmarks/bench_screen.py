@@ -0,0 +1,45 @@
+"""Screening engine: backtests of a parameter grid over the USD panel of
+a synthetic database, in this process and on every core.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_screen [years] [workers]
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+from pystocks.stats import DBstats
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+
+if __name__ == "__main__":
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        market = SyntheticMarket(years=years)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbs = make_db(os.path.join(tmp, "screen.db"), market)
+            stats = DBstats(dbs)
+            stats.get_yprices()
+            stats.get_ccl()
+        screener = stats.screener()
+
+    grids = {'ma_cross': {'fast': [5, 10, 15, 20, 30, 40, 50],
+                          'slow': [60, 80, 100, 150, 200, 250]},
+             'momentum': {'window': [20, 40, 60, 90, 120, 180, 250],
+                          'skip': [0, 5, 10, 21]},
+             'relative_strength': {'window': [20, 40, 60, 90, 120, 180]}}
+    top = (3, 5, 10, 15, 20)
+    hold = (5, 10, 21, 42, 63)
+    print("panel: %d dates x %d tickers" % screener.prices.shape)
+    for rule, params in grids.items():
+        for n in sorted({1, workers}):
+            start = time.perf_counter()
+            table = screener.grid(rule, params, top=top, hold=hold,
+                                  workers=n)
+            elapsed = time.perf_counter() - start
+            print("%-18s workers: %2d  %5d backtests  %7.3fs  %8.0f/s" %
+                  (rule, n, len(table), elapsed, len(table) / elapsed))
@@ -0,0 +1,89 @@
+"""Concurrent full-market panel reads: every reader opening the db with
+its own DBstocks vs QueryClient proxies to a PriceServer. Also checks
+that DBstats over a QueryClient matches DBstats on the db, before and
+after an earlier row is revised. Exits with an error on any mismatch.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_server [readers] [requests]
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+import threading
+import contextlib
+import pandas as pd
+from pystocks.dbstocks import DBstocks
+from pystocks.stats import DBstats
+from pystocks.server import PriceServer, QueryClient
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+
+def concurrent(make, readers, requests, tickers):
+    """Seconds for readers threads doing requests panel reads each"""
+    def read():
+        dbs = make()
+        for i in range(requests):
+            dbs.get_panel(tickers, "close_h")
+    threads = [threading.Thread(target=read) for i in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def check_stats(path, server, market):
+    """Variations of DBstats over a QueryClient and over the db, then
+    again after a close 100 days back is revised. Returns the errors."""
+    errors = []
+    remote = DBstats(dbs=QueryClient(server.url))
+    for label in ("initial", "revised"):
+        local = DBstats(dbs=DBstocks(dbname=path, log=False))
+        with contextlib.redirect_stdout(io.StringIO()):
+            local.update()
+            remote.update()
+        for kind, series in local.since.items():
+            try:
+                pd.testing.assert_series_equal(remote.since[kind], series)
+            except AssertionError as error:
+                errors.append(label + ", " + kind + ": " + str(error))
+        if label == "initial":
+            day = market.dates[-100].strftime("%Y-%m-%d")
+            local.dbs._upsert_data({'GGAL': [{'date': day, 'close': 1.,
+                                              'close_h': 1.}]})
+            server.refresh()
+        local.dbs.close()
+    remote.dbs.close()
+    return errors
+
+
+if __name__ == "__main__":
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "server.db")
+        market = SyntheticMarket(years=20)
+        with contextlib.redirect_stdout(io.StringIO()):
+            make_db(path, market).close()
+        tickers = market.dtickers['y']
+
+        direct = concurrent(lambda: DBstocks(dbname=path, log=False),
+                            readers, requests, tickers)
+        start = time.perf_counter()
+        server = PriceServer(path, port=0).start()
+        load = time.perf_counter() - start
+        served = concurrent(lambda: QueryClient(server.url),
+                            readers, requests, tickers)
+        stats = server.stats
+        errors = check_stats(path, server, market)
+        server.shutdown()
+
+    print("direct:  %8.3fs" % direct)
+    print("server:  %8.3fs  (load %.3fs, %d of %d requests batched)" %
+          (served, load, stats['batched'], stats['requests']))
+    if errors:
+        raise SystemExit("\n".join(errors))
@@ -0,0 +1,132 @@
+"""DBstats.compute_var_since against the former pandas implementation:
+row by row updates, a revised last row, rows revised in the db before the
+last date (an adjustment, released quarantine flags), and the cost of an
+update for short and long histories. Exits with an error on any mismatch.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_since [years]
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+import pandas as pd
+from pystocks.stats import DBstats
+from pystocks.rolling import SinceStats
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+
+def pandas_var_since(data_usd, start, anchors):
+    """compute_var_since as it was before SinceStats"""
+    data = data_usd.loc[start:].ffill()
+    since = {}
+    since['max'] = (100. * data.div(data.max(), axis=1).subtract(1)
+                    ).dropna().iloc[-1].sort_values()
+    since['min'] = (100. * data.div(data.min(), axis=1).subtract(1)
+                    ).dropna().iloc[-1].sort_values()
+    for name, date in anchors.items():
+        since[name] = (100. * data.iloc[-1].div(data.loc[date:].iloc[0])
+                       .subtract(1)).dropna().sort_values()
+    return since
+
+
+def mismatches(stats, start, label):
+    """Kinds where stats.since differs from pandas_var_since"""
+    expected = pandas_var_since(stats.data_usd, start, stats.anchors)
+    errors = []
+    for kind, series in expected.items():
+        try:
+            pd.testing.assert_series_equal(stats.since[kind], series,
+                                           check_exact=True)
+        except AssertionError as error:
+            errors.append(label + ", " + kind + ": " + str(error))
+    return errors
+
+
+def update_cost(data_usd, start, anchors, repeat=200):
+    """Best seconds to fold in the last row over the rest of data_usd"""
+    engine = SinceStats(data_usd.columns, start=start, anchors=anchors)
+    engine.update(data_usd.iloc[:-1])
+    best = None
+    for i in range(repeat):
+        begin = time.perf_counter()
+        engine.update(data_usd)
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    start = '2017-01-01'
+    errors = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        market = SyntheticMarket(years=years)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbs = make_db(os.path.join(tmp, "since.db"), market)
+            stats = DBstats(dbs=dbs)
+            stats.get_yprices()
+            stats.get_ccl()
+        stats.anchors = {'ytd': '2020-01-01', 'paso': '2019-08-11',
+                         'covid': '2020-03-16'}
+        full = stats.data_usd
+
+        #  Row by row, as daily updates.
+        for end in range(len(full) - 30, len(full) + 1):
+            stats.data_usd = full.iloc[:end]
+            stats.compute_var_since(start)
+            errors += mismatches(stats, start, "rows up to %d" % end)
+        engine = stats.since_stats
+
+        #  Second update of the same day, with other last prices.
+        revised = full.copy()
+        revised.iloc[-1] = revised.iloc[-1] * 1.3
+        stats.data_usd = revised
+        stats.compute_var_since(start)
+        errors += mismatches(stats, start, "revised last row")
+        stats.data_usd = full
+        stats.compute_var_since(start)
+        errors += mismatches(stats, start, "last row back")
+        if stats.since_stats is not engine:
+            errors.append("engine rebuilt for a revised last row")
+
+        #  Adjustment rewriting the *_h rows of a ticker 100 days back.
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbs.add_events("GGAL", [(market.dates[-100], 'dividend', 0.5)])
+            stats.get_yprices()
+            stats.get_ccl()
+        stats.compute_var_since(start)
+        errors += mismatches(stats, start, "adjusted ggal")
+        if stats.since_stats is engine:
+            errors.append("engine kept after an earlier revision")
+
+        #  Released quarantine flag on an early date.
+        day = market.dates[-200]
+        stamp = day.strftime("%Y-%m-%d")
+        dbs.validator.store("ypfd", pd.DataFrame(
+            {'date': [day], 'rule': ['jump'], 'value': [0.]}), stamp, stamp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats.get_yprices()
+            stats.get_ccl()
+        stats.since_stats = None
+        stats.compute_var_since(start)
+        errors += mismatches(stats, start, "flagged ypfd")
+        dbs.validator.release("ypfd", dates=[day])
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats.get_yprices()
+            stats.get_ccl()
+        stats.compute_var_since(start)
+        errors += mismatches(stats, start, "released ypfd")
+        dbs.close()
+
+    #  Cost of a daily update, same panel width, 1 year or all the history.
+    short = update_cost(full.iloc[-252:], None, stats.anchors)
+    long = update_cost(full, None, stats.anchors)
+    print("update of a row: %d rows of history %.1f us, %d rows %.1f us" %
+          (252, short * 1e6, len(full), long * 1e6))
+    print("%d mismatches" % len(errors))
+    if errors:
+        raise SystemExit("\n".join(errors))
@@ -0,0 +1,68 @@
+"""Snapshot export: size of the db against compressed and memory mapped
+snapshots, export time, and full-market panel reads from a cold handle on
+each of them.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_snapshot [years] [repeat]
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+from pystocks.dbstocks import DBstocks, dispose_engines
+from pystocks.snapshot import Snapshot
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+
+def cold_panel(make, tickers, repeat):
+    """Best seconds to open a handle and read the close_h panel"""
+    best = None
+    for i in range(repeat):
+        dispose_engines()
+        start = time.perf_counter()
+        handle = make()
+        handle.get_panel(tickers, "close_h", start="1900-01-01")
+        elapsed = time.perf_counter() - start
+        handle.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot.db")
+        market = SyntheticMarket(years=years)
+        with contextlib.redirect_stdout(io.StringIO()):
+            make_db(path, market).close()
+        dbs = DBstocks(dbname=path, log=False)
+        with dbs.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        tickers = market.dtickers['y'] + market.dtickers['yusa']
+
+        sizes = {'db': os.path.getsize(path)}
+        times = {}
+        for codec in ("zlib", None):
+            name = codec or "raw"
+            target = os.path.join(tmp, "snapshot." + name)
+            start = time.perf_counter()
+            dbs.export_snapshot(target, codec=codec)
+            times[name] = time.perf_counter() - start
+            sizes[name] = os.path.getsize(target)
+        dbs.close()
+
+        reads = {'db': cold_panel(lambda: DBstocks(dbname=path, log=False),
+                                  tickers, repeat)}
+        for name in ("zlib", "raw"):
+            target = os.path.join(tmp, "snapshot." + name)
+            reads[name] = cold_panel(lambda: Snapshot(target), tickers,
+                                     repeat)
+
+    for name in ("db", "zlib", "raw"):
+        print("%-5s %8.1f MB  %5.1fx  export %6.3fs  cold panel %6.3fs" %
+              (name, sizes[name] / 2**20, sizes['db'] / sizes[name],
+               times.get(name, 0.), reads[name]))
@@ -0,0 +1,82 @@
+"""Bulk upsert vs the former row by row loop on a synthetic database.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_upsert [tickers] [rows]
+"""
+import os
+import sys
+import time
+import tempfile
+import datetime as dt
+import numpy as np
+import sqlalchemy as db
+from pystocks.dbstocks import DBstocks
+
+
+def synthetic_values(nrows, seed=0):
+    """List of value dicts as produced by get_data_from_yahoo"""
+    rng = np.random.default_rng(seed)
+    close = 100. * np.exp(np.cumsum(rng.normal(0, 0.02, nrows)))
+    first = dt.datetime(1993, 1, 4)
+    values = []
+    for i in range(nrows):
+        values.append({'close': close[i],
+                       'max': close[i] * 1.01,
+                       'min': close[i] * 0.99,
+                       'start': close[i],
+                       'volnom': float(rng.integers(1000, 100000)),
+                       'vol': None,
+                       'close_h': close[i],
+                       'date': first + dt.timedelta(days=i)})
+    return values
+
+
+def legacy_upsert(dbs, value_dict):
+    """The former _upsert_data: one existence check plus one INSERT or
+    UPDATE per row."""
+    with dbs.engine.connect() as conn:
+        for ticker in value_dict.keys():
+            ticker_table = dbs.get_table(ticker)
+            for value in value_dict[ticker]:
+                value_date = value['date'].strftime("%Y-%m-%d")
+                exists = conn.execute(
+                    db.select(ticker_table.c.date).where(
+                        ticker_table.c.date == value_date)
+                    ).first() is not None
+                if not exists:
+                    conn.execute(db.insert(ticker_table), value)
+                else:
+                    conn.execute(db.update(ticker_table).where(
+                        ticker_table.c.date == value_date).values(
+                            {i: value[i] for i in value if i != 'date'}))
+                if conn.in_transaction():
+                    conn.commit()
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    ntickers = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    nrows = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    value_dict = {"t" + str(i): synthetic_values(nrows, seed=i)
+                  for i in range(ntickers)}
+    total = ntickers * nrows
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, func in (("row by row", legacy_upsert),
+                            ("bulk", None)):
+            dbs = DBstocks(dbname=os.path.join(tmp, label + ".db"),
+                           log=False)
+            if func is None:
+                insert = timeit(dbs._upsert_data, value_dict)
+                update = timeit(dbs._upsert_data, value_dict)
+            else:
+                insert = timeit(func, dbs, value_dict)
+                update = timeit(func, dbs, value_dict)
+            print("%-10s insert: %8.3fs (%9.0f rows/s)  "
+                  "update: %8.3fs (%9.0f rows/s)" %
+                  (label, insert, total / insert, update, total / update))
@@ -0,0 +1,87 @@
+"""Ingest validation: per row cost of the checks on a full backfill of a
+synthetic market, and the faults found once injected into a daily update.
+Exits with an error over Validator.budget or if a fault is missed.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_validate [years] [budget_us]
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+import pandas as pd
+from pystocks.validate import Validator
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+
+def faulty(frame):
+    """frame with a spike, a zero low, a stale run and a repeated date, and
+    the dates where they are expected"""
+    frame = frame.copy()
+    dates = frame.index
+    frame.loc[dates[3], ['Close', 'Adj Close']] *= 1.8
+    frame.loc[dates[6], 'Low'] = 0.
+    frame.loc[dates[10]:dates[16], 'Close'] = frame.loc[dates[10], 'Close']
+    expected = {'jump': [dates[3]], 'nonpositive': [dates[6]],
+                'stale': list(dates[14:17]), 'duplicate': [dates[12]]}
+    return pd.concat([frame, frame.iloc[[12]]]), expected
+
+
+if __name__ == "__main__":
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    budget = (float(sys.argv[2]) * 1e-6 if len(sys.argv) > 2 else
+              Validator.budget)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        market = SyntheticMarket(years=years)
+        update = market.dates[-25]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbs = make_db(os.path.join(tmp, "validate.db"), market,
+                          until=market.dates[-26], workers=1)
+        backfill = time.perf_counter() - start
+        stats = dict(dbs.validator.stats)
+        clean = len(dbs.validator.flags())
+
+        #  Daily update with faults: GGAL prints, and a YPF ADR off the CCL.
+        frames = {'GGAL': faulty(market.frame('GGAL').loc[update:])}
+        ypf = market.frame('YPF_usa').loc[update:].copy()
+        ypf.loc[ypf.index[-5]:, ['Close', 'Adj Close']] *= 1.5
+        expected = dict(frames['GGAL'][1])
+        market.install(dbs)
+        fetch = dbs._fetch_yahoo
+
+        def fetch_faulty(ticker, start, end, category='y', timeout=None):
+            if ticker == 'GGAL':
+                return frames['GGAL'][0]
+            if ticker == 'YPF_usa':
+                return ypf
+            return fetch(ticker, start, end, category)
+
+        dbs._fetch_yahoo = fetch_faulty
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbs.update_db(workers=1)
+        flags = dbs.validator.flags(start=update.strftime("%Y-%m-%d"))
+        dbs.close()
+
+    cost = stats['seconds'] / stats['rows']
+    print("backfill: %d rows in %.3fs, validation %.3fs (%.2f us a row, "
+          "budget %.2f)" % (stats['rows'], backfill, stats['seconds'],
+                            cost * 1e6, budget * 1e6))
+    print("false flags on clean data: %d" % clean)
+    print(flags.groupby(['ticker', 'rule']).size().to_string())
+
+    errors = []
+    if cost > budget:
+        errors.append("validation over the budget")
+    for rule, dates in expected.items():
+        found = flags.loc[(flags['ticker'] == 'ggal') &
+                          (flags['rule'] == rule), 'date']
+        if not set(dates) <= set(found):
+            errors.append("missed " + rule + " on ggal")
+    if not (flags.loc[flags['ticker'] == 'ypf_usa', 'rule'] == 'ccl').any():
+        errors.append("missed the ccl mismatch of ypf_usa")
+    if errors:
+        raise SystemExit("\n".join(errors))
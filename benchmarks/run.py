@@ -0,0 +1,276 @@
+"""Timed scenarios on a synthetic database, compared against a baseline.
+
+Results are written to JSON. When a baseline exists every scenario is
+reported with its ratio to it, and the run exits with an error if any is
+slower than the tolerance allows.
+
+Usage (from the repo root):
+    python -m benchmarks.run [--tickers N] [--years N] [--repeat N]
+                             [--scenario NAME ...] [--output PATH]
+                             [--baseline PATH] [--save-baseline]
+                             [--tolerance FRACTION]
+"""
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+from pystocks.dbstocks import dispose_engines
+from pystocks.stats import DBstats
+from benchmarks.synthetic import SyntheticMarket, make_db
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+class Context:
+    """Synthetic market and the databases shared by the scenarios"""
+
+    def __init__(self, market, tmp):
+        self.market = market
+        self.tmp = tmp
+        self._count = 0
+
+        #  Full history, and the same db one business day behind.
+        self.full = self.path("full.db")
+        self.prev = self.path("prev.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            make_db(self.full, market).close()
+            make_db(self.prev, market, until=market.dates[-2]).close()
+
+    def path(self, name=None):
+        """Path to a new db file in the scratch dir"""
+        if name is None:
+            self._count += 1
+            name = "run%04d.db" % self._count
+        return os.path.join(self.tmp, name)
+
+    def copy(self, source):
+        """Consistent copy of source, returns its path"""
+        path = self.path()
+        src, dst = sqlite3.connect(source), sqlite3.connect(path)
+        with dst:
+            src.backup(dst)
+        src.close()
+        dst.close()
+        return path
+
+    def stats(self, path=None):
+        """DBstats over a stub sourced DBstocks on path (default full)"""
+        dbs = self.market.open(self.full if path is None else path)
+        return DBstats(dbs)
+
+
+#  Scenarios return (setup, run): setup() builds the state for one timed
+#  run(state) call and is not timed itself.
+
+def full_update(ctx):
+    return (lambda: ctx.market.open(ctx.path()),
+            lambda dbs: dbs.update_db())
+
+
+def incremental_update(ctx):
+    return (lambda: ctx.market.open(ctx.copy(ctx.prev)),
+            lambda dbs: dbs.update_db())
+
+
+def read_ticker(ctx):
+    dbs = ctx.market.open(ctx.full)
+    return (lambda: dbs,
+            lambda dbs: dbs.get_prices('GGAL', '1991-01-01'))
+
+
+def panel_load(ctx):
+    stats = ctx.stats()
+    return lambda: stats, lambda stats: stats.get_yprices()
+
+
+def ccl(ctx):
+    dbs = ctx.market.open(ctx.full)
+
+    def setup():
+        dbs.ccl_engine.clear()
+        return dbs
+    return setup, lambda dbs: dbs.get_ccl()
+
+
+def readjust(ctx):
+    when = ctx.market.dates[-30]
+
+    def run(dbs):
+        for ticker in dbs.dtickers['y']:
+            dbs.add_events(ticker, [(when, 'dividend', 0.1)], full=True)
+    return lambda: ctx.market.open(ctx.copy(ctx.full)), run
+
+
+def _usd_stats(ctx):
+    stats = ctx.stats()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats.get_yprices()
+        stats.get_ccl()
+    return stats
+
+
+def var_since_full(ctx):
+    stats = _usd_stats(ctx)
+
+    def setup():
+        stats.since_stats = None
+        return stats
+    return setup, lambda stats: stats.compute_var_since()
+
+
+def var_since_incremental(ctx):
+    stats = _usd_stats(ctx)
+    data_usd = stats.data_usd
+
+    def setup():
+        stats.since_stats = None
+        stats.data_usd = data_usd.iloc[:-1]
+        stats.compute_var_since()
+        stats.data_usd = data_usd
+        return stats
+    return setup, lambda stats: stats.compute_var_since()
+
+
+def stats_update(ctx):
+    stats = ctx.stats()
+
+    def setup():
+        stats.since_stats = None
+        stats.dbs.ccl_engine.clear()
+        return stats
+    return setup, lambda stats: stats.update()
+
+
+scenarios = {'full_update': full_update,
+             'incremental_update': incremental_update,
+             'read_ticker': read_ticker,
+             'panel_load': panel_load,
+             'ccl': ccl,
+             'readjust': readjust,
+             'var_since_full': var_since_full,
+             'var_since_incremental': var_since_incremental,
+             'stats_update': stats_update}
+
+
+def timeit(setup, run, repeat):
+    """Seconds taken by each of repeat run(setup()) calls. Prints of the
+    code under test are discarded."""
+    times = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def run_all(market, names, repeat):
+    """{scenario: {best, median, times}}"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = Context(market, tmp)
+        for name in names:
+            times = timeit(*scenarios[name](ctx), repeat=repeat)
+            results[name] = {'best': min(times),
+                             'median': float(np.median(times)),
+                             'times': times}
+            print("%-22s best: %9.4fs  median: %9.4fs" %
+                  (name, results[name]['best'], results[name]['median']))
+        dispose_engines()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints every scenario against the baseline. Returns the names of
+    those slower than baseline * (1 + tolerance)."""
+    if baseline['config'] != results['config']:
+        print("WARN: baseline config differs: " + str(baseline['config']))
+    slower = []
+    print("%-22s %10s %10s %7s" % ("scenario", "best", "baseline", "ratio"))
+    for name, res in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            print("%-22s %9.4fs %10s" % (name, res['best'], "-"))
+            continue
+        ratio = res['best'] / base['best']
+        flag = ""
+        if ratio > 1 + tolerance:
+            slower.append(name)
+            flag = "  REGRESSION"
+        print("%-22s %9.4fs %9.4fs %6.2fx%s" %
+              (name, res['best'], base['best'], ratio, flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--tickers", type=int, default=None,
+                        help="number of BYMA tickers (default all)")
+    parser.add_argument("--years", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=None,
+                        help="rows per ticker, overrides --years")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", action="append", choices=scenarios,
+                        help="run only these (default all)")
+    parser.add_argument("--output",
+                        default=os.path.join(here, "results.json"))
+    parser.add_argument("--baseline",
+                        default=os.path.join(here, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown before a regression")
+    args = parser.parse_args(argv)
+
+    market = SyntheticMarket(ntickers=args.tickers, years=args.years,
+                             rows=args.rows, seed=args.seed)
+    config = {'tickers': len(market.dtickers['y']),
+              'rows': len(market.dates),
+              'seed': args.seed,
+              'repeat': args.repeat}
+    print("Synthetic db: %d BYMA tickers, %d rows each, %d rows in total" %
+          (config['tickers'], config['rows'], market.nrows()))
+
+    results = {'config': config,
+               'versions': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'pandas': pd.__version__,
+                            'sqlalchemy': db.__version__,
+                            'sqlite': sqlite3.sqlite_version},
+               'machine': platform.platform(),
+               'scenarios': run_all(market, args.scenario or list(scenarios),
+                                    args.repeat)}
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Baseline saved to " + args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at " + args.baseline + ", use --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    slower = compare(results, baseline, args.tolerance)
+    if slower:
+        print("Regressions: " + ", ".join(slower))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""Offline stand-ins for the Y! data source"""
+import time
+import numpy as np
+import pandas as pd
+
+
+def canned_frame(nrows, seed=0, start="1993-01-04"):
+    """DataFrame shaped like yf.download() output"""
+    rng = np.random.default_rng(seed)
+    close = 100. * np.exp(np.cumsum(rng.normal(0, 0.02, nrows)))
+    index = pd.bdate_range(start, periods=nrows, name="Date")
+    return pd.DataFrame({'Open': close,
+                         'High': close * 1.01,
+                         'Low': close * 0.99,
+                         'Close': close,
+                         'Adj Close': close,
+                         'Volume': rng.integers(1000, 100000, nrows)},
+                        index=index)
+
+
+def stub_fetch(latency, nrows):
+    """Returns a fetch function serving canned frames after latency
+    seconds"""
+    def fetch(ticker, start, end, category, timeout=None):
+        time.sleep(latency)
+        return canned_frame(nrows, seed=len(ticker))
+    return fetch
@@ -0,0 +1,168 @@
+"""Deterministic synthetic market and dbprices.db generator.
+
+Prices are random walks seeded by ticker name, so the same configuration
+always produces the same database. NYSE prices are derived from their
+BYMA pair and a common CCL series, which keeps DBstocks.get_ccl
+meaningful, and the BCRA series follows the same walk.
+
+Usage (from the repo root):
+    python -m benchmarks.synthetic path [tickers] [years] [layout]
+"""
+import sys
+import zlib
+import numpy as np
+import pandas as pd
+from pystocks.dbstocks import DBstocks
+from pystocks.ccl import CCL
+
+
+class SyntheticMarket:
+    """Synthetic history for the DBstocks tickers. ntickers is the number
+    of BYMA tickers: the list in DBstocks.dtickers['y'] is cut or extended
+    with SYNnnn tickers, always keeping those other code depends on. rows,
+    if given, overrides years (252 business days each)."""
+
+    #  BYMA tickers required by the CCL pairs and DBstats.
+    required = sorted({i[0] for i in CCL.pairs.values()} |
+                      {'VALO', 'GAMI', 'GCLA', 'CGPA2'})
+
+    def __init__(self, ntickers=None, years=20, rows=None, end="2020-06-30",
+                 seed=0):
+        byma = list(DBstocks.dtickers['y'])
+        if ntickers is not None:
+            keep = [i for i in byma if i in self.required]
+            rest = [i for i in byma if i not in self.required]
+            rest += ['SYN%04d' % i
+                     for i in range(max(0, ntickers - len(byma)))]
+            byma = keep + rest[:max(0, ntickers - len(keep))]
+        self.dtickers = {'y': byma,
+                         'yusa': list(DBstocks.dtickers['yusa']),
+                         'bcra': list(DBstocks.dtickers['bcra'])}
+        self.seed = seed
+        if rows is None:
+            rows = int(years * 252)
+        self.dates = pd.bdate_range(end=end, periods=rows, name="Date")
+
+        #  Common CCL walk, the official rate trails it.
+        rng = self._rng("CCL")
+        self.ccl = 3. * np.exp(np.cumsum(rng.normal(0.0004, 0.006, rows)))
+        self.official = self.ccl * np.exp(rng.normal(-0.05, 0.02, rows))
+
+        #  {ticker: DataFrame shaped like yf.download()}
+        self._frames = {}
+
+    def _rng(self, name):
+        return np.random.default_rng([self.seed, zlib.crc32(name.encode())])
+
+    def _frame(self, close, volume):
+        return pd.DataFrame({'Open': close * 0.998,
+                             'High': close * 1.012,
+                             'Low': close * 0.988,
+                             'Close': close,
+                             'Adj Close': close * 0.97,
+                             'Volume': volume}, index=self.dates)
+
+    def frame(self, ticker):
+        """Full history of ticker, as yf.download() would return it"""
+        if ticker in self._frames:
+            return self._frames[ticker]
+        rng = self._rng(ticker)
+        volume = rng.integers(1000, 1000000, len(self.dates))
+        if ticker in self.dtickers['yusa']:
+            local, ratio = CCL.pairs[ticker]
+            local = self.frame(local)['Close'].to_numpy()
+            noise = np.exp(rng.normal(0, 0.004, len(self.dates)))
+            close = local * ratio / self.ccl * noise
+        else:
+            close = 10. * np.exp(np.cumsum(rng.normal(0.0003, 0.025,
+                                                      len(self.dates))))
+        self._frames[ticker] = self._frame(close, volume)
+        return self._frames[ticker]
+
+    def bars(self, ticker, days=None, minutes=1):
+        """Intraday bars of ticker over its last days sessions (all of them
+        by default), 11:00 to 17:00 in minutes bars. Each session is a
+        Brownian bridge from the previous close to the daily close."""
+        daily = self.frame(ticker)
+        if days is not None:
+            daily = daily.iloc[-days - 1:]
+        close = daily['Close'].to_numpy()
+        steps = 360 // minutes
+        ndays = len(close) - 1
+        rng = self._rng(ticker + "_bars")
+        walk = np.cumsum(rng.normal(0, 0.02 / np.sqrt(steps),
+                                    (ndays, steps)), axis=1)
+        t = np.arange(1, steps + 1) / steps
+        target = np.log(close[1:] / close[:-1])[:, None]
+        path = close[:-1, None] * np.exp(walk - t * (walk[:, -1:] - target))
+        start = np.hstack([close[:-1, None], path[:, :-1]])
+        spread = np.abs(rng.normal(0, 0.001, (2, ndays, steps)))
+        volume = daily['Volume'].to_numpy()[1:, None] / steps
+        ts = (daily.index[1:].to_numpy()[:, None] + np.timedelta64(11, 'h') +
+              np.arange(steps) * np.timedelta64(minutes, 'm'))
+        return pd.DataFrame(
+            {'Open': start.ravel(),
+             'High': (np.maximum(start, path) * (1 + spread[0])).ravel(),
+             'Low': (np.minimum(start, path) * (1 - spread[1])).ravel(),
+             'Close': path.ravel(),
+             'Volume': np.round(volume * rng.uniform(
+                                        0.5, 1.5, (ndays, steps))).ravel()},
+            index=pd.DatetimeIndex(ts.ravel(), name="Datetime"))
+
+    def nrows(self):
+        """Number of rows of a full update"""
+        return (len(self.dates) *
+                sum(len(self.dtickers[i]) for i in ('y', 'yusa', 'bcra')))
+
+    def install(self, dbs, until=None):
+        """Replaces the Y! and BCRA sources of dbs with offline stubs
+        serving data up to until (default, the last date)."""
+        until = self.dates[-1] if until is None else pd.Timestamp(until)
+        dbs.dtickers = self.dtickers
+
+        def fetch_yahoo(ticker, start, end, category='y', timeout=None):
+            data = self.frame(ticker)
+            if start is not None:
+                data = data.loc[pd.Timestamp(start):]
+            if end is not None:
+                data = data.loc[:pd.Timestamp(end)]
+            return data.loc[:until]
+
+        def get_dolar_bcra(fuente='dolar_bcra_a3500', start=None, end=None,
+                           timeout=None):
+            dolar = pd.DataFrame({'valor': self.official}, index=self.dates)
+            if start is not None:
+                dolar = dolar.loc[pd.Timestamp(start):]
+            if end is not None:
+                dolar = dolar.loc[:pd.Timestamp(end)]
+            dolar = dolar.loc[:until]
+            return {fuente: dbs._frame_to_rows(dolar, {'valor': 'close'})}
+
+        dbs._fetch_yahoo = fetch_yahoo
+        dbs.get_dolar_bcra = get_dolar_bcra
+        return dbs
+
+    def open(self, path, until=None, **kwargs):
+        """DBstocks on path with the stub sources installed"""
+        kwargs.setdefault('log', False)
+        return self.install(DBstocks(dbname=path, **kwargs), until=until)
+
+
+def make_db(path, market=None, until=None, layout="wide", workers=None):
+    """Fills path with the market history up to until. Returns the
+    DBstocks handle."""
+    if market is None:
+        market = SyntheticMarket()
+    dbs = market.open(path, until=until, layout=layout)
+    dbs.update_db(workers=workers)
+    return dbs
+
+
+if __name__ == "__main__":
+    path = sys.argv[1]
+    ntickers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    years = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    layout = sys.argv[4] if len(sys.argv) > 4 else "wide"
+    market = SyntheticMarket(ntickers=ntickers, years=years)
+    make_db(path, market, layout=layout)
+    print("%s: %d rows" % (path, market.nrows()))
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+
+class Adjuster:
+    """Local corporate action adjustment. Dividend and split events are
+    stored per ticker in a single table and the *_h columns of a ticker
+    are recomputed from its raw columns in one cumulative factor pass.
+
+    An event dated d adjusts the rows before d: a dividend D by
+    1 - D / (last close before d), a split of ratio r (new shares per old
+    share) by 1 / r, and volnom_h by r. Once a ticker has events, only rows
+    before the latest changed event need to be rewritten.
+
+    Rows before the first stored event of a ticker keep the adjustments of
+    their source, which may include events the engine doesn't know about
+    (e.g. dividends older than the Y! history). They are only rewritten
+    with full=True, for sources without adjustments of their own."""
+
+    #  Events table: (ticker, date, kind, value)
+    table = "corporate_actions"
+
+    kinds = ('dividend', 'split')
+
+    #  Adjusted column: raw column
+    prices = {'start_h': 'start', 'max_h': 'max', 'min_h': 'min',
+              'close_h': 'close'}
+
+    def __init__(self, dbs, splits=False):
+
+        #  DBstocks handle
+        self.dbs = dbs
+
+        #  Apply split events to prices and volumes. Off by default: Y!
+        #  Close, as every source here, is already split adjusted.
+        self.splits = splits
+
+    def create_table(self):
+        """Creates the events table if needed"""
+        return self.dbs._ensure_table(self.table,
+                                      "ticker TEXT, date TEXT, kind TEXT, "
+                                      "value REAL, "
+                                      "PRIMARY KEY (ticker, date, kind)")
+
+    def get_events(self, ticker):
+        """Returns a DataFrame with the date, kind and value of the events of
+        ticker, sorted by date"""
+        if not self.dbs.has_table(self.table):
+            return pd.DataFrame(columns=['date', 'kind', 'value'])
+        with self.dbs.engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                'SELECT date, kind, value FROM "' + self.table + '" '
+                'WHERE ticker = ? ORDER BY date', (ticker.lower(),)).fetchall()
+        return pd.DataFrame(rows, columns=['date', 'kind', 'value'])
+
+    def tickers(self):
+        """Tickers with stored events"""
+        if not self.dbs.has_table(self.table):
+            return []
+        with self.dbs.engine.connect() as conn:
+            return [i[0] for i in conn.exec_driver_sql(
+                'SELECT DISTINCT ticker FROM "' + self.table + '"')]
+
+    def add_events(self, ticker, events, recompute=True, full=False):
+        """Stores events, a DataFrame (or list of tuples) with date, kind and
+        value, and recomputes the rows they affect (see recompute() for
+        full). Returns the counts of rewritten rows, as _upsert_rows."""
+        events = pd.DataFrame(events, columns=['date', 'kind', 'value'])
+        events['date'] = pd.to_datetime(events['date']).dt.strftime(
+                                                                "%Y-%m-%d")
+        unknown = set(events['kind']) - set(self.kinds)
+        if unknown:
+            raise ValueError("Unknown event kinds " + str(sorted(unknown)))
+
+        #  Only new or revised events move the adjustment.
+        known = self.get_events(ticker).set_index(['date', 'kind'])['value']
+        merged = events.join(known.rename('known'), on=['date', 'kind'])
+        changed = merged[~np.isclose(merged['value'],
+                                     merged['known'].astype(float))]
+        if changed.empty:
+            return {'inserted': 0, 'updated': 0, 'failed': 0}
+
+        self.create_table()
+        rows = [(ticker.lower(),) + tuple(i) for i in
+                changed[['date', 'kind', 'value']].itertuples(index=False)]
+        with self.dbs.engine.begin() as conn:
+            conn.exec_driver_sql(
+                self.dbs._upsert_sql(self.table,
+                                     ['ticker', 'date', 'kind', 'value'],
+                                     keys=('ticker', 'date', 'kind')),
+                rows)
+        if not recompute:
+            return {'inserted': 0, 'updated': 0, 'failed': 0}
+
+        #  The first events take over the rows from the source.
+        end = changed['date'].max() if len(known) else None
+        return self.recompute(ticker, end=end, full=full)
+
+    def factors(self, dates, close, events):
+        """Cumulative (price, volume) factors for rows with sorted %Y-%m-%d
+        dates and raw close prices"""
+        if events.empty:
+            return np.ones(len(dates)), np.ones(len(dates))
+        when = events['date'].to_numpy(dtype=str)
+        value = events['value'].to_numpy(dtype=float)
+        dividend = (events['kind'] == 'dividend').to_numpy()
+        split = (events['kind'] == 'split').to_numpy() & self.splits
+
+        #  Close of the last row before each event.
+        last = np.searchsorted(dates, when, side='left') - 1
+        previous = np.where(last >= 0, close[np.maximum(last, 0)], np.nan)
+
+        price = np.ones(len(events))
+        volume = np.ones(len(events))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            price[dividend] = 1. - value[dividend] / previous[dividend]
+            price[split] = 1. / value[split]
+        volume[split] = value[split]
+        price[~np.isfinite(price) | (price <= 0)] = 1.
+
+        #  Row factor: product of the events dated after the row.
+        after = np.searchsorted(when, dates, side='right')
+        price = np.append(np.cumprod(price[::-1])[::-1], 1.)
+        volume = np.append(np.cumprod(volume[::-1])[::-1], 1.)
+        return price[after], volume[after]
+
+    def recompute(self, ticker, start=None, end=None, full=False):
+        """Rewrites the *_h columns of the rows of ticker dated from start
+        and before end (default all) in bulk. Rows before the first event
+        of ticker are left as the source adjusted them, unless full.
+        Returns _upsert_rows counts."""
+        prices = self.dbs._read_prices(ticker.lower(), "0001-01-01",
+                                       "9999-12-31", dt_index=False)
+        dates = prices['date'].str.slice(0, 10).to_numpy(dtype=str)
+        events = self.get_events(ticker)
+        price, volume = self.factors(dates, prices['close'].to_numpy(),
+                                     events)
+
+        rewrite = np.ones(len(dates), dtype=bool)
+        if not full:
+            if events.empty:
+                return {'inserted': 0, 'updated': 0, 'failed': 0}
+            rewrite &= dates >= events['date'].min()
+        if start is not None:
+            rewrite &= dates >= pd.Timestamp(start).strftime("%Y-%m-%d")
+        if end is not None:
+            rewrite &= dates < pd.Timestamp(end).strftime("%Y-%m-%d")
+        if not rewrite.any():
+            return {'inserted': 0, 'updated': 0, 'failed': 0}
+
+        adjusted = pd.DataFrame(index=pd.DatetimeIndex(dates[rewrite]))
+        price, volume = price[rewrite], volume[rewrite]
+        for column, raw in self.prices.items():
+            adjusted[column] = prices[raw].to_numpy()[rewrite] * price
+        adjusted['volnom_h'] = prices['volnom'].to_numpy()[rewrite] * volume
+        adjusted['vol_h'] = prices['vol'].to_numpy()[rewrite]
+        columns, rows = self.dbs._frame_to_rows(
+                            adjusted, {i: i for i in adjusted.columns})
+        return self.dbs._upsert_rows(ticker, columns, rows)
+
+    def recompute_all(self, tickers=None, start=None, full=False):
+        """recompute() for tickers, default those with events. Returns
+        {ticker: counts}"""
+        if tickers is None:
+            tickers = self.tickers()
+        return {ticker: self.recompute(ticker, start=start, full=full)
+                for ticker in tickers}
+
+    def fetch_yahoo(self, ticker, category='y'):
+        """Dividend events of ticker from Y!. Splits are left out, Y! prices
+        are already split adjusted."""
+        import yfinance as yf
+        actions = yf.Ticker(self.dbs.yticker(ticker, category)).dividends
+        actions = actions[actions > 0]
+        return pd.DataFrame({'date': pd.DatetimeIndex(actions.index)
+                                       .strftime("%Y-%m-%d"),
+                             'kind': 'dividend',
+                             'value': actions.to_numpy(dtype=float)})
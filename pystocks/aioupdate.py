@@ -0,0 +1,186 @@
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    """asyncio token bucket: rate tokens per second, bursts of capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else
+                              max(1., rate))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a token is available and takes it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1.:
+                    self.tokens -= 1.
+                    return None
+                await asyncio.sleep((1. - self.tokens) / self.rate)
+
+
+class AsyncUpdater:
+    """Updates a DBstocks db from Y! and BCRA concurrently.
+
+    Each source has its own concurrency limit and token bucket. Every
+    download has a timeout, passed to the download itself, and is retried
+    with exponential backoff. The blocking downloads run on an executor of
+    the update, abandoned without waiting when the budget runs out, and db
+    writes are serialized, one ticker at a time, local adjustments
+    included. update() returns a report dict per ticker."""
+
+    #  Concurrent downloads per source.
+    limits = {'y': 4, 'yusa': 4, 'bcra': 1}
+
+    #  Requests per second per source.
+    rates = {'y': 2., 'yusa': 2., 'bcra': 1.}
+
+    def __init__(self, dbs, limits=None, rates=None, timeout=60.,
+                 retries=3, backoff=1., budget=None, fetchers=None):
+
+        #  DBstocks handle
+        self.dbs = dbs
+
+        self.limits = dict(self.limits, **(limits or {}))
+        self.rates = dict(self.rates, **(rates or {}))
+
+        #  Seconds per download, retries after the first attempt and base
+        #  of the exponential backoff.
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        #  Seconds for the whole update, None for no limit.
+        self.budget = budget
+
+        #  {source: fetch(ticker, start, end, timeout)} returning (columns,
+        #  rows) as DBstocks._frame_to_rows. Defaults download from Y! and
+        #  BCRA.
+        self.fetchers = {'y': self._fetch_yahoo('y'),
+                         'yusa': self._fetch_yahoo('yusa'),
+                         'bcra': self._fetch_bcra}
+        self.fetchers.update(fetchers or {})
+
+    def _fetch_yahoo(self, category):
+        def fetch(ticker, start, end, timeout=None):
+            data = self.dbs._fetch_yahoo(ticker, start, end,
+                                         category=category, timeout=timeout)
+            return self.dbs._yahoo_rows(data)
+        return fetch
+
+    def _fetch_bcra(self, ticker, start, end, timeout=None):
+        return self.dbs.get_dolar_bcra(fuente=ticker, start=start, end=end,
+                                       timeout=timeout)[ticker]
+
+    def run(self, start=None, end=None):
+        """Blocking version of update()"""
+        return asyncio.run(self.update(start=start, end=end))
+
+    async def update(self, start=None, end=None):
+        """Updates every ticker that needs it. Returns {ticker: report}"""
+        #  Room for a hung download per attempt of every concurrent slot,
+        #  so retries never queue behind them.
+        workers = sum(self.limits[i] for i in self.fetchers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers * (self.retries + 1) + 1,
+            thread_name_prefix="pystocks-async")
+        try:
+            return await self._update(start=start, end=end)
+        finally:
+            #  Downloads still running (timed out, or past the budget) are
+            #  left to their own timeouts instead of holding the update.
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _update(self, start=None, end=None):
+        self._semaphores = {i: asyncio.Semaphore(self.limits[i])
+                            for i in self.fetchers}
+        self._buckets = {i: TokenBucket(self.rates[i])
+                         for i in self.fetchers}
+        self._write_lock = asyncio.Lock()
+
+        #  Tickers with local adjustments, recomputed after their writes.
+        self._adjusted = set(self.dbs.adjuster.tickers())
+
+        report = {}
+        tasks = {}
+        for source in self.fetchers:
+            starts = self.dbs.get_start_dates(source, start=start)
+            for ticker, since in starts.items():
+                report[ticker] = {'source': source,
+                                  'status': 'pending',
+                                  'attempts': 0,
+                                  'elapsed': 0.,
+                                  'inserted': 0,
+                                  'updated': 0,
+                                  'failed': 0,
+                                  'error': None}
+                task = asyncio.ensure_future(
+                    self._update_ticker(source, ticker, since, end,
+                                        report[ticker]))
+                tasks[task] = ticker
+
+        if tasks:
+            done, pending = await asyncio.wait(list(tasks),
+                                               timeout=self.budget)
+            for task in pending:
+                task.cancel()
+                report[tasks[task]]['status'] = 'cancelled'
+                report[tasks[task]]['error'] = "Time budget exhausted"
+            if pending:
+                await asyncio.wait(pending)
+        return report
+
+    async def _update_ticker(self, source, ticker, start, end, report):
+        loop = asyncio.get_running_loop()
+        clock = time.monotonic()
+        async with self._semaphores[source]:
+            for attempt in range(self.retries + 1):
+                await self._buckets[source].acquire()
+                report['attempts'] = attempt + 1
+                try:
+                    rows = await asyncio.wait_for(
+                        loop.run_in_executor(self._executor,
+                                             self.fetchers[source], ticker,
+                                             start, end, self.timeout),
+                        timeout=self.timeout)
+                    break
+                except Exception as error:
+                    if isinstance(error, asyncio.TimeoutError):
+                        report['status'] = 'timeout'
+                        report['error'] = ("No answer in " +
+                                           str(self.timeout) + " s")
+                    else:
+                        report['status'] = 'error'
+                        report['error'] = repr(error)
+                    if attempt == self.retries:
+                        report['elapsed'] = time.monotonic() - clock
+                        return report
+                    await asyncio.sleep(self.backoff * 2 ** attempt *
+                                        (1. + random.random() / 2.))
+
+        async with self._write_lock:
+            counts = await loop.run_in_executor(
+                self._executor, self._write, ticker, rows, start)
+        report.update(counts[ticker])
+        report['status'] = 'ok' if not report['failed'] else 'error'
+        report['error'] = None
+        report['elapsed'] = time.monotonic() - clock
+        return report
+
+    def _write(self, ticker, rows, start):
+        """Upserts the rows of ticker and, as DBstocks.update_db, recomputes
+        its *_h columns from start if it has local adjustments"""
+        counts = self.dbs._upsert_data({ticker: rows})
+        if ticker.lower() in self._adjusted:
+            self.dbs.adjuster.recompute(ticker, start=start)
+        return counts
@@ -0,0 +1,242 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+
+class BarStore:
+    """Append-only store of intraday bars (1 minute, 5 minutes...),
+    timestamp keyed, next to the daily db.
+
+    Bars are partitioned by ticker and month: path/ticker/YYYY-MM.bars
+    files of fixed size records (ts, start, max, min, close, volnom), in
+    timestamp order. Appends only add bars newer than the last stored one,
+    so ingestion is a single sequential write per partition and reads are
+    memory maps sliced with binary searches. Timestamps are naive,
+    exchange local time (tz): tz-aware bars are converted on append.
+
+    Range reads downsample on the fly to daily ('D'), weekly ('W', labeled
+    by their Monday) or N minute ('5min') OHLCV bars, in one vectorized
+    pass."""
+
+    #  Record of a bar, columns named as the daily tables.
+    dtype = np.dtype([('ts', '<i8'), ('start', '<f8'), ('max', '<f8'),
+                      ('min', '<f8'), ('close', '<f8'), ('volnom', '<f8')])
+    columns = ['start', 'max', 'min', 'close', 'volnom']
+
+    #  Nanoseconds in a day.
+    day = 86400 * 10**9
+
+    #  Other accepted names of the columns of appended frames.
+    aliases = {'open': 'start', 'high': 'max', 'low': 'min',
+               'volume': 'volnom'}
+
+    def __init__(self, path, tz="America/Argentina/Buenos_Aires"):
+
+        #  Root directory of the partitions.
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        meta = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                stored = json.load(f)
+            if stored['dtype'] != self.dtype.descr:
+                stored['dtype'] = [tuple(i) for i in stored['dtype']]
+                if stored['dtype'] != self.dtype.descr:
+                    raise ValueError("Bars in " + self.path + " have "
+                                     "another record layout")
+        else:
+            with open(meta, "w") as f:
+                json.dump({'version': 1, 'dtype': self.dtype.descr}, f)
+
+        #  Exchange time zone, tz-aware bars are converted to it.
+        self.tz = tz
+
+        #  {ticker: last stored ts}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def tickers(self):
+        """Tickers with stored bars, lower case"""
+        return sorted(i for i in os.listdir(self.path)
+                      if os.path.isdir(os.path.join(self.path, i)))
+
+    def months(self, ticker):
+        """Stored months of ticker, as YYYY-MM strings"""
+        folder = os.path.join(self.path, ticker.lower())
+        if not os.path.isdir(folder):
+            return []
+        return sorted(i[:-5] for i in os.listdir(folder)
+                      if i.endswith(".bars"))
+
+    def _file(self, ticker, month):
+        return os.path.join(self.path, ticker.lower(), month + ".bars")
+
+    def _records(self, ticker, month):
+        """Memory map of the whole records of a partition"""
+        path = self._file(ticker, month)
+        count = os.path.getsize(path) // self.dtype.itemsize
+        if not count:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(path, dtype=self.dtype, mode='r', shape=(count,))
+
+    def last(self, ticker):
+        """Timestamp (datetime64[ns]) of the last stored bar, None if
+        there is none"""
+        ticker = ticker.lower()
+        if ticker not in self._last:
+            months = self.months(ticker)
+            last = None
+            for month in months[::-1]:
+                records = self._records(ticker, month)
+                if len(records):
+                    last = int(records['ts'][-1])
+                    break
+            self._last[ticker] = last
+        last = self._last[ticker]
+        return None if last is None else np.datetime64(last, 'ns')
+
+    def _to_records(self, bars):
+        """Timestamp indexed DataFrame into sorted records, one per ts (the
+        last one). tz-aware timestamps, as Y! intraday bars, are stored as
+        exchange local time."""
+        bars = bars.rename(columns=lambda i: self.aliases.get(str(i).lower(),
+                                                              str(i).lower()))
+        missing = [i for i in self.columns if i not in bars.columns]
+        if missing:
+            raise ValueError("Bars without columns " + str(missing))
+        index = pd.DatetimeIndex(bars.index)
+        if index.tz is not None:
+            index = index.tz_convert(self.tz).tz_localize(None)
+        ts = index.as_unit('ns').asi8
+        records = np.empty(len(bars), dtype=self.dtype)
+        records['ts'] = ts
+        for column in self.columns:
+            records[column] = bars[column].to_numpy(dtype=float)
+        step = np.diff(ts)
+        if (step > 0).all():
+            return records
+        if (step < 0).any():
+            records = records[np.argsort(ts, kind='stable')]
+        keep = np.append(records['ts'][1:] != records['ts'][:-1], True)
+        return records[keep]
+
+    def append(self, ticker, bars):
+        """Appends bars, a timestamp indexed DataFrame with start, max, min,
+        close and volnom (or open, high, low, close, volume) columns. Bars
+        not newer than the last stored one are skipped. Returns
+        {'appended', 'skipped'}."""
+        ticker = ticker.lower()
+        records = self._to_records(bars)
+        with self._lock:
+            last = self.last(ticker)
+            skipped = 0
+            if last is not None:
+                new = records['ts'] > last.astype('int64')
+                skipped = len(records) - int(new.sum())
+                records = records[new]
+            if not len(records):
+                return {'appended': 0, 'skipped': skipped}
+
+            #  One sequential write per month touched.
+            os.makedirs(os.path.join(self.path, ticker), exist_ok=True)
+            month = records['ts'].astype('datetime64[ns]').astype(
+                                                        'datetime64[M]')
+            cuts = np.flatnonzero(month[1:] != month[:-1]) + 1
+            for part in np.split(np.arange(len(records)), cuts):
+                with open(self._file(ticker, str(month[part[0]])), "ab") as f:
+                    #  Drops the partial record an interrupted write left.
+                    whole = f.tell() // self.dtype.itemsize
+                    if whole * self.dtype.itemsize != f.tell():
+                        f.truncate(whole * self.dtype.itemsize)
+                        f.seek(0, os.SEEK_END)
+                    f.write(records[part[0]:part[-1] + 1].tobytes())
+            self._last[ticker] = int(records['ts'][-1])
+        return {'appended': len(records), 'skipped': skipped}
+
+    def read(self, ticker, start=None, end=None, freq=None):
+        """Bars of ticker from start to end (inclusive, dates or
+        timestamps; a date end takes the whole day) as a DataFrame indexed
+        by ts, downsampled to freq when given, see resample()"""
+        records = self.records(ticker, start, end)
+        if freq is not None:
+            return self.resample(records, freq)
+        return self._frame(records['ts'], {i: records[i]
+                                           for i in self.columns})
+
+    def records(self, ticker, start=None, end=None):
+        """Bars of ticker from start to end as a record array, see read()"""
+        ticker = ticker.lower()
+        if start is not None:
+            start = np.datetime64(pd.Timestamp(start).value, 'ns')
+        if end is not None:
+            day = not (isinstance(end, str) and ":" in end)
+            end = pd.Timestamp(end)
+            if day and end == end.normalize():
+                end = end + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+            end = np.datetime64(end.value, 'ns')
+        parts = []
+        for month in self.months(ticker):
+            first = np.datetime64(month, 'M')
+            if start is not None and first + 1 <= start.astype(
+                                                        'datetime64[M]'):
+                continue
+            if end is not None and first > end.astype('datetime64[M]'):
+                continue
+            records = self._records(ticker, month)
+            ts = records['ts']
+            lo = 0 if start is None else np.searchsorted(
+                                        ts, start.astype('int64'), 'left')
+            hi = len(ts) if end is None else np.searchsorted(
+                                        ts, end.astype('int64'), 'right')
+            parts.append(records[lo:hi])
+        if not parts:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def _frame(self, ts, values):
+        index = pd.DatetimeIndex(np.asarray(ts).astype('datetime64[ns]'),
+                                 name='ts')
+        return pd.DataFrame({i: np.array(values[i]) for i in self.columns},
+                            index=index)
+
+    def resample(self, records, freq):
+        """OHLCV bars of records (sorted, as from records()) per freq: 'D',
+        'W' or 'Nmin'. Buckets are labeled by their start."""
+        ts = records['ts']
+        if freq == 'D':
+            key = ts // self.day
+            label = key.astype('datetime64[D]')
+        elif freq == 'W':
+            #  Day 0, 1970-01-01, was a Thursday: weeks start 3 days before.
+            key = (ts // self.day + 3) // 7
+            label = (key * 7 - 3).astype('datetime64[D]')
+        elif str(freq).endswith('min'):
+            size = int(freq[:-3] or 1)
+            key = ts // (60 * 10**9 * size)
+            label = (key * size).astype('datetime64[m]')
+        else:
+            raise ValueError("Unknown freq " + str(freq) +
+                             ". Options: 'D', 'W', 'Nmin'")
+        if not len(records):
+            return self._frame(label, {i: np.zeros(0) for i in self.columns})
+        starts = np.append(0, np.flatnonzero(key[1:] != key[:-1]) + 1)
+        ends = np.append(starts[1:], len(records)) - 1
+        values = {'start': records['start'][starts],
+                  'max': np.fmax.reduceat(records['max'], starts),
+                  'min': np.fmin.reduceat(records['min'], starts),
+                  'close': records['close'][ends],
+                  'volnom': np.add.reduceat(np.nan_to_num(records['volnom']),
+                                            starts)}
+        return self._frame(label[starts], values)
+
+    def drop(self, ticker, before):
+        """Removes the months of ticker that end before the date before"""
+        month = np.datetime64(pd.Timestamp(before), 'M')
+        with self._lock:
+            for name in self.months(ticker):
+                if np.datetime64(name, 'M') < month:
+                    os.remove(self._file(ticker, name))
+            self._last.pop(ticker.lower(), None)
+        return None
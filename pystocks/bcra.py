@@ -0,0 +1,107 @@
+import io
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+class BCRASource:
+    """Conditional, cached download of a BCRA spreadsheet series.
+
+    The parsed series is kept as a compact .npz snapshot next to the
+    ETag / Last-Modified validators of the download. Later runs send a
+    conditional request and reuse the snapshot when the server answers
+    304 Not Modified. The workbook is parsed from memory and every cache
+    file is replaced atomically, so concurrent processes don't collide."""
+
+    #  Default cache directory.
+    path = os.path.join(os.path.expanduser("~"), ".cache", "pystocks")
+
+    def __init__(self, name, url, path=None, timeout=60, log=True):
+        self.name = name
+        self.url = url
+        if path is not None:
+            self.path = path
+        self.timeout = timeout
+        self.log = log
+
+    def _file(self, ext):
+        return os.path.join(self.path, self.name + ext)
+
+    def _replace(self, ext, write):
+        """Writes a cache file through a unique temp file and os.replace"""
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=self.name,
+                                   suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, self._file(ext))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return None
+
+    def load(self):
+        """Returns (series, validators) from the cache, (None, {}) if
+        missing or unreadable"""
+        try:
+            with open(self._file(".json")) as f:
+                validators = json.load(f)
+            with np.load(self._file(".npz")) as snap:
+                series = pd.Series(snap['values'],
+                                   index=pd.DatetimeIndex(
+                                       snap['dates'].view("datetime64[ns]"),
+                                       name='fecha'),
+                                   name='valor')
+        except (OSError, ValueError, KeyError):
+            return None, {}
+        return series, validators
+
+    def save(self, series, validators):
+        dates = series.index.values.astype("datetime64[ns]").view("int64")
+        self._replace(".npz", lambda f: np.savez_compressed(
+            f, dates=dates, values=series.to_numpy(dtype=float)))
+        self._replace(".json", lambda f: f.write(
+            json.dumps(validators).encode()))
+        return None
+
+    def parse(self, content):
+        """Parses the com3500 workbook from memory"""
+        usd = pd.read_excel(io.BytesIO(content), header=4)
+        valor = pd.to_numeric(usd.iloc[:, 3], errors='coerce')
+        dolar = pd.Series(valor.values,
+                          index=pd.to_datetime(usd.iloc[:, 2],
+                                               errors='coerce'),
+                          name='valor')
+        dolar.index.name = 'fecha'
+        dolar = dolar.loc[dolar.index.notna()].dropna()
+        return dolar.sort_index()
+
+    def series(self):
+        """Returns the whole series, downloading it only if it changed"""
+        cached, validators = self.load()
+        headers = {}
+        if cached is not None:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        import requests
+        res = requests.get(self.url, headers=headers, timeout=self.timeout)
+        if res.status_code == 304 and cached is not None:
+            if self.log:
+                print("[bcra] " + self.name + " not modified")
+            return cached
+        res.raise_for_status()
+
+        if self.log:
+            print("[bcra] Parsing " + self.name + " (" +
+                  str(len(res.content)) + " bytes)")
+        dolar = self.parse(res.content)
+        self.save(dolar, {'etag': res.headers.get('ETag'),
+                          'last_modified': res.headers.get('Last-Modified'),
+                          'url': self.url})
+        return dolar
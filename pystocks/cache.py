@@ -0,0 +1,208 @@
+import os
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+class PriceCache:
+    """In memory LRU cache of decoded price frames, keyed by db and
+    ticker (see DBstocks.cache_key).
+
+    Frames are the whole stored history of a ticker, date indexed, kept
+    along with the change log seq they are current to, so writes made by
+    other handles or processes since are found on every get. When path is
+    given, frames are also persisted as .npy files and memory mapped when
+    loaded back. Writes to the db only mark the tail of an entry as stale,
+    so the next read fetches just the new rows.
+
+    Persisted files are named by a version the .json file of the key
+    points to. They are written before the .json file is replaced
+    atomically, so readers never pair files of different writes."""
+
+    def __init__(self, max_bytes=256 * 2**20, path=None):
+
+        #  Memory budget for the frames held in memory.
+        self.max_bytes = max_bytes
+
+        #  Directory for the persisted frames, None to keep them in memory.
+        self.path = path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+        self._frames = OrderedDict()
+        self._nbytes = {}
+        self._seqs = {}
+        self._stale = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0,
+                      'misses': 0,
+                      'disk_hits': 0,
+                      'extensions': 0,
+                      'evictions': 0}
+
+    def __len__(self):
+        return len(self._frames)
+
+    def nbytes(self):
+        """Bytes used by the frames held in memory"""
+        return sum(self._nbytes.values())
+
+    def get(self, key, check=None):
+        """Returns (frame, stale) for key, frame None on a miss. stale is
+        the earliest date written since frame was cached, or None.
+        check(seq) returns the earliest date written since the change log
+        seq frame is current to, or None."""
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.stats['hits'] += 1
+                seq = self._seqs.get(key)
+        if frame is None:
+            frame, seq = self._load(key)
+            if frame is None:
+                with self._lock:
+                    self.stats['misses'] += 1
+                    return None, self._stale.get(key)
+            with self._lock:
+                self.stats['disk_hits'] += 1
+                self._remember(key, frame, seq)
+        since = check(seq) if check is not None else None
+        with self._lock:
+            if since is not None:
+                self._mark(key, since)
+            return frame, self._stale.get(key)
+
+    def put(self, key, frame, extended=False, stale=None, seq=None):
+        """Caches frame as the whole history of key. stale is the mark
+        returned by get() before frame was read, kept if a write marked
+        key again since. seq is the change log seq frame is current to."""
+        with self._lock:
+            if self._stale.get(key) == stale:
+                self._stale.pop(key, None)
+            if extended:
+                self.stats['extensions'] += 1
+            self._remember(key, frame, seq)
+            self._dump(key, frame, seq)
+        return None
+
+    def written(self, key, start):
+        """Marks rows of key from date start onwards as stale"""
+        with self._lock:
+            self._mark(key, start)
+        return None
+
+    def _mark(self, key, start):
+        start = pd.Timestamp(start)
+        if key in self._stale:
+            start = min(start, self._stale[key])
+        self._stale[key] = start
+        return None
+
+    def invalidate(self, key=None):
+        """Drops key, or every entry if key is None"""
+        with self._lock:
+            keys = list(self._frames) if key is None else [key]
+            for i in keys:
+                self._frames.pop(i, None)
+                self._nbytes.pop(i, None)
+                self._seqs.pop(i, None)
+                self._stale.pop(i, None)
+        if self.path is not None:
+            if key is None:
+                keys = [i[:-len(".json")] for i in os.listdir(self.path)
+                        if i.endswith(".json")]
+            for i in keys:
+                self._remove(i, self._meta(i))
+                if os.path.exists(self._file(i, ".json")):
+                    os.remove(self._file(i, ".json"))
+        return None
+
+    def _remember(self, key, frame, seq=None):
+        """Adds frame to the LRU, evicting the oldest entries over budget"""
+        self._frames[key] = frame
+        self._frames.move_to_end(key)
+        self._nbytes[key] = int(frame.memory_usage(index=True).sum())
+        self._seqs[key] = seq
+        while len(self._frames) > 1 and self.nbytes() > self.max_bytes:
+            old, _ = self._frames.popitem(last=False)
+            self._nbytes.pop(old)
+            self._seqs.pop(old, None)
+            self.stats['evictions'] += 1
+
+    def _file(self, key, ext, version=None):
+        if version is not None:
+            ext = "." + version + ext
+        return os.path.join(self.path, str(key) + ext)
+
+    def _meta(self, key):
+        """Contents of the .json file of key, None if missing or
+        unreadable"""
+        try:
+            with open(self._file(key, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove(self, key, meta):
+        """Removes the .npy files meta points to"""
+        if meta is None:
+            return None
+        for ext in (".index.npy", ".values.npy"):
+            try:
+                os.remove(self._file(key, ext, meta.get('version')))
+            except OSError:
+                pass
+        return None
+
+    def _dump(self, key, frame, seq=None):
+        """Writes frame as .npy files, int64 dates and float64 values,
+        under a new version, then points the .json file of key to it"""
+        if self.path is None:
+            return None
+        old = self._meta(key)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=str(key),
+                                   suffix=".tmp")
+        version = os.path.basename(tmp)[len(str(key)):-len(".tmp")]
+        try:
+            np.save(self._file(key, ".index.npy", version),
+                    frame.index.values.astype("datetime64[ns]").view("int64"))
+            np.save(self._file(key, ".values.npy", version),
+                    frame.to_numpy(dtype=float))
+            with os.fdopen(fd, "w") as f:
+                json.dump({'columns': list(frame.columns),
+                           'index': frame.index.name,
+                           'seq': seq,
+                           'version': version}, f)
+            os.replace(tmp, self._file(key, ".json"))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+                self._remove(key, {'version': version})
+        if old is not None and old.get('version') != version:
+            self._remove(key, old)
+        return None
+
+    def _load(self, key):
+        """Memory maps a persisted frame. Returns (frame, seq), (None, None)
+        if not found"""
+        if self.path is None:
+            return None, None
+        meta = self._meta(key)
+        if meta is None:
+            return None, None
+        try:
+            index = np.load(self._file(key, ".index.npy",
+                                       meta.get('version')), mmap_mode="r")
+            values = np.load(self._file(key, ".values.npy",
+                                        meta.get('version')), mmap_mode="r")
+        except (OSError, ValueError):
+            #  Replaced by another process meanwhile.
+            return None, None
+        index = pd.DatetimeIndex(np.asarray(index).view("datetime64[ns]"),
+                                 name=meta['index'])
+        return (pd.DataFrame(values, index=index, columns=meta['columns'],
+                             copy=False), meta.get('seq'))
@@ -0,0 +1,115 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+
+class CCL:
+    """Estimates the CCL (contado con liqui) rate from every BYMA / NYSE
+    pair: for each date and pair, local close * shares per ADR / ADR
+    close, aggregated across pairs."""
+
+    #  NYSE ticker: (BYMA ticker, BYMA shares per ADR). These are the
+    #  current ratios, pass pairs= to use others.
+    pairs = {'BBAR_usa': ('BBAR', 3),
+             'BMA_usa': ('BMA', 10),
+             'GGAL_usa': ('GGAL', 10),
+             'TGS_usa': ('TGSU2', 5),
+             'IRS_usa': ('IRSA', 10),
+             'CRESY_usa': ('CRES', 10),
+             'SUPV_usa': ('SUPV', 5),
+             'PAM_usa': ('PAMP', 25),
+             'YPF_usa': ('YPFD', 1),
+             'CEPU_usa': ('CEPU', 10),
+             'EDN_usa': ('EDN', 20)}
+
+    methods = ('median', 'volume', 'trimmed')
+
+    #  Days read before start so the first dates can be forward filled.
+    lookback = 15
+
+    def __init__(self, dbs, pairs=None, trim=0.2):
+
+        #  DBstocks handle
+        self.dbs = dbs
+
+        if pairs is not None:
+            self.pairs = dict(pairs)
+
+        #  Fraction dropped at each side by the trimmed mean.
+        self.trim = trim
+
+        #  {(start, end, method): DataFrame}
+        self._memo = {}
+
+    def clear(self):
+        """Forgets memoized results, e.g. after the db is updated"""
+        self._memo.clear()
+        return None
+
+    def rates(self, start, end):
+        """Returns (dates, rates, weights) arrays, one column per pair.
+        Prices come from the cache of the DBstocks handle when it has
+        one."""
+        adrs = list(self.pairs)
+        local = [self.pairs[i][0] for i in adrs]
+        ratio = np.array([self.pairs[i][1] for i in adrs], dtype=float)
+        if self.dbs.cache is not None:
+            panel = self.dbs._cached_panel(local + adrs, ['close', 'volnom'],
+                                           start, end)
+        else:
+            panel = self.dbs.get_panel(local + adrs, ['close', 'volnom'],
+                                       start=start, end=end)
+        close = panel['close'].to_numpy(dtype=float)
+        volnom = panel['volnom'].to_numpy(dtype=float)
+        n = len(adrs)
+
+        #  All pairs aligned by date in a single pass.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = close[:, :n] * ratio / close[:, n:]
+        rates[~np.isfinite(rates)] = np.nan
+        weights = np.nan_to_num(volnom[:, n:] * close[:, n:])
+        weights[np.isnan(rates)] = 0.
+        return panel.index, rates, weights
+
+    def aggregate(self, rates, weights, method='median'):
+        """Aggregates the pair rates of each date"""
+        valid = ~np.isnan(rates)
+        count = valid.sum(axis=1)
+        out = np.full(len(rates), np.nan)
+        some = count > 0
+        if method == 'median':
+            out[some] = np.nanmedian(rates[some], axis=1)
+        elif method == 'volume':
+            total = weights.sum(axis=1)
+            ok = total > 0
+            out[ok] = (np.nansum(rates * weights, axis=1)[ok] / total[ok])
+        elif method == 'trimmed':
+            ranked = np.sort(rates, axis=1)
+            cut = np.floor(count * self.trim).astype(int)
+            pos = np.arange(rates.shape[1])
+            keep = ((pos >= cut[:, None]) &
+                    (pos < (count - cut)[:, None]))
+            out[some] = (np.where(keep, ranked, 0.).sum(axis=1)[some] /
+                         keep.sum(axis=1)[some])
+        else:
+            raise ValueError("Unknown method " + str(method) +
+                             ". Options: " + str(self.methods))
+        return out
+
+    def get(self, start=None, end=None, method='median'):
+        """CCL between start and end as a DataFrame with a close column,
+        forward filled. Results are memoized per (start, end, method)."""
+        if start is None:
+            start = "1991-01-01"
+        if end is None:
+            end = dt.datetime.now().strftime("%Y-%m-%d")
+        key = (str(start), str(end), method)
+        if key not in self._memo:
+            since = (pd.Timestamp(start) -
+                     pd.Timedelta(days=self.lookback)).strftime("%Y-%m-%d")
+            dates, rates, weights = self.rates(since, end)
+            ccl = pd.DataFrame({'close': self.aggregate(rates, weights,
+                                                        method=method)},
+                               index=dates).ffill()
+            self._memo[key] = ccl.loc[pd.Timestamp(start):]
+        return self._memo[key].copy()
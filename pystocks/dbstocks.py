@@ -1,10 +1,52 @@
 import sqlalchemy as db
-from sqlalchemy.orm import sessionmaker
 import datetime as dt
-import yfinance as yf
 import pandas as pd
-import requests
+import numpy as np
 import os
+import queue
+import contextlib
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pystocks.cache import PriceCache
+from pystocks.ccl import CCL
+from pystocks.adjust import Adjuster
+from pystocks.validate import Validator
+from pystocks.bcra import BCRASource
+from pystocks.instrument import null_span, timed
+
+
+#  One pooled engine per (db url, pragmas), shared by all DBstocks instances.
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(dbname, pragmas=None):
+    """Returns the shared engine for dbname. For SQLite, pragmas are set on
+    every new pooled connection."""
+    pragmas = dict(pragmas or {})
+    key = (dbname, tuple(sorted(pragmas.items())))
+    with _engines_lock:
+        if key not in _engines:
+            engine = db.create_engine(dbname)
+            if dbname.startswith("sqlite") and pragmas:
+                def set_pragmas(dbapi_connection, connection_record):
+                    cursor = dbapi_connection.cursor()
+                    for name, value in pragmas.items():
+                        cursor.execute("PRAGMA " + str(name) + " = " +
+                                       str(value))
+                    cursor.close()
+                db.event.listen(engine, "connect", set_pragmas)
+            _engines[key] = engine
+        return _engines[key]
+
+
+def dispose_engines():
+    """Closes all the pooled connections of the shared engines"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
 
 
 class DBstocks:
@@ -35,7 +77,50 @@ class DBstocks:
                 'bcra': ['dolar_bcra_a3500']
                 }
 
-    def __init__(self, dbname=None, log=True):
+    #  Price columns of every ticker, in table order.
+    price_columns = ['max', 'min', 'close', 'volnom', 'vol', 'start',
+                     'start_h', 'max_h', 'min_h', 'volnom_h', 'vol_h',
+                     'close_h']
+
+    #  Tables of the long layout: every ticker in one prices table, keyed
+    #  by (ticker_id, date), plus the tickers dimension.
+    long_table = "prices"
+    tickers_table = "tickers"
+
+    #  BCRA sources, seconds to wait for them and directory for their
+    #  cached snapshots (None for pystocks.bcra.BCRASource.path).
+    bcra_urls = {'dolar_bcra_a3500': 'http://www.bcra.gov.ar/Pdfs/'
+                 'PublicacionesEstadisticas/com3500.xls'}
+    http_timeout = 60
+    bcra_cache = None
+
+    #  yf.download() columns stored in the db. 'vol' is not provided by Y!
+    ycolumns = {'High': 'max',
+                'Low': 'min',
+                'Close': 'close',
+                'Volume': 'volnom',
+                'Open': 'start',
+                'Adj Close': 'close_h'}
+
+    #  Rows sent to the db on each executemany call when upserting.
+    chunksize = 5000
+
+    #  Concurrent Y! downloads when updating the db.
+    workers = 4
+
+    #  Check each batch of downloaded rows before it is written, see
+    #  pystocks.validate.Validator
+    validate = True
+
+    #  SQLite pragmas set on each connection. Override per workload with
+    #  DBstocks(pragmas={...}), e.g. {'synchronous': 'OFF'} for backfills.
+    pragmas = {'journal_mode': 'WAL',
+               'synchronous': 'NORMAL',
+               'cache_size': -65536,
+               'mmap_size': 268435456}
+
+    def __init__(self, dbname=None, log=True, chunksize=None, pragmas=None,
+                 cache=None, layout=None, instrument=None):
 
         #  DB PATH
         if dbname is None:
@@ -43,64 +128,424 @@ class DBstocks:
             self.dbname = "sqlite:///" + str(os.path.join(mdir,
                                                            "db",
                                                            "dbprices.db"))
+        elif "://" in str(dbname):
+            self.dbname = str(dbname)
+        else:
+            self.dbname = "sqlite:///" + str(dbname)
+
+        #  Upsert batch size
+        if chunksize is not None:
+            self.chunksize = int(chunksize)
 
         #  Screen log boolean
         self.log = log
 
-        #  DB handle. ToDo: improve this.
-        self.engine, self.connect, self.metadata = self.get_connection()
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
-        self.inspect = db.inspect(self.engine)
+        #  Optional PriceCache for get_prices. True for a default one.
+        if cache is True:
+            cache = PriceCache()
+        self.cache = cache if cache is not False else None
+        self._cache_prefix = None
+
+        #  SQLite pragmas
+        self.pragmas = dict(self.pragmas)
+        if pragmas is not None:
+            self.pragmas.update(pragmas)
+
+        #  DB handle. Engine is shared, connection and session are opened
+        #  on first use.
+        self.engine, self.metadata = self.get_connection()
+        self._connect = None
+        self._session = None
+        self._table_names = None
+        self._ticker_ids = None
+
+        #  Optional pystocks.instrument.Instrument for timings and SQL
+        #  statement counts. It listens to an engine of its own, sharing
+        #  the pool, so statements of other handles are left out.
+        self.instrument = instrument
+        if instrument is not None:
+            self.engine = self.engine.execution_options()
+            instrument.attach(self.engine)
+
+        #  CCL estimator, memoizes results until the next upsert.
+        self.ccl_engine = CCL(self)
+
+        #  Local dividend / split adjustment of the *_h columns.
+        self.adjuster = Adjuster(self)
+
+        #  Data quality checks and quarantine flags.
+        self.validator = Validator(self)
+
+        #  Storage layout: 'wide' (a table per ticker) or 'long' (a single
+        #  prices table). Detected from the db on first use when not given.
+        if layout not in (None, "wide", "long"):
+            raise ValueError("Unknown layout " + str(layout))
+        self._layout = layout
+
+        #  Intraday BarStore, opened on first use next to the db file.
+        self._bars = None
+
+    @property
+    def layout(self):
+        """Storage layout, detecting it opens the first connection"""
+        if self._layout is None:
+            self._layout = ("long" if self.has_table(self.long_table)
+                            else "wide")
+        return self._layout
+
+    def span(self, name, **tags):
+        """Span of self.instrument, a no-op when there is none"""
+        if self.instrument is None:
+            return null_span()
+        return self.instrument.span(name, **tags)
 
     def get_connection(self):
         """Returns db handle"""
-        engine = db.create_engine(self.dbname)
-        connect = engine.connect()
+        engine = get_engine(self.dbname, self.pragmas)
         metadata = db.MetaData()
-        return engine, connect, metadata
+        return engine, metadata
 
-    def update_db(self, start=None):
-        """Updates all the prices in the db"""
+    @property
+    def connect(self):
+        """Long lived connection, opened on first use"""
+        if self._connect is None:
+            self._connect = self.engine.connect()
+        return self._connect
 
-        #  Available AR Values from Y!
-        if start is None:
-            start = self.get_last_date('y')
-        print("[db] Updating values from Y! since " + str(start))
-        self._upsert_yahoo_data(start=start)
+    @property
+    def session(self):
+        """ORM session, opened on first use"""
+        if self._session is None:
+            from sqlalchemy.orm import sessionmaker
+            self._session = sessionmaker(bind=self.engine)()
+        return self._session
 
-        #  US Values from Y!
-        if start is None:
-            start = self.get_last_date('yusa')
-        print("[db] Updating values from Y! since " + str(start))
-        self._upsert_yahoo_data(start=start, category='yusa')
+    @property
+    def inspect(self):
+        return db.inspect(self.engine)
+
+    def close(self):
+        """Closes the connection and session, and detaches the
+        instrument. The shared engine pool is kept, see
+        dispose_engines()."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._connect is not None:
+            self._connect.close()
+            self._connect = None
+        if self.instrument is not None:
+            self.instrument.detach(self.engine)
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def table_names(self, refresh=False):
+        """Cached set of the tables in the db"""
+        if self._table_names is None or refresh:
+            self._table_names = set(i.lower() for i in
+                                    self.inspect.get_table_names())
+        return self._table_names
+
+    def has_table(self, ticker):
+        return ticker.lower() in self.table_names()
+
+    def has_ticker(self, ticker):
+        """True if there is storage for ticker in the db"""
+        if self.layout == "long":
+            return ticker.lower() in self.ticker_ids()
+        return self.has_table(ticker)
+
+    def ticker_ids(self, refresh=False):
+        """Cached {ticker: ticker_id} of the long layout"""
+        if self._ticker_ids is None or refresh:
+            self._ticker_ids = {}
+            if self.has_table(self.tickers_table):
+                with self.engine.connect() as conn:
+                    self._ticker_ids = dict(conn.exec_driver_sql(
+                        'SELECT ticker, ticker_id FROM "' +
+                        self.tickers_table + '"').fetchall())
+        return self._ticker_ids
+
+    def create_long_tables(self):
+        """Creates the tables of the long layout"""
+        columns = ", ".join('"' + i + '" REAL' for i in self.price_columns)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE IF NOT EXISTS "' + self.tickers_table + '" '
+                "(ticker_id INTEGER PRIMARY KEY, ticker TEXT UNIQUE NOT NULL)")
+            conn.exec_driver_sql(
+                'CREATE TABLE IF NOT EXISTS "' + self.long_table + '" '
+                "(ticker_id INTEGER NOT NULL, date DATE NOT NULL, " +
+                columns + ", PRIMARY KEY (ticker_id, date)) WITHOUT ROWID")
+            conn.exec_driver_sql(
+                'CREATE INDEX IF NOT EXISTS "' + self.long_table +
+                '_date" ON "' + self.long_table + '" (date, ticker_id)')
+        self.table_names().update([self.tickers_table, self.long_table])
+        return None
+
+    def ticker_id(self, ticker, create=False):
+        """Returns the long layout id of ticker, None if unknown"""
+        ticker = ticker.lower()
+        if ticker not in self.ticker_ids() and create:
+            self.create_long_tables()
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    'INSERT OR IGNORE INTO "' + self.tickers_table +
+                    '" (ticker) VALUES (?)', (ticker,))
+            if self.log:
+                print("[db] Creating storage for ticker " + ticker + ".")
+            self.ticker_ids(refresh=True)
+        return self.ticker_ids().get(ticker)
+
+    @timed("update_db")
+    def update_db(self, start=None, workers=None):
+        """Updates all the prices in the db. Each ticker is requested from
+        its own last stored date, unless start is given. workers sets the
+        number of concurrent Y! downloads."""
+
+        #  Available AR Values from Y! and US Values from Y!
+        for category in ('y', 'yusa'):
+            starts = self.get_start_dates(category, start=start)
+            if not starts:
+                print("[db] Values from Y! (" + category + ") up to date")
+                continue
+            print("[db] Updating " + str(len(starts)) + " tickers from Y! "
+                  "since " + str(self._earliest(starts)))
+            self._upsert_yahoo_data(start=starts, category=category,
+                                    tickers=list(starts), workers=workers)
+
+            #  New rows of tickers with local adjustments.
+            adjusted = set(self.adjuster.tickers())
+            for ticker in starts:
+                if ticker.lower() in adjusted:
+                    self.adjuster.recompute(ticker, start=starts[ticker])
 
         #  Values from BCRA
-        if start is None:
-            start = self.get_last_date('bcra')
-        print("[db] Updating values from BCRA since " + str(start))
-        for fuente in self.dtickers['bcra']:
-            self._upsert_dolar_data(fuente=fuente, start=start)
+        starts = self.get_start_dates('bcra', start=start)
+        for fuente in starts:
+            print("[db] Updating values from BCRA since " +
+                  str(starts[fuente]))
+            self._upsert_dolar_data(fuente=fuente, start=starts[fuente])
 
         return None
 
+    def add_events(self, ticker, events, full=False):
+        """Stores dividend / split events of ticker, a DataFrame with date,
+        kind and value, and rewrites the *_h rows they affect, from the
+        first event on unless full. See pystocks.adjust.Adjuster"""
+        return self.adjuster.add_events(ticker, events, full=full)
+
+    def update_events(self, category='y', tickers=None):
+        """Downloads dividends of tickers (default self.dtickers[category])
+        from Y! and adjusts the rows of those that changed. Returns
+        {ticker: counts}"""
+        if tickers is None:
+            tickers = self.dtickers[category]
+        counts = {}
+        for ticker in tickers:
+            try:
+                events = self.adjuster.fetch_yahoo(ticker, category)
+            except Exception as error:
+                self.myprint("Could not get " + str(ticker) + " events: " +
+                             str(error), override=True)
+                continue
+            counts[ticker] = self.adjuster.add_events(ticker, events)
+        return counts
+
+    def _earliest(self, starts):
+        """Earliest of the start dates, None if any ticker has no data"""
+        if any(i is None for i in starts.values()):
+            return None
+        return min(starts.values())
+
+    def get_start_dates(self, category, start=None):
+        """Returns {ticker: start date} for the tickers of
+        self.dtickers[category] that need an update. None means there is
+        no data for the ticker, so the whole history is needed."""
+        tickers = self.dtickers[category]
+        if start is not None:
+            return {ticker: start for ticker in tickers}
+
+        today = dt.datetime.now()
+        starts = {}
+        for ticker, last in self.get_last_dates(tickers).items():
+            if last is None:
+                starts[ticker] = None
+            elif last + dt.timedelta(days=1) <= today:
+                starts[ticker] = last + dt.timedelta(days=1)
+        return starts
+
+    def _ensure_table(self, name, ddl):
+        """Creates table name, with ddl as its column definitions, if it
+        is not known yet"""
+        if not self.has_table(name):
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql('CREATE TABLE IF NOT EXISTS "' + name +
+                                     '" (' + ddl + ')')
+            self.table_names().add(name)
+        return None
+
+    def _ticker_source(self, ticker):
+        """FROM ... WHERE fragment selecting the rows of ticker, for either
+        layout. More conditions are appended with AND."""
+        if self.layout == "long":
+            return ('"' + self.long_table + '" WHERE ticker_id = ' +
+                    str(self.ticker_id(ticker)))
+        return '"' + ticker.lower() + '" WHERE true'
+
+    #  Metadata table with the last stored date of each ticker.
+    freshness_table = "meta_freshness"
+
+    def _create_freshness_table(self):
+        """Creates the freshness table if needed"""
+        return self._ensure_table(self.freshness_table,
+                                  "ticker TEXT PRIMARY KEY, last_date TEXT")
+
+    #  Append only log of writes: (seq, ticker, first date written). Lets
+    #  other processes, e.g. pystocks.server, reload just what changed.
+    changes_table = "meta_changes"
+
+    def _create_changes_table(self):
+        """Creates the change log table if needed"""
+        return self._ensure_table(self.changes_table,
+                                  "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                  "ticker TEXT, since TEXT")
+
+    def get_changes(self, after=0):
+        """Returns [(seq, ticker, since)] of the writes logged after seq"""
+        if (not self.has_table(self.changes_table) and
+                self.changes_table not in self.table_names(refresh=True)):
+            return []
+        with self.engine.connect() as conn:
+            return [tuple(i) for i in conn.exec_driver_sql(
+                'SELECT seq, ticker, since FROM "' + self.changes_table +
+                '" WHERE seq > ? ORDER BY seq', (after,))]
+
+    def last_change(self):
+        """seq of the last write logged, 0 if none"""
+        if (not self.has_table(self.changes_table) and
+                self.changes_table not in self.table_names(refresh=True)):
+            return 0
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql(
+                'SELECT COALESCE(MAX(seq), 0) FROM "' + self.changes_table +
+                '"').scalar()
+
+    def log_change(self, conn, ticker, since):
+        """Logs a write of ticker from since on, within the transaction of
+        conn"""
+        conn.exec_driver_sql(
+            'INSERT INTO "' + self.changes_table +
+            '" (ticker, since) VALUES (?, ?)', (ticker.lower(), since))
+        return None
+
+    def export_snapshot(self, path, after=None, codec="zlib", tickers=None):
+        """Writes the prices of every stored ticker (or of tickers) to a
+        columnar snapshot file. With after, a change log seq, only the rows
+        written since then, as a delta. codec=None leaves it uncompressed,
+        to be memory mapped. See pystocks.snapshot"""
+        from pystocks.snapshot import export_snapshot
+        return export_snapshot(self, path, after=after, codec=codec,
+                               tickers=tickers)
+
+    def import_snapshot(self, path):
+        """Upserts the prices of a snapshot file, full or delta, into the
+        db. See pystocks.snapshot"""
+        from pystocks.snapshot import import_snapshot
+        return import_snapshot(self, path)
+
+    @property
+    def bars(self):
+        """Intraday BarStore of the db, in a <db name>_bars folder next
+        to the sqlite file. See pystocks.bars"""
+        if self._bars is None:
+            if not self.dbname.startswith("sqlite:///"):
+                raise ValueError("No default bars folder for " + self.dbname)
+            from pystocks.bars import BarStore
+            path = os.path.splitext(self.dbname[len("sqlite:///"):])[0]
+            self._bars = BarStore(path + "_bars")
+        return self._bars
+
+    def append_bars(self, ticker, bars):
+        """Appends intraday bars of ticker, only the ones newer than the
+        last stored. See BarStore.append"""
+        with self.span("bars_append", ticker=ticker.lower()) as span:
+            counts = self.bars.append(ticker, bars)
+            span['rows'] = counts['appended']
+        return counts
+
+    def get_bars(self, ticker, start, end=None, freq=None):
+        """Intraday bars of ticker from start to end, downsampled to freq
+        ('D', 'W', 'Nmin') when given. See BarStore.read"""
+        with self.span("bars_query", ticker=ticker.lower()) as span:
+            bars = self.bars.read(ticker, start, end, freq=freq)
+            span['rows'] = len(bars)
+        return bars
+
+    def _freshness_sql(self, ticker):
+        """Statement refreshing the freshness row of ticker from its table"""
+        return ('INSERT INTO "' + self.freshness_table + '" '
+                "SELECT '" + ticker.lower() + "', MAX(date) FROM " +
+                self._ticker_source(ticker) + " ON CONFLICT(ticker) "
+                "DO UPDATE SET last_date = excluded.last_date")
+
+    def update_db_async(self, start=None, end=None, **kwargs):
+        """Updates the db running Y! and BCRA downloads concurrently with
+        rate limits, timeouts and retries. kwargs go to
+        pystocks.aioupdate.AsyncUpdater. Returns a report per ticker."""
+        from pystocks.aioupdate import AsyncUpdater
+        return AsyncUpdater(self, **kwargs).run(start=start, end=end)
+
+    @timed("query.last_dates")
+    def get_last_dates(self, tickers):
+        """Returns {ticker: last stored date} with a single query on the
+        freshness table. Tickers without a table or rows map to None."""
+        self._create_freshness_table()
+        keys = [ticker.lower() for ticker in tickers]
+        marks = ", ".join("?" for i in keys)
+        with self.engine.begin() as conn:
+            known = dict(conn.exec_driver_sql(
+                'SELECT ticker, last_date FROM "' + self.freshness_table +
+                '" WHERE ticker IN (' + marks + ')', tuple(keys)).fetchall())
+
+            #  Tables not indexed yet, e.g. dbs created by older versions.
+            for key in keys:
+                if key not in known and self.has_ticker(key):
+                    conn.exec_driver_sql(self._freshness_sql(key))
+                    known[key] = conn.exec_driver_sql(
+                        'SELECT last_date FROM "' + self.freshness_table +
+                        '" WHERE ticker = ?', (key,)).scalar()
+
+        last_dates = {}
+        for ticker, key in zip(tickers, keys):
+            if key not in known:
+                self.myprint("Warning: Table " + str(ticker) +
+                             " not found in " + str(self.dbname) + ".",
+                             override=True)
+            if known.get(key) is None:
+                last_dates[ticker] = None
+            else:
+                last_dates[ticker] = dt.datetime.strptime(known[key][:10],
+                                                          "%Y-%m-%d")
+        return last_dates
+
     def get_last_date(self, category, debug=False):
         """Returns the earliest date not updated in db for
         self.dtickers[category]"""
 
         last = dt.datetime.now()
-        for ticker in self.dtickers[category]:
-            try:
-                res = self.connect.execute("SELECT date FROM " + str(ticker) +
-                                           " ORDER by date DESC LIMIT 1")
-                current = dt.datetime.strptime(res.first()[0], "%Y-%m-%d")
-                if debug:
-                    print(str(ticker) + ": " + str(current))
-                if current < last:
-                    last = current
-            except:
-                print("[db] Warning: Table " + str(ticker) + " not found in " +
-                      str(self.dbname) + ".")
+        for ticker, current in self.get_last_dates(
+                                    self.dtickers[category]).items():
+            if debug:
+                print(str(ticker) + ": " + str(current))
+            if current is not None and current < last:
+                last = current
         last = last + dt.timedelta(days=1)
         return last
 
@@ -109,24 +554,14 @@ class DBstocks:
         ticker = ticker.lower()
         emp = db.Table(ticker, self.metadata,
                        db.Column('date', db.Date(), primary_key=True),
-                       db.Column('max', db.Float()),
-                       db.Column('min', db.Float()),
-                       db.Column('close', db.Float()),
-                       db.Column('volnom', db.Float()),
-                       db.Column('vol', db.Float()),
-                       db.Column('start', db.Float()),
-                       db.Column('start_h', db.Float()),
-                       db.Column('max_h', db.Float()),
-                       db.Column('min_h', db.Float()),
-                       db.Column('volnom_h', db.Float()),
-                       db.Column('vol_h', db.Float()),
-                       db.Column('close_h', db.Float()))
+                       *[db.Column(i, db.Float()) for i in self.price_columns])
 
         if self.log:
             message = "[db] Creating table for ticker " + str(ticker) + "."
             print(message)
 
-        self.metadata.create_all(self.engine)
+        emp.create(self.engine, checkfirst=True)
+        self.table_names().add(ticker)
         return None
 
     def _sanitize(self, my_string):
@@ -135,15 +570,18 @@ class DBstocks:
 
     def get_table(self, ticker):
         """Returns db handle for the ticker table."""
+        ticker = ticker.lower()
+        if ticker in self.metadata.tables:
+            return self.metadata.tables[ticker]
 
         #  If table don't exist, Create.
-        if not self.inspect.has_table(ticker):
+        if not self.has_table(ticker):
             if self.log:
                 message = ("[db] Table for ticker " + str(ticker) +
                            " does not exist.")
                 print(message)
             self.create_ticker_table(ticker)
-        my_table = db.Table(ticker, self.metadata, autoload=True,
+        my_table = db.Table(ticker, self.metadata,
                             autoload_with=self.engine)
         return my_table
 
@@ -160,68 +598,254 @@ class DBstocks:
         results = self.connect.execute(query, value_list)
         return None
 
-    def _upsert_data(self, value_dict):
-        """ Inserts data into de db"""
+    def _format_date(self, value):
+        """Returns value as a %Y-%m-%d string, None if not a valid date"""
+        if isinstance(value, str):
+            return value[:10] if value else None
+        try:
+            return value.strftime("%Y-%m-%d")
+        except (AttributeError, ValueError):
+            return None
+
+    def _rows_from_dicts(self, values):
+        """Turns a list of value dicts into (columns, rows, failed), where
+        rows are plain tuples with the date first."""
+        columns = ['date']
+        for value in values:
+            for key in value:
+                if key not in columns:
+                    columns.append(key)
+        rows = []
+        failed = 0
+        for value in values:
+            value_date = self._format_date(value.get('date'))
+            if value_date is None:
+                failed += 1
+                continue
+            rows.append((value_date,) +
+                        tuple(value.get(i) for i in columns[1:]))
+        return columns, rows, failed
+
+    def _upsert_sql(self, table, columns, keys=('date',)):
+        """INSERT ... ON CONFLICT(keys) DO UPDATE statement for columns"""
+        names = ", ".join('"' + i + '"' for i in columns)
+        marks = ", ".join("?" for i in columns)
+        values = [i for i in columns if i not in keys]
+        query = ('INSERT INTO "' + table.lower() + '" (' + names +
+                 ') VALUES (' + marks + ') ON CONFLICT(' +
+                 ", ".join('"' + i + '"' for i in keys) + ') ')
+        if values:
+            query += "DO UPDATE SET " + ", ".join(
+                '"' + i + '" = excluded."' + i + '"' for i in values)
+        else:
+            query += "DO NOTHING"
+        return query
+
+    def _upsert_rows(self, ticker, columns, rows, chunksize=None):
+        """Writes rows (tuples ordered as columns, date first) of ticker in
+        a single transaction. Returns counts of inserted, updated and
+        failed rows."""
+        counts = {'inserted': 0, 'updated': 0, 'failed': 0}
+        if not rows:
+            return counts
+        if chunksize is None:
+            chunksize = self.chunksize
+
+        with self.span("upsert", ticker=ticker) as span:
+            self._create_freshness_table()
+            self._create_changes_table()
+            if self.layout == "long":
+                key = self.ticker_id(ticker, create=True)
+                query = self._upsert_sql(self.long_table,
+                                         ['ticker_id'] + list(columns),
+                                         keys=('ticker_id', 'date'))
+            else:
+                self.get_table(ticker)
+                query = self._upsert_sql(ticker, columns)
+            exists = ('SELECT date FROM ' + self._ticker_source(ticker) +
+                      ' AND date BETWEEN ? AND ?')
+            inserted = updated = 0
+            try:
+                with self.engine.begin() as conn:
+                    for i in range(0, len(rows), chunksize):
+                        chunk = rows[i:i + chunksize]
+                        dates = [row[0] for row in chunk]
+                        if self.layout == "long":
+                            chunk = [(key,) + tuple(row) for row in chunk]
+                        known = set(r[0] for r in conn.exec_driver_sql(
+                            exists, (min(dates), max(dates))))
+                        for value_date in dates:
+                            if value_date in known:
+                                updated += 1
+                            else:
+                                inserted += 1
+                                known.add(value_date)
+                        conn.exec_driver_sql(query, chunk)
+                    conn.exec_driver_sql(self._freshness_sql(ticker))
+                    self.log_change(conn, ticker,
+                                    min(row[0] for row in rows))
+                counts['inserted'] = inserted
+                counts['updated'] = updated
+                if self.cache is not None:
+                    self.cache.written(self.cache_key(ticker),
+                                       min(row[0] for row in rows))
+                self.ccl_engine.clear()
+                self.validator.written(ticker)
+            except Exception as error:
+                message = ("Could not update " + str(ticker) + ": " +
+                           str(error))
+                self.myprint(message, override=True)
+                counts['failed'] = len(rows)
+            span['rows'] = inserted + updated
+        return counts
+
+    def _upsert_data(self, value_dict, chunksize=None):
+        """Inserts data into the db, one transaction per ticker. Values
+        are either lists of value dicts or (columns, rows) tuples as
+        returned by _frame_to_rows. Rows are validated first when
+        self.validate. Returns a dict of
+        {ticker: {'inserted', 'updated', 'failed', 'flagged'}}"""
 
+        counts = {}
         for ticker in value_dict.keys():
-            print("[db] Upserting values from ticker " + str(ticker))
-            ticker_table = self.get_table(ticker)
-            for value in value_dict[ticker]:
-                value_date = value['date'].strftime("%Y-%m-%d")
-                exists = self.session.query(ticker_table).filter_by(date=value_date).scalar() is not None
+            self.myprint("Upserting values from ticker " + str(ticker))
+            if isinstance(value_dict[ticker], tuple):
+                columns, rows = value_dict[ticker]
+                failed = 0
+            else:
+                columns, rows, failed = self._rows_from_dicts(
+                                                    value_dict[ticker])
+            flagged = 0
+            if self.validate:
+                with self.span("validate", ticker=ticker) as span:
+                    try:
+                        flagged = len(self.validator.validate(ticker, columns,
+                                                              rows))
+                    except Exception as error:
+                        self.myprint("Could not validate " + str(ticker) +
+                                     ": " + str(error), override=True)
+                    span['rows'] = len(rows)
+            counts[ticker] = self._upsert_rows(ticker, columns, rows,
+                                               chunksize=chunksize)
+            counts[ticker]['failed'] += failed
+            counts[ticker]['flagged'] = flagged
+        return counts
+
+    def _upsert_yahoo_data(self, start, end=None, category="y",
+                           chunksize=None, workers=None, fetch=None,
+                           queue_size=None, tickers=None):
+        """Upserts yahoo data. Tickers are downloaded concurrently by a pool
+        of workers and streamed through a bounded queue to a single writer
+        thread, so downloads and db writes overlap.
+
+        start may be a {ticker: start} dict. tickers defaults to
+        self.dtickers[category]. fetch(ticker, start, end, category) must
+        return a DataFrame shaped like yf.download() output; defaults to
+        self._fetch_yahoo. Returns per ticker counts."""
+        if workers is None:
+            workers = self.workers
+        if fetch is None:
+            fetch = self._fetch_yahoo
+        if queue_size is None:
+            queue_size = 2 * workers
+        if tickers is None:
+            tickers = self.dtickers[category]
+
+        done = queue.Queue(maxsize=queue_size)
+        counts = {}
+        errors = []
+
+        def fetcher(ticker):
+            try:
+                since = start[ticker] if isinstance(start, dict) else start
+                with self.span("fetch", ticker=ticker, category=category):
+                    data = fetch(ticker, since, end, category)
+                with self.span("convert", ticker=ticker) as span:
+                    rows = self._yahoo_rows(data)
+                    span['rows'] = len(rows[1])
+                done.put((ticker, rows))
+            except Exception as error:
+                self.myprint("Could not get " + str(ticker) + " data: " +
+                             str(error), override=True)
+                counts[ticker] = {'inserted': 0, 'updated': 0, 'failed': 0}
+
+        def writer():
+            while True:
+                item = done.get()
+                if item is None:
+                    break
                 try:
-                    if not exists:
-                        query = db.insert(ticker_table)
-                        results = self.connect.execute(query, value)
-                    else:
-                        query = db.update(ticker_table).where(
-                                ticker_table.c.date == value_date).values(
-                                    {i: value[i] for i in value if i != 'date'})
-                        results = self.connect.execute(query, value)
-                except:
-                    message = "[db] Could not update " + ticker
-                    print(message)
-
-    def _upsert_yahoo_data(self, start, end=None, category="y"):
-        """Return value dict for upsert from yahoo data"""
-        if end is None:
-            dt.datetime.now().strftime("%Y-%m-%d")
-        value_dict = self.get_data_from_yahoo(start=start,
-                                              end=end,
-                                              category=category)
-        self._upsert_data(value_dict)
-        return None
+                    counts.update(self._upsert_data({item[0]: item[1]},
+                                                    chunksize=chunksize))
+                except Exception as error:
+                    errors.append(error)
+
+        thread = threading.Thread(target=writer, name="pystocks-writer")
+        thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for ticker in tickers:
+                    pool.submit(fetcher, ticker)
+        finally:
+            done.put(None)
+            thread.join()
+        if errors:
+            raise errors[0]
+        return counts
 
-    def _upsert_dolar_data(self, fuente="a3500", start=None, end=None):
-        """Updates db with dolar data"""
-        if fuente.lower() == "a3500":
+    def _upsert_dolar_data(self, fuente="dolar_bcra_a3500", start=None,
+                           end=None, chunksize=None):
+        """Updates db with dolar data. Returns per ticker counts"""
+        if fuente.lower() in self.dtickers['bcra']:
             value_dict = self.get_dolar_bcra(fuente=fuente,
                                              start=start,
                                              end=end)
-            self._upsert_data(value_dict)
-        return None
+            return self._upsert_data(value_dict, chunksize=chunksize)
+        return {}
+
+    def _fetch_yahoo(self, ticker, start, end, category='y', timeout=None):
+        """Downloads ticker data with yf.download(). start None means the
+        whole history. timeout, in seconds, defaults to self.http_timeout"""
+        import yfinance as yf
+        if start is None:
+            start = "1991-01-01"
+        if timeout is None:
+            timeout = self.http_timeout
+        self.myprint("Getting " + str(ticker) + " data from Y!")
+        return yf.download(self.yticker(ticker, category=category),
+                           start=start,
+                           end=end,
+                           auto_adjust=False,
+                           progress=False,
+                           timeout=timeout)
+
+    def _frame_to_rows(self, data, columns):
+        """Vectorized conversion of a date indexed DataFrame into
+        (columns, rows) for _upsert_data. columns maps data columns to db
+        columns. Rows are tuples with the date, as %Y-%m-%d, first."""
+        data = data.loc[data.index.notna()]
+        names = ['date'] + list(columns.values())
+        rows = np.empty((len(data), len(names)), dtype=object)
+        rows[:, 0] = pd.DatetimeIndex(data.index).strftime("%Y-%m-%d")
+        rows[:, 1:] = data[list(columns.keys())].to_numpy(dtype=float)
+        return names, list(map(tuple, rows.tolist()))
+
+    def _yahoo_rows(self, data):
+        """Turns yf.download() output into (columns, rows)"""
+        if isinstance(data.columns, pd.MultiIndex):
+            data = data.droplevel(1, axis=1)
+        columns = {i: self.ycolumns[i] for i in self.ycolumns
+                   if i in data.columns}
+        return self._frame_to_rows(data, columns)
 
     def get_data_from_yahoo(self, start, end, category='y'):
-        """ Encapsulates yf.download()"""
+        """ Encapsulates yf.download(). start may be a {ticker: start}
+        dict."""
         value_dict = {}
         for ticker in self.dtickers[category]:
-            self.myprint("Getting " + str(ticker) + " data from Y!")
-            data = yf.download(self.yticker(ticker,
-                                            category=category),
-                                            start=start,
-                                            end=end,
-                                            progress=False)
-            data.reset_index(inplace=True)
-            value_dict[ticker] = []
-            for row in data.iterrows():
-                value_dict[ticker].append({'close':   row[1].Close,
-                                           'max':     row[1].High,
-                                           'min':     row[1].Low,
-                                           'start':   row[1].Open,
-                                           'volnom':  row[1].Volume,
-                                           'vol':     None,
-                                           'close_h': row[1]['Adj Close'],
-                                           'date':    row[1].Date})
+            since = start[ticker] if isinstance(start, dict) else start
+            data = self._fetch_yahoo(ticker, since, end, category=category)
+            value_dict[ticker] = self._yahoo_rows(data)
         return value_dict
 
     def yticker(self, ticker, category):
@@ -238,67 +862,323 @@ class DBstocks:
     def get_prices(self, ticker, start, end=None, dt_index=True):
         """Ejemplo para obtener precios de un ticker desde la base de datos"""
         ticker = ticker.lower()
-        engine = db.create_engine(self.dbname)
 
         if end is None:
             end = dt.datetime.now().strftime("%Y-%m-%d")
 
-        query = ("SELECT * FROM " + ticker + " WHERE date between '" + start +
-                  "' AND '" + end + "';")
+        with self.span("query", ticker=ticker) as span:
+            if self.cache is not None and dt_index:
+                prices = self._cached_prices(ticker).loc[start:end].copy()
+            else:
+                prices = self._read_prices(ticker, start, end,
+                                           dt_index=dt_index)
+            span['rows'] = len(prices)
+        return prices
+
+    def _read_prices(self, ticker, start, end, dt_index=True):
+        """Reads prices of ticker from the db"""
+        params = {'start': start, 'end': end}
+        if self.layout == "long":
+            query = ("SELECT date, " +
+                     ", ".join('"' + i + '"' for i in self.price_columns) +
+                     ' FROM "' + self.long_table + '" WHERE ticker_id = :key'
+                     " AND date BETWEEN :start AND :end ORDER BY date")
+            params['key'] = self.ticker_id(ticker)
+        else:
+            query = ('SELECT * FROM "' + ticker +
+                     '" WHERE date BETWEEN :start AND :end')
 
-        prices = pd.read_sql(query, con=engine)
+        with self.engine.connect() as conn:
+            prices = pd.read_sql(db.text(query), con=conn, params=params)
+        values = [i for i in prices.columns if i != 'date']
+        prices[values] = prices[values].astype(float)
         if dt_index:
             fecha = pd.to_datetime(prices.date, format="%Y-%m-%d")
             prices['date'] = fecha
             prices.set_index("date", inplace=True)
         return prices
 
-    def get_ccl(self, start=None, end=None):
-        """Computes and return CCL"""
-        #ToDo CCL average using alse other tickers
-        ypf = self.get_prices("YPFD", start="1991-01-01")
-        ypfu = self.get_prices("YPF_usa", start="1991-01-01")
-        ccl = ypf.close.div(ypfu.close)
-        ccl = ccl.to_frame().fillna(method='ffill')
-        return ccl
+    def cache_key(self, ticker):
+        """Key of ticker in self.cache: the db and the ticker, so a cache
+        (or its folder) can be shared by several dbs"""
+        if self._cache_prefix is None:
+            name = self.dbname
+            if name.startswith("sqlite:///"):
+                name = os.path.abspath(name[len("sqlite:///"):])
+            self._cache_prefix = hashlib.sha1(name.encode()).hexdigest()[:12]
+        return self._cache_prefix + "_" + ticker.lower()
 
-    def get_dolar_bcra(self, fuente='dolar_bcra_a3500', start=None, end=None):
-        """Start and end in %Y%m%d format"""
+    def _written_since(self, ticker, seq):
+        """Earliest date of ticker written after the change log seq, None
+        if none. Unknown seqs mean the whole history."""
+        if seq is None:
+            return pd.Timestamp.min
+        if seq >= self.last_change():
+            return None
+        since = [i[2] for i in self.get_changes(seq)
+                 if i[1] == ticker.lower()]
+        return pd.Timestamp(min(since)) if since else None
+
+    def _cached_prices(self, ticker):
+        """Whole history of ticker from self.cache. Misses read the db,
+        stale entries only read the rows written since cached. Entries are
+        checked against the change log, for writes of other handles."""
+        key = self.cache_key(ticker)
+        prices, stale = self.cache.get(
+            key, check=lambda seq: self._written_since(ticker, seq))
+        if prices is None:
+            seq = self.last_change()
+            prices = self._read_prices(ticker, "0001-01-01", "9999-12-31")
+            self.cache.put(key, prices, stale=stale, seq=seq)
+        elif stale is not None:
+            seq = self.last_change()
+            tail = self._read_prices(ticker, stale.strftime("%Y-%m-%d"),
+                                     "9999-12-31")
+            prices = pd.concat([prices.loc[prices.index < stale], tail])
+            self.cache.put(key, prices, extended=True, stale=stale, seq=seq)
+        return prices
+
+    def _cached_panel(self, tickers, columns, start, end=None):
+        """Date by (column, ticker) frame built from self.cache, as
+        get_panel with a list of columns"""
+        if end is None:
+            end = dt.datetime.now().strftime("%Y-%m-%d")
+        frames = {}
+        for ticker in tickers:
+            if self.has_ticker(ticker):
+                frames[ticker] = self._cached_prices(ticker).loc[
+                                                    start:end, columns]
+        return self._frames_panel(frames, tickers, columns)
+
+    #  Tables per UNION ALL query, SQLite allows up to 500.
+    panel_batch = 200
+
+    @timed("query.panel")
+    def get_panel(self, tickers, columns="close_h", start="1991-01-01",
+                  end=None, dtype=None, quarantine=None):
+        """Returns a date by ticker DataFrame with prices of tickers, read
+        with a single query per panel_batch tickers (UNION ALL of ticker
+        tables in the wide layout). If columns
+        is a list, DataFrame columns are (column, ticker). dtype, e.g.
+        'float32', sets a compact dtype for the values. quarantine, True
+        or a list of rules, leaves NaN where rows were flagged, see
+        pystocks.validate.Validator"""
+        if isinstance(columns, str):
+            names = [columns]
+        else:
+            names = list(columns)
+        if end is None:
+            end = dt.datetime.now().strftime("%Y-%m-%d")
+
+        found = []
+        for ticker in tickers:
+            if self.has_ticker(ticker):
+                found.append(ticker)
+            else:
+                self.myprint("Warning: Table " + str(ticker) +
+                             " not found in " + str(self.dbname) + ".",
+                             override=True)
+
+        #  Plain DBAPI cursor: rows go straight into the DataFrame.
+        select = ", ".join('"' + i + '"' for i in names)
+        if self.layout == "long":
+            keys = {self.ticker_id(ticker): ticker for ticker in found}
+        else:
+            keys = dict(enumerate(found))
+        records = []
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            for i in range(0, len(found), self.panel_batch):
+                batch = list(keys)[i:i + self.panel_batch]
+                if self.layout == "long":
+                    query = ("SELECT ticker_id AS k, date, " + select +
+                             ' FROM "' + self.long_table + '"'
+                             " WHERE ticker_id IN (" +
+                             ", ".join(str(j) for j in batch) + ")"
+                             " AND date BETWEEN :start AND :end")
+                else:
+                    query = " UNION ALL ".join(
+                        "SELECT " + str(j) + " AS k, date, " + select +
+                        ' FROM "' + keys[j].lower() + '"' +
+                        " WHERE date BETWEEN :start AND :end"
+                        for j in batch)
+                cursor.execute(query, {'start': start, 'end': end})
+                records.extend(cursor.fetchall())
+            cursor.close()
+        finally:
+            conn.close()
+
+        prices = pd.DataFrame.from_records(records,
+                                           columns=['k', 'date'] + names)
+        prices['k'] = prices['k'].map(keys)
+        prices[names] = prices[names].astype(float)
+        panel = self._pivot_panel(prices, tickers, columns, dtype=dtype)
+        if quarantine:
+            panel = self.validator.apply(
+                        panel, tickers,
+                        rules=None if quarantine is True else quarantine)
+        return panel
+
+    def _pivot_panel(self, prices, tickers, columns, dtype=None):
+        """Long (k, date, columns...) rows into a date by ticker frame"""
+        names = [columns] if isinstance(columns, str) else list(columns)
+        prices['date'] = pd.to_datetime(prices['date'], format="%Y-%m-%d")
+        panel = prices.pivot(index='date', columns='k', values=names)
+        return self._shape_panel(panel, tickers, columns, dtype=dtype)
+
+    @staticmethod
+    def _frames_panel(frames, tickers, columns, dtype=None):
+        """{ticker: date indexed frame of columns} into a date by ticker
+        frame, as _pivot_panel. Also used by the in-memory copies of
+        pystocks.server and pystocks.snapshot."""
+        if frames:
+            panel = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index()
+        else:
+            panel = pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+        return DBstocks._shape_panel(panel, tickers, columns, dtype=dtype)
+
+    @staticmethod
+    def _shape_panel(panel, tickers, columns, dtype=None):
+        """(column, ticker) panel with every ticker, in order, and a
+        single column level when columns is a string"""
+        names = [columns] if isinstance(columns, str) else list(columns)
+        panel = panel.reindex(columns=pd.MultiIndex.from_product(
+                                                    [names, list(tickers)]))
+        if isinstance(columns, str):
+            panel = panel.droplevel(0, axis=1)
+        if dtype is not None:
+            panel = panel.astype(dtype)
+        return panel
+
+    def iter_prices(self, tickers, start="1991-01-01", end=None,
+                    columns=None, chunksize=10000, merge=False, dtype=None):
+        """Streams prices in date ordered chunks of at most chunksize rows,
+        so memory stays bounded whatever the history length.
+
+        Yields (ticker, DataFrame) chunks, one ticker after the other, or
+        with merge=True date by ticker DataFrames as get_panel, merged
+        across tickers by date: one query per panel_batch tickers, so up to
+        chunksize rows per batch. A date is never split across chunks."""
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        if columns is None:
+            columns = 'close_h' if merge else list(self.price_columns)
+        names = [columns] if isinstance(columns, str) else list(columns)
+        if end is None:
+            end = dt.datetime.now().strftime("%Y-%m-%d")
+        found = [ticker for ticker in tickers if self.has_ticker(ticker)]
+        select = ", ".join('"' + i + '"' for i in names)
+        params = {'start': start, 'end': end}
+
+        def read(conn, query):
+            for chunk in pd.read_sql(db.text(query), con=conn, params=params,
+                                     chunksize=chunksize):
+                chunk[names] = chunk[names].astype(dtype or float)
+                yield chunk
+
+        if not merge:
+            with self.engine.connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                for ticker in found:
+                    query = ("SELECT date, " + select + " FROM " +
+                             self._ticker_source(ticker) +
+                             " AND date BETWEEN :start AND :end"
+                             " ORDER BY date")
+                    for chunk in read(conn, query):
+                        chunk['date'] = pd.to_datetime(chunk['date'],
+                                                       format="%Y-%m-%d")
+                        yield ticker, chunk.set_index('date')
+            return None
+
+        def dates(conn, batch):
+            """Rows of batch, a UNION ALL of at most panel_batch tickers,
+            in chunks of whole dates"""
+            query = (" UNION ALL ".join(
+                     "SELECT " + str(j) + " AS k, date, " + select +
+                     " FROM " + self._ticker_source(found[j]) +
+                     " AND date BETWEEN :start AND :end" for j in batch) +
+                     " ORDER BY date")
+            carry = None
+            for chunk in read(conn, query):
+                #  Rows of the last date may continue in the next chunk.
+                if carry is not None:
+                    chunk = pd.concat([carry, chunk], ignore_index=True)
+                last = chunk['date'].iloc[-1]
+                carry = chunk.loc[chunk['date'] == last]
+                chunk = chunk.loc[chunk['date'] != last]
+                if len(chunk):
+                    yield chunk
+            if carry is not None and len(carry):
+                yield carry
+
+        #  One stream per batch, merged by date: each round yields the
+        #  dates up to the earliest last date buffered.
+        batches = [range(i, min(i + self.panel_batch, len(found)))
+                   for i in range(0, len(found), self.panel_batch)]
+        keys = dict(enumerate(found))
+        with contextlib.ExitStack() as stack:
+            streams = [dates(stack.enter_context(self.engine.connect())
+                             .execution_options(stream_results=True), batch)
+                       for batch in batches]
+            buffers = [next(i, None) for i in streams]
+            while any(i is not None for i in buffers):
+                bound = min(i['date'].iloc[-1] for i in buffers
+                            if i is not None)
+                parts = []
+                for j, buffer in enumerate(buffers):
+                    if buffer is None:
+                        continue
+                    done = buffer['date'] <= bound
+                    parts.append(buffer.loc[done])
+                    buffer = buffer.loc[~done]
+                    buffers[j] = (buffer if len(buffer) else
+                                  next(streams[j], None))
+                chunk = pd.concat(parts, ignore_index=True)
+                chunk['k'] = chunk['k'].map(keys)
+                yield self._pivot_panel(chunk, tickers, columns, dtype=dtype)
+        return None
+
+    @timed("ccl")
+    def get_ccl(self, start=None, end=None, method='median'):
+        """Computes and return CCL from every BYMA / NYSE pair. method is
+        'median', 'volume' (weighted by NYSE volume) or 'trimmed' (mean).
+        See pystocks.ccl.CCL"""
+        return self.ccl_engine.get(start=start, end=end, method=method)
+
+    def get_dolar_bcra(self, fuente='dolar_bcra_a3500', start=None, end=None,
+                       timeout=None):
+        """Start and end in %Y%m%d format. timeout, in seconds, defaults to
+        self.http_timeout"""
 
         fuente = fuente.lower()
         if fuente not in self.dtickers['bcra']:
-            print('Opción no reconocida. Opciones: ' + str(opciones))
+            print('Opción no reconocida. Opciones: ' +
+                  str(self.dtickers['bcra']))
             return None
 
         value_dict = {}
 
-        if end is None:
-            dt.datetime.now().strftime("%Y%m%d")
         if start is None:
             start = dt.datetime(2002, 3, 4).strftime("%Y%m%d")
 
-        #  Downloading BCRA data
+        #  Downloading BCRA data, only if it changed since the last run.
         if fuente == 'dolar_bcra_a3500':
-            self.myprint("Dowloading a3500 data from bcra.gov.ar")
-            dlr_url = 'http://www.bcra.gov.ar/Pdfs/PublicacionesEstadisticas/com3500.xls'
-            datos = requests.get(dlr_url)
-            with open("com3500.xls", "wb") as f:
-                f.write(datos.content)
-
-            #  Cleaning up
-            usd = pd.read_excel("com3500.xls", header=4)
-            fecha = usd.iloc[:, 2]
-            valor = usd.iloc[:, 3]
-            dolar = pd.concat([fecha, valor], axis=1)
-            dolar.columns = ['fecha', 'valor']
-            dolar.set_index('fecha', inplace=True)
-            dolar = dolar.valor.dropna(how='all')
-            dolar = dolar.loc[start:end]
+            self.myprint("Checking a3500 data from bcra.gov.ar")
+            source = BCRASource(fuente, self.bcra_urls[fuente],
+                                path=self.bcra_cache,
+                                timeout=timeout or self.http_timeout,
+                                log=self.log)
+            with self.span("fetch", ticker=fuente, category='bcra'):
+                dolar = source.series()
+
+            #  Only the requested tail is upserted.
+            dolar = dolar.loc[pd.Timestamp(start):]
+            if end is not None:
+                dolar = dolar.loc[:pd.Timestamp(end)]
             dolar = dolar.to_frame()
-            value_dict['dolar_bcra_a3500'] = []
-            for row in dolar.iterrows():
-                value_dict['dolar_bcra_a3500'].append({'close':row[1].valor,
-                                                       'date':row[0]})
+            value_dict['dolar_bcra_a3500'] = self._frame_to_rows(
+                                                    dolar, {'valor': 'close'})
         return value_dict
 
     def myprint(self, string, override=False):
@@ -0,0 +1,240 @@
+import json
+import time
+import logging
+import cProfile
+import pstats
+import functools
+import threading
+import tracemalloc
+import contextlib
+import sqlalchemy as db
+
+
+class Instrument:
+    """Timing spans and SQL statement counts for DBstocks and DBstats.
+
+    A span is a dict record timed by a context manager, with the tags it
+    was opened with. Records are aggregated by name and passed to sink,
+    a callable (e.g. a metrics callback or log_sink()), when they close.
+    SQL statements run on attached engines are counted and timed into the
+    open spans of the executing thread and per ticker, the ticker being
+    the innermost ticker tag. Queries on raw DBAPI cursors (get_panel,
+    iter_prices) are only seen through the spans around them.
+
+    With profile or memory, the outermost span of a thread runs under
+    cProfile (one at a time, stats are kept in self.profiles by name) and
+    records its tracemalloc peak in bytes."""
+
+    def __init__(self, sink=None, profile=False, memory=False):
+
+        #  Called with every closed span record.
+        self.sink = sink
+
+        #  Capture modes
+        self.profile = profile
+        self.memory = memory
+
+        #  {span name: pstats.Stats}
+        self.profiles = {}
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._engines = []
+        self._profiling = False
+        self.reset()
+
+    def reset(self):
+        """Forgets the aggregated spans and statements"""
+        with self._lock:
+            self.spans = {}
+            self.sql = {}
+        return None
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def attach(self, engine):
+        """Counts and times the statements run on engine"""
+        if any(engine is i for i in self._engines):
+            return None
+        db.event.listen(engine, "before_cursor_execute", self._before)
+        db.event.listen(engine, "after_cursor_execute", self._after)
+        db.event.listen(engine, "handle_error", self._error)
+        self._engines.append(engine)
+        return None
+
+    def detach(self, engine=None):
+        """Stops listening to engine, or to every attached engine"""
+        engines = [i for i in self._engines
+                   if engine is None or engine is i]
+        for i in engines:
+            db.event.remove(i, "before_cursor_execute", self._before)
+            db.event.remove(i, "after_cursor_execute", self._after)
+            db.event.remove(i, "handle_error", self._error)
+        self._engines = [i for i in self._engines
+                         if not any(i is j for j in engines)]
+        return None
+
+    #  Start times are kept on the execution context of the statement, so
+    #  a failed statement leaves nothing behind on its connection.
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if context is not None:
+            context.pystocks_start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self._record(context)
+
+    def _error(self, exception_context):
+        """Failed statements count and take their time as the others"""
+        self._record(exception_context.execution_context)
+
+    def _record(self, context):
+        start = getattr(context, 'pystocks_start', None)
+        if start is None:
+            return None
+        context.pystocks_start = None
+        elapsed = time.perf_counter() - start
+        stack = self._stack()
+        ticker = None
+        for record in stack:
+            record['sql_count'] += 1
+            record['sql_time'] += elapsed
+            ticker = record.get('ticker', ticker)
+        with self._lock:
+            stats = self.sql.setdefault(ticker, {'count': 0, 'time': 0.})
+            stats['count'] += 1
+            stats['time'] += elapsed
+        return None
+
+    @contextlib.contextmanager
+    def span(self, name, **tags):
+        """Times the block. Yields the record, so the block can add
+        fields such as rows."""
+        stack = self._stack()
+        record = dict(tags, name=name, depth=len(stack), start=time.time(),
+                      sql_count=0, sql_time=0.)
+        profiler = self._start_capture() if not stack else None
+        stack.append(record)
+        began = time.perf_counter()
+        try:
+            yield record
+        except BaseException as error:
+            record['error'] = type(error).__name__
+            raise
+        finally:
+            record['elapsed'] = time.perf_counter() - began
+            stack.pop()
+            if profiler is not None:
+                self._stop_capture(profiler, record)
+            self._close(record)
+
+    def _start_capture(self):
+        """Returns the capture state of an outermost span, or None"""
+        if not (self.profile or self.memory):
+            return None
+        with self._lock:
+            if self._profiling:
+                return None
+            self._profiling = True
+        profiler = None
+        if self.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        traced = self.memory and not tracemalloc.is_tracing()
+        if self.memory:
+            if traced:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        return (profiler, traced)
+
+    def _stop_capture(self, capture, record):
+        profiler, traced = capture
+        if profiler is not None:
+            profiler.disable()
+            stats = pstats.Stats(profiler)
+            if record['name'] in self.profiles:
+                self.profiles[record['name']].add(stats)
+            else:
+                self.profiles[record['name']] = stats
+        if self.memory:
+            record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            if traced:
+                tracemalloc.stop()
+        with self._lock:
+            self._profiling = False
+        return None
+
+    def _close(self, record):
+        with self._lock:
+            stats = self.spans.setdefault(record['name'],
+                                          {'count': 0, 'time': 0., 'max': 0.,
+                                           'rows': 0, 'sql_count': 0,
+                                           'sql_time': 0., 'errors': 0})
+            stats['count'] += 1
+            stats['time'] += record['elapsed']
+            stats['max'] = max(stats['max'], record['elapsed'])
+            stats['rows'] += record.get('rows', 0)
+            stats['sql_count'] += record['sql_count']
+            stats['sql_time'] += record['sql_time']
+            stats['errors'] += 'error' in record
+        if self.sink is not None:
+            self.sink(record)
+        return None
+
+    def summary(self):
+        """Returns {'spans': {name: stats}, 'sql': {ticker: stats}}"""
+        with self._lock:
+            return {'spans': {i: dict(j) for i, j in self.spans.items()},
+                    'sql': {i: dict(j) for i, j in self.sql.items()}}
+
+    def report(self, top=10):
+        """Readable summary: spans by total time and the tickers with the
+        most SQL time"""
+        summary = self.summary()
+        lines = ["%-24s %7s %10s %10s %9s %7s" %
+                 ("span", "count", "total s", "max s", "rows", "sql")]
+        for name, i in sorted(summary['spans'].items(),
+                              key=lambda i: -i[1]['time']):
+            lines.append("%-24s %7d %10.4f %10.4f %9d %7d" %
+                         (name, i['count'], i['time'], i['max'], i['rows'],
+                          i['sql_count']))
+        lines.append("%-24s %7s %10s" % ("ticker", "sql", "sql s"))
+        for ticker, i in sorted(summary['sql'].items(),
+                                key=lambda i: -i[1]['time'])[:top]:
+            lines.append("%-24s %7d %10.4f" % (ticker, i['count'], i['time']))
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def null_span(name=None, **tags):
+    """Span of a disabled instrument, the record is discarded"""
+    yield {}
+
+
+def timed(name):
+    """Decorator running a method inside a span of self.instrument, when
+    there is one"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrument = self.instrument
+            if instrument is None:
+                return method(self, *args, **kwargs)
+            with instrument.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def log_sink(logger="pystocks", level=logging.INFO):
+    """Sink writing every span as a JSON log line"""
+    if isinstance(logger, str):
+        logger = logging.getLogger(logger)
+
+    def sink(record):
+        logger.log(level, json.dumps(record, default=str))
+    return sink
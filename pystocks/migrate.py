@@ -0,0 +1,99 @@
+"""Converts a wide dbprices.db (a table per ticker) into the long layout
+(a single prices table keyed by ticker_id and date). Ticker keyed tables
+(corporate actions, quarantine flags, freshness) are copied as they are.
+
+Usage:
+    python -m pystocks.migrate source.db destination.db [chunksize]
+"""
+import sys
+from pystocks.dbstocks import DBstocks
+
+
+def ticker_tables(dbs):
+    """Tables of dbs holding ticker prices"""
+    tables = []
+    for table in sorted(dbs.inspect.get_table_names()):
+        columns = [i['name'] for i in dbs.inspect.get_columns(table)]
+        if 'date' in columns and 'close' in columns:
+            tables.append(table)
+    return tables
+
+
+def keyed_tables(dbs):
+    """{table: (create function, key columns)} of the ticker keyed tables
+    of dbs, the same in both layouts"""
+    return {dbs.adjuster.table: (dbs.adjuster.create_table,
+                                 ('ticker', 'date', 'kind')),
+            dbs.validator.table: (dbs.validator.create_table,
+                                  ('ticker', 'date', 'rule')),
+            dbs.freshness_table: (dbs._create_freshness_table,
+                                  ('ticker',))}
+
+
+def copy_keyed(src, dst, chunksize=50000):
+    """Copies the ticker keyed tables of src into dst. Returns rows
+    copied per table."""
+    counts = {}
+    for table, (create, keys) in keyed_tables(dst).items():
+        if not src.has_table(table):
+            continue
+        create()
+        counts[table] = 0
+        with src.engine.connect() as conn:
+            result = conn.exec_driver_sql('SELECT * FROM "' + table + '"')
+            query = dst._upsert_sql(table, list(result.keys()), keys=keys)
+            while True:
+                rows = result.fetchmany(chunksize)
+                if not rows:
+                    break
+                with dst.engine.begin() as out:
+                    out.exec_driver_sql(query, [tuple(i) for i in rows])
+                counts[table] += len(rows)
+    dst.validator._flagged = None
+    return counts
+
+
+def migrate(source, destination, chunksize=50000, log=True):
+    """Streams every ticker table of source into the long layout db
+    destination, chunksize rows at a time, then copies the ticker keyed
+    tables. Returns per ticker counts."""
+    src = DBstocks(dbname=source, log=False, layout="wide")
+    dst = DBstocks(dbname=destination, log=False, layout="long",
+                   chunksize=chunksize)
+    counts = {}
+    conn = src.engine.raw_connection()
+    try:
+        for table in ticker_tables(src):
+            if log:
+                print("[migrate] " + table)
+            counts[table] = {'inserted': 0, 'updated': 0, 'failed': 0}
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM "' + table + '" ORDER BY date')
+            columns = [i[0] for i in cursor.description]
+            date = columns.index('date')
+            columns = ['date'] + [i for i in columns if i != 'date']
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                rows = [(row[date],) + row[:date] + row[date + 1:]
+                        for row in rows]
+                res = dst._upsert_rows(table, columns, rows)
+                for i in res:
+                    counts[table][i] += res[i]
+            cursor.close()
+    finally:
+        conn.close()
+    for table, rows in copy_keyed(src, dst, chunksize).items():
+        if log:
+            print("[migrate] " + table + ": " + str(rows) + " rows")
+    return counts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        raise SystemExit(__doc__)
+    chunksize = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+    counts = migrate(sys.argv[1], sys.argv[2], chunksize=chunksize)
+    print("[migrate] " + str(len(counts)) + " tickers, " +
+          str(sum(i['inserted'] for i in counts.values())) + " rows")
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+
+class SinceStats:
+    """Incremental "variation since X" statistics over a price panel.
+
+    Keeps, per ticker, the last known price, the running max and min and
+    the price at each anchor date in NumPy arrays, so new rows are folded
+    in with O(new rows x tickers) work whatever the history length. The
+    last row is always folded in again, as a second update of the same day
+    may revise it; revisions of earlier rows need a new SinceStats.
+    Results match the former pandas DBstats.compute_var_since, which
+    forward fills the panel from start."""
+
+    def __init__(self, tickers, start=None, anchors=None):
+
+        #  Columns of the panel and first date taken into account.
+        self.tickers = list(tickers)
+        self.start = None if start is None else pd.Timestamp(start)
+
+        #  Last processed date, and the state before its row was folded in.
+        self.last_date = None
+        self._checkpoint = None
+
+        n = len(self.tickers)
+        self.last = np.full(n, np.nan)
+        self.vmax = np.full(n, np.nan)
+        self.vmin = np.full(n, np.nan)
+
+        #  {name: [anchor date, prices or None until the date is reached]}
+        self.anchors = {}
+        for name, date in (anchors or {}).items():
+            self.add_anchor(name, date)
+
+    def add_anchor(self, name, date):
+        """Tracks the variation since date as name"""
+        date = pd.Timestamp(date)
+        if self.last_date is not None and date < self.last_date:
+            raise ValueError("Anchor " + str(name) + " is before the last "
+                             "processed date, rebuild SinceStats with it.")
+        self.anchors[name] = [date, None]
+        return None
+
+    def _fill(self, last, block):
+        """Forward fills last with the rows of block"""
+        valid = ~np.isnan(block)
+        has = valid.any(axis=0)
+        pos = len(block) - 1 - np.argmax(valid[::-1], axis=0)
+        last = last.copy()
+        last[has] = block[pos[has], np.flatnonzero(has)]
+        return last
+
+    def update(self, data):
+        """Folds in the rows of data (date by ticker) from the last
+        processed date on. The row of that date is folded in again, over
+        the state before it, so a revised last row replaces the former one.
+        Returns self."""
+        if self.start is not None:
+            data = data.loc[self.start:]
+        if self.last_date is not None:
+            data = data.iloc[data.index.searchsorted(self.last_date,
+                                                     side='left'):]
+        data = data.reindex(columns=self.tickers)
+        if len(data) == 0:
+            return self
+
+        block = data.to_numpy(dtype=float)
+        dates = data.index
+        if self.last_date is not None:
+            self._restore()
+        if len(block) > 1:
+            self._fold(dates[:-1], block[:-1])
+        self._checkpoint = self._state()
+        self._fold(dates[-1:], block[-1:])
+        self.last_date = dates[-1]
+        return self
+
+    def _fold(self, dates, block):
+        """Folds in the rows of block, dated dates"""
+        for name, anchor in self.anchors.items():
+            if anchor[1] is None and dates[-1] >= anchor[0]:
+                pos = int(np.searchsorted(dates, anchor[0]))
+                anchor[1] = self._fill(self.last, block[:pos + 1])
+
+        self.last = self._fill(self.last, block)
+        self.vmax = np.fmax(self.vmax, np.fmax.reduce(block, axis=0))
+        self.vmin = np.fmin(self.vmin, np.fmin.reduce(block, axis=0))
+        return None
+
+    def _state(self):
+        """State to restore before folding the last row in again. Arrays
+        are replaced on every fold, never written in place."""
+        return (self.last, self.vmax, self.vmin,
+                {name: anchor[1] for name, anchor in self.anchors.items()})
+
+    def _restore(self):
+        self.last, self.vmax, self.vmin, anchors = self._checkpoint
+        for name, anchor in self.anchors.items():
+            anchor[1] = anchors.get(name)
+        return None
+
+    def _ranking(self, values, name=None):
+        return pd.Series(values, index=self.tickers,
+                         name=name).dropna().sort_values()
+
+    def since(self, kind):
+        """Variation (%) since kind: 'max', 'min' or an anchor name"""
+        if kind in ('max', 'min'):
+            #  Like dropna().iloc[-1] on the forward filled panel.
+            if np.isnan(self.last).any():
+                raise IndexError("Some tickers have no prices since " +
+                                 str(self.start))
+            ref = self.vmax if kind == 'max' else self.vmin
+            return self._ranking(100. * (self.last / ref - 1.),
+                                 name=self.last_date)
+        elif kind in self.anchors:
+            ref = self.anchors[kind][1]
+            if ref is None:
+                raise IndexError("No prices since " +
+                                 str(self.anchors[kind][0]))
+        else:
+            raise KeyError(kind)
+        return self._ranking(100. * (self.last / ref - 1.))
+
+    def variations(self):
+        """{kind: variation} for max, min and every anchor"""
+        return {kind: self.since(kind)
+                for kind in ['max', 'min'] + list(self.anchors)}
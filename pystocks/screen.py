@@ -0,0 +1,273 @@
+import os
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+def _rolling(values, window, func=None):
+    """Rolling sums of values (and of func(values)) over window rows with
+    cumulative sums. NaN unless the whole window is valid."""
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.)
+    sums = [filled] if func is None else [filled, func(filled)]
+    count = np.cumsum(valid, axis=0)
+    count = count[window - 1:] - np.vstack([np.zeros((1, values.shape[1])),
+                                            count[:-window]])
+    out = []
+    for i in sums:
+        total = np.cumsum(i, axis=0)
+        total = total[window - 1:] - np.vstack(
+                        [np.zeros((1, values.shape[1])), total[:-window]])
+        res = np.full(values.shape, np.nan)
+        res[window - 1:] = np.where(count == window, total, np.nan)
+        out.append(res)
+    return out
+
+
+def label(rule):
+    """'name(param=value, ...)' for a rule tuple"""
+    name, params = rule[0], rule[1] if len(rule) > 1 else {}
+    return name + "(" + ", ".join(str(i) + "=" + str(params[i])
+                                  for i in sorted(params)) + ")"
+
+
+class Screener:
+    """Vectorized rules and backtests over a date by ticker USD price
+    panel, e.g. DBstats.data_usd, forward filled into a contiguous float
+    matrix.
+
+    A rule is a (name, {param: value}) tuple evaluated on every date and
+    ticker at once. Scores rank tickers, higher is better; filters are
+    (rule, low, high) bounds on rule values."""
+
+    rules = ('price', 'sma_ratio', 'ma_cross', 'momentum', 'drawdown',
+             'volatility', 'relative_strength')
+
+    #  Trading days per year, for annualized figures.
+    year = 252
+
+    #  Rule results kept for reuse across a parameter grid.
+    memo_size = 64
+
+    def __init__(self, data):
+        data = data.ffill()
+        self.dates = data.index
+        self.tickers = list(data.columns)
+        self.prices = np.ascontiguousarray(data.to_numpy(dtype=float))
+        self._memo = OrderedDict()
+        #  {hold: returns}, see returns()
+        self._returns = {}
+
+    #  Rules: each returns a date by ticker matrix.
+
+    def price(self):
+        return self.prices
+
+    def sma_ratio(self, window=50):
+        """Price over its moving average, minus 1"""
+        mean = _rolling(self.prices, window)[0] / window
+        return self.prices / mean - 1.
+
+    def ma_cross(self, fast=20, slow=100):
+        """Fast over slow moving average, minus 1"""
+        return (self.compute('sma_ratio', {'window': slow}) + 1.) / \
+               (self.compute('sma_ratio', {'window': fast}) + 1.) - 1.
+
+    def momentum(self, window=120, skip=0):
+        """Return over window rows, ending skip rows ago"""
+        out = np.full(self.prices.shape, np.nan)
+        end = self.prices[window:len(self.prices) - skip]
+        out[window + skip:] = end / self.prices[:len(end)] - 1.
+        return out
+
+    def drawdown(self, window=None):
+        """Price over its running (or rolling window) max, minus 1"""
+        if window is None:
+            peak = np.fmax.accumulate(self.prices, axis=0)
+        else:
+            peak = pd.DataFrame(self.prices).rolling(
+                        window, min_periods=1).max().to_numpy()
+        return self.prices / peak - 1.
+
+    def volatility(self, window=60):
+        """Annualized rolling volatility of daily log returns"""
+        returns = np.full(self.prices.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[1:] = np.log(self.prices[1:] / self.prices[:-1])
+        total, squares = _rolling(returns, window, np.square)
+        var = (squares - total * total / window) / (window - 1)
+        return np.sqrt(np.maximum(var, 0.) * self.year)
+
+    def relative_strength(self, window=120):
+        """Momentum over the median momentum of the universe (in USD, so
+        peers are compared at the CCL)"""
+        mom = self.compute('momentum', {'window': window})
+        with np.errstate(invalid='ignore'):
+            peers = np.full(len(mom), np.nan)
+            some = ~np.isnan(mom).all(axis=1)
+            peers[some] = np.nanmedian(mom[some], axis=1)
+        return (1. + mom) / (1. + peers[:, None]) - 1.
+
+    def compute(self, name, params=None):
+        """Matrix of rule name with params, memoized"""
+        if name not in self.rules:
+            raise ValueError("Unknown rule " + str(name) + ". Rules: " +
+                             str(self.rules))
+        params = dict(params or {})
+        key = (name, tuple(sorted(params.items())))
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = getattr(self, name)(**params)
+        self._memo[key] = value
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return value
+
+    def _score(self, score, filters=(), step=1):
+        """Score matrix, every step rows, with NaN where a filter fails"""
+        score = self.compute(*score)[::step].copy()
+        for rule, low, high in filters:
+            value = self.compute(*rule)[::step]
+            with np.errstate(invalid='ignore'):
+                fail = np.isnan(value)
+                if low is not None:
+                    fail |= value < low
+                if high is not None:
+                    fail |= value > high
+            score[fail] = np.nan
+        return score
+
+    def screen(self, score, filters=(), date=None, top=None):
+        """Ranked tickers on date (default, the last) by score, with the
+        value of every filter rule"""
+        pos = -1 if date is None else int(self.dates.get_indexer(
+                                [pd.Timestamp(date)], method='ffill')[0])
+        if pos == -1 and date is not None:
+            raise ValueError("No prices on or before " + str(date) +
+                             ", the panel starts on " +
+                             str(self.dates[0].date()))
+        result = pd.DataFrame({'score': self._score(score, filters)[pos]},
+                              index=self.tickers)
+        for rule, low, high in filters:
+            result[label(rule)] = self.compute(*rule)[pos]
+        result = result.dropna(subset=['score'])
+        result = result.sort_values('score', ascending=False)
+        return result if top is None else result.head(top)
+
+    def returns(self, hold=None):
+        """Daily simple returns, 0 where unknown. With hold, returns from
+        row 1 on are split in (periods, hold, tickers), zero padded."""
+        if None not in self._returns:
+            returns = np.zeros(self.prices.shape)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns[1:] = self.prices[1:] / self.prices[:-1] - 1.
+            returns[~np.isfinite(returns)] = 0.
+            self._returns[None] = returns
+        if hold not in self._returns:
+            returns = self._returns[None][1:]
+            periods = -(-len(returns) // hold)
+            padded = np.zeros((periods * hold, returns.shape[1]))
+            padded[:len(returns)] = returns
+            self._returns[hold] = padded.reshape(periods, hold, -1)
+        return self._returns[hold]
+
+    def backtest(self, score, filters=(), top=10, hold=21):
+        """Equal weight portfolio of the top tickers by score, chosen every
+        hold rows and held until the next choice. Returns (daily returns,
+        metrics)."""
+        choice = self._score(score, filters, step=hold)
+        rows, n = self.prices.shape
+
+        #  Holdings picked at each rebalance row.
+        picks = np.zeros(choice.shape)
+        ranked = np.where(np.isnan(choice), -np.inf, choice)
+        k = min(top, n)
+        if k:
+            best = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+            chosen = np.take_along_axis(ranked, best, axis=1) > -np.inf
+            np.put_along_axis(picks, best, chosen.astype(float), axis=1)
+        count = picks.sum(axis=1, keepdims=True)
+        weights = np.divide(picks, count, out=np.zeros_like(picks),
+                            where=count > 0)
+
+        #  Held from the close of the pick row to the next pick.
+        daily = np.zeros(rows)
+        if rows > 1:
+            periods = self.returns(hold)
+            daily[1:] = np.einsum('phn,pn->ph', periods,
+                                  weights[:len(periods)]).ravel()[:rows - 1]
+        return daily, self.metrics(daily)
+
+    def metrics(self, daily):
+        """Total return, CAGR, volatility, Sharpe and max drawdown of daily
+        returns"""
+        if len(daily) == 0:
+            return {'total': 0., 'cagr': 0., 'volatility': 0., 'sharpe': 0.,
+                    'max_drawdown': 0.}
+        equity = np.cumprod(1. + daily)
+        years = len(daily) / self.year
+        vol = float(daily.std() * np.sqrt(self.year))
+        peak = np.maximum.accumulate(equity)
+        return {'total': float(equity[-1] - 1.),
+                'cagr': float(equity[-1] ** (1. / years) - 1.),
+                'volatility': vol,
+                'sharpe': float(daily.mean() * self.year / vol) if vol > 0
+                          else 0.,
+                'max_drawdown': float((equity / peak - 1.).min())}
+
+    def grid(self, rule, params, filters=(), top=(10,), hold=(21,),
+             metric='sharpe', workers=None):
+        """Backtests score rule over every combination of params ({param:
+        values}), top and hold, in workers processes (default one per
+        core, 1 to run here). Returns a DataFrame ranked by metric."""
+        names = list(params)
+        combos = [dict(zip(names, i)) for i in
+                  itertools.product(*[params[j] for j in names])]
+        tasks = [(rule, combo, tuple(filters), t, h) for combo in combos
+                 for t in top for h in hold]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(tasks)))
+        if workers == 1:
+            results = [self._run(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(self,)) as pool:
+                results = list(pool.map(_run_task, tasks,
+                                        chunksize=max(1, len(tasks) //
+                                                      (workers * 4))))
+        rows = []
+        for (rule, combo, filters, t, h), result in zip(tasks, results):
+            rows.append(dict(combo, top=t, hold=h, **result))
+        table = pd.DataFrame(rows)
+        if len(table):
+            table = table.sort_values(metric, ascending=False)
+        return table.reset_index(drop=True)
+
+    def _run(self, task):
+        rule, combo, filters, top, hold = task
+        return self.backtest((rule, combo), filters, top=top, hold=hold)[1]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_memo'] = OrderedDict()
+        state['_returns'] = {}
+        return state
+
+
+#  Screener of each worker process, sent once when the pool starts.
+_worker = None
+
+
+def _init_worker(screener):
+    global _worker
+    _worker = screener
+
+
+def _run_task(task):
+    return _worker._run(task)
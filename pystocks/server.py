@@ -0,0 +1,489 @@
+"""Read-only query server over a price database.
+
+The server holds the whole history of every ticker in memory (a
+DBstocks PriceCache) and answers price, panel and CCL queries as compact
+binary frames, or Arrow IPC streams when pyarrow is installed. Concurrent
+identical requests are computed once. Writes made by other processes are
+picked up from the change log of the db, reloading only the rows written.
+
+Usage:
+    python -m pystocks.server dbprices.db [port] [refresh_seconds]
+"""
+import sys
+import json
+import time
+import struct
+import threading
+import http.client
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+from pystocks.dbstocks import DBstocks
+from pystocks.cache import PriceCache
+from pystocks.migrate import ticker_tables
+
+#  Compact frame: magic, header length, JSON header, int32 day ordinals
+#  and column major values, each part 8 byte aligned.
+MAGIC = b"PSF1"
+FRAME_TYPE = "application/x-pystocks-frame"
+
+#  Start of a whole history query.
+FIRST = "1900-01-01"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def _pad(size):
+    return b"\0" * (-size % 8)
+
+
+def stored_tickers(dbs):
+    """Tickers with prices in dbs"""
+    if dbs.layout == "long":
+        return sorted(dbs.ticker_ids(refresh=True))
+    return ticker_tables(dbs)
+
+
+def encode_frame(frame):
+    """Date indexed DataFrame into compact bytes, see decode_frame"""
+    values = frame.to_numpy()
+    if values.dtype.kind != 'f':
+        values = values.astype(float)
+    columns = [list(i) if isinstance(i, tuple) else i for i in frame.columns]
+    header = json.dumps({'rows': len(frame),
+                         'columns': columns,
+                         'index': frame.index.name,
+                         'unit': getattr(frame.index, 'unit', 'ns'),
+                         'dtype': values.dtype.str}).encode()
+    head = MAGIC + struct.pack("<I", len(header)) + header
+    head += _pad(len(head))
+    days = frame.index.values.astype("datetime64[D]").astype("<i4")
+    index = days.tobytes()
+    return b"".join([head, index, _pad(len(index)),
+                     np.asarray(values.T, order='C').tobytes()])
+
+
+def decode_frame(buffer):
+    """DataFrame viewing buffer, no copies of the values are made. Pass a
+    bytearray to get a writable frame."""
+    if bytes(buffer[:4]) != MAGIC:
+        raise ValueError("Not a pystocks frame")
+    size = struct.unpack("<I", bytes(buffer[4:8]))[0]
+    header = json.loads(bytes(buffer[8:8 + size]))
+    offset = 8 + size
+    offset += -offset % 8
+    rows = header['rows']
+    days = np.frombuffer(buffer, dtype="<i4", count=rows, offset=offset)
+    offset += 4 * rows
+    offset += -offset % 8
+    columns = header['columns']
+    values = np.frombuffer(buffer, dtype=header['dtype'],
+                           count=rows * len(columns), offset=offset)
+    index = pd.DatetimeIndex(days.astype("datetime64[D]"),
+                             name=header['index']).as_unit(header['unit'])
+    if columns and isinstance(columns[0], list):
+        columns = pd.MultiIndex.from_tuples([tuple(i) for i in columns])
+    return pd.DataFrame(values.reshape(len(columns), rows).T, index=index,
+                        columns=columns, copy=False)
+
+
+def encode_arrow(frame):
+    """DataFrame into an Arrow IPC stream. Needs pyarrow."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(frame)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_arrow(buffer):
+    """DataFrame from an Arrow IPC stream. Needs pyarrow."""
+    import pyarrow as pa
+    return pa.ipc.open_stream(pa.py_buffer(buffer)).read_all().to_pandas()
+
+
+class PriceServer:
+    """Warm, read-only copy of a price db served over HTTP.
+
+    GET /prices?ticker=&start=&end=
+    GET /panel?tickers=a,b&columns=close_h,volnom&start=&end=&dtype=
+        &quarantine=all|jump,stale
+    GET /ccl?start=&end=&method=
+    GET /changes?after=
+    GET /tickers, GET /stats, POST /refresh
+
+    Frames are returned as compact binary frames, or Arrow with
+    format=arrow. refresh, in seconds, polls the change log of the db."""
+
+    def __init__(self, dbname=None, host="127.0.0.1", port=8765,
+                 refresh=None, max_bytes=2**30):
+
+        #  DB handle, prices are served from its cache.
+        self.dbs = DBstocks(dbname=dbname, log=False,
+                            cache=PriceCache(max_bytes=max_bytes))
+
+        self.host = host
+        self.port = port
+        self.refresh_interval = refresh
+
+        #  Last change log entry applied.
+        self.seq = 0
+
+        #  Stored tickers, lower case.
+        self.tickers = []
+
+        self.stats = {'requests': 0, 'batched': 0, 'refreshes': 0,
+                      'errors': 0}
+
+        #  {request key: [Event, result, error]} being computed
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.httpd = None
+
+    def stored_tickers(self):
+        """Tickers with prices in the db"""
+        return stored_tickers(self.dbs)
+
+    def load(self):
+        """Reads the whole history of every ticker into memory"""
+        changes = self.dbs.get_changes()
+        self.seq = changes[-1][0] if changes else 0
+        self.tickers = self.stored_tickers()
+        for ticker in self.tickers:
+            self.dbs.get_prices(ticker, FIRST)
+        return None
+
+    def refresh(self):
+        """Applies the writes logged since the last refresh: only the rows
+        from the first date written are read again. Returns the tickers
+        reloaded."""
+        changes = self.dbs.get_changes(self.seq)
+        if not changes:
+            return []
+        since = {}
+        for seq, ticker, start in changes:
+            since[ticker] = min(start, since.get(ticker, start))
+        for ticker, start in since.items():
+            self.dbs.cache.written(self.dbs.cache_key(ticker), start)
+        self.dbs.ccl_engine.clear()
+
+        #  Writes may also have created tables, e.g. the quarantine one.
+        self.dbs.table_names(refresh=True)
+        if any(i not in self.tickers for i in since):
+            self.tickers = self.stored_tickers()
+        for ticker in since:
+            self.dbs.get_prices(ticker, FIRST)
+        self.seq = changes[-1][0]
+        self.stats['refreshes'] += 1
+        return sorted(since)
+
+    def prices(self, ticker, start=FIRST, end=None):
+        """Prices of ticker, as DBstocks.get_prices"""
+        if ticker.lower() not in self.tickers:
+            raise KeyError("Unknown ticker " + str(ticker))
+        return self.dbs.get_prices(ticker, start, end=end)
+
+    def panel(self, tickers, columns="close_h", start="1991-01-01",
+              end=None, dtype=None, quarantine=None):
+        """Date by ticker frame, as DBstocks.get_panel, built from the
+        copies in memory. Quarantine flags are read from the db."""
+        names = [columns] if isinstance(columns, str) else list(columns)
+        frames = {}
+        for ticker in tickers:
+            if ticker.lower() in self.tickers:
+                frames[ticker] = self.prices(ticker, start, end)[names]
+        panel = DBstocks._frames_panel(frames, tickers, columns, dtype=dtype)
+        if quarantine:
+            panel = self.dbs.validator.apply(
+                        panel, tickers,
+                        rules=None if quarantine is True else quarantine)
+        return panel
+
+    def ccl(self, start=None, end=None, method='median'):
+        """CCL rate, as DBstocks.get_ccl"""
+        return self.dbs.get_ccl(start=start, end=end, method=method)
+
+    def changes(self, after=None):
+        """{'seq', 'changes'}: the last change log entry applied, and the
+        [seq, ticker, since] entries after after up to it. Entries not
+        applied yet are left out, as their rows are not served."""
+        seq = self.seq
+        if after is None:
+            return {'seq': seq, 'changes': []}
+        return {'seq': seq,
+                'changes': [list(i) for i in self.dbs.get_changes(int(after))
+                            if i[0] <= seq]}
+
+    def batched(self, key, func):
+        """Runs func once for concurrent calls with the same key, every
+        caller gets the same result"""
+        with self._lock:
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = [threading.Event(), None, None]
+            else:
+                self.stats['batched'] += 1
+        if not owner:
+            flight[0].wait()
+        else:
+            try:
+                flight[1] = func()
+            except Exception as error:
+                flight[2] = error
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight[0].set()
+        if flight[2] is not None:
+            raise flight[2]
+        return flight[1]
+
+    def answer(self, path, params):
+        """Returns (content type, body) for a request"""
+        arrow = params.get('format') == 'arrow'
+        encode = encode_arrow if arrow else encode_frame
+        kind = ARROW_TYPE if arrow else FRAME_TYPE
+        if path == "/prices":
+            return kind, encode(self.prices(params['ticker'],
+                                            params.get('start', FIRST),
+                                            params.get('end')))
+        if path == "/panel":
+            columns = params.get('columns', "close_h").split(",")
+            if len(columns) == 1:
+                columns = columns[0]
+            quarantine = params.get('quarantine')
+            if quarantine:
+                quarantine = (True if quarantine == "all" else
+                              quarantine.split(","))
+            return kind, encode(self.panel(params['tickers'].split(","),
+                                           columns,
+                                           params.get('start', "1991-01-01"),
+                                           params.get('end'),
+                                           dtype=params.get('dtype'),
+                                           quarantine=quarantine))
+        if path == "/ccl":
+            return kind, encode(self.ccl(params.get('start'),
+                                         params.get('end'),
+                                         params.get('method', 'median')))
+        if path == "/changes":
+            return "application/json", json.dumps(
+                self.changes(params.get('after'))).encode()
+        if path == "/tickers":
+            return "application/json", json.dumps(self.tickers).encode()
+        if path == "/stats":
+            stats = dict(self.stats, seq=self.seq, tickers=len(self.tickers),
+                         cache=self.dbs.cache.stats,
+                         cache_bytes=self.dbs.cache.nbytes())
+            return "application/json", json.dumps(stats).encode()
+        if path == "/refresh":
+            return "application/json", json.dumps(self.refresh()).encode()
+        raise LookupError(path)
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                server.stats['requests'] += 1
+                try:
+                    if url.path == "/refresh":
+                        kind, body = server.answer(url.path, params)
+                    else:
+                        key = (url.path, tuple(sorted(params.items())))
+                        kind, body = server.batched(
+                            key, lambda: server.answer(url.path, params))
+                    status = 200
+                except LookupError as error:
+                    status, kind = 404, "text/plain"
+                    body = str(error).encode()
+                except (ValueError, TypeError) as error:
+                    status, kind = 400, "text/plain"
+                    body = str(error).encode()
+                except Exception as error:
+                    status, kind = 500, "text/plain"
+                    body = str(error).encode()
+                if status != 200:
+                    server.stats['errors'] += 1
+                self.send_response(status)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Loads the db and serves in background threads. Returns self."""
+        self.load()
+        self.httpd = ThreadingHTTPServer((self.host, self.port),
+                                         self.handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True,
+                         name="pystocks-server").start()
+        if self.refresh_interval:
+            threading.Thread(target=self._poll, daemon=True,
+                             name="pystocks-refresh").start()
+        return self
+
+    def _poll(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as error:
+                print("[server] Could not refresh: " + str(error))
+
+    @property
+    def url(self):
+        return "http://" + self.host + ":" + str(self.port)
+
+    def shutdown(self):
+        self._stop.set()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        self.dbs.close()
+        return None
+
+
+class QueryClient:
+    """Read-only, DBstocks compatible proxy to a PriceServer. Can replace
+    the db handle of DBstats, e.g. DBstats(dbs=QueryClient(url))."""
+
+    dtickers = DBstocks.dtickers
+    price_columns = DBstocks.price_columns
+
+    #  No local instrumentation, see pystocks.instrument
+    instrument = None
+
+    def __init__(self, url="http://127.0.0.1:8765", timeout=60, arrow=False):
+        url = urllib.parse.urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port
+        self.timeout = timeout
+
+        #  Ask for Arrow IPC streams instead of compact frames.
+        self.arrow = arrow
+        self._local = threading.local()
+
+    def _request(self, path, params=None, method="GET"):
+        """Response body as a bytearray. The connection of the thread is
+        kept alive and opened again once if it was dropped."""
+        query = urllib.parse.urlencode({i: j for i, j in
+                                        (params or {}).items()
+                                        if j is not None})
+        target = path + ("?" + query if query else "")
+        for attempt in (0, 1):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = http.client.HTTPConnection(self.host, self.port,
+                                                  timeout=self.timeout)
+                self._local.conn = conn
+            try:
+                conn.request(method, target)
+                res = conn.getresponse()
+                body = bytearray(int(res.getheader("Content-Length", 0)))
+                res.readinto(body)
+                break
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        if res.status == 404:
+            raise KeyError(bytes(body).decode())
+        if res.status != 200:
+            raise ValueError(bytes(body).decode())
+        return body
+
+    def _frame(self, path, params):
+        if self.arrow:
+            params = dict(params, format='arrow')
+            return decode_arrow(self._request(path, params))
+        return decode_frame(self._request(path, params))
+
+    def _json(self, path, params=None, method="GET"):
+        return json.loads(bytes(self._request(path, params, method=method)))
+
+    def get_prices(self, ticker, start, end=None, dt_index=True):
+        """See DBstocks.get_prices"""
+        prices = self._frame("/prices", {'ticker': ticker.lower(),
+                                         'start': start, 'end': end})
+        if not dt_index:
+            prices = prices.reset_index()
+            prices['date'] = prices['date'].dt.strftime("%Y-%m-%d")
+        return prices
+
+    def get_panel(self, tickers, columns="close_h", start="1991-01-01",
+                  end=None, dtype=None, quarantine=None):
+        """See DBstocks.get_panel"""
+        names = columns if isinstance(columns, str) else ",".join(columns)
+        if quarantine:
+            quarantine = ("all" if quarantine is True else
+                          ",".join(quarantine))
+        return self._frame("/panel", {'tickers': ",".join(tickers),
+                                      'columns': names, 'start': start,
+                                      'end': end, 'dtype': dtype,
+                                      'quarantine': quarantine or None})
+
+    def get_ccl(self, start=None, end=None, method='median'):
+        """See DBstocks.get_ccl"""
+        return self._frame("/ccl", {'start': start, 'end': end,
+                                    'method': method})
+
+    def tickers(self):
+        """Tickers stored in the served db"""
+        return self._json("/tickers")
+
+    def has_ticker(self, ticker):
+        return ticker.lower() in self.tickers()
+
+    def refresh(self):
+        """Makes the server apply pending writes. Returns the tickers
+        reloaded."""
+        return self._json("/refresh", method="POST")
+
+    def get_changes(self, after=0):
+        """See DBstocks.get_changes, up to the last change the server
+        applied"""
+        return [tuple(i) for i in
+                self._json("/changes", {'after': after})['changes']]
+
+    def last_change(self):
+        """See DBstocks.last_change, the last change the server applied"""
+        return self._json("/changes")['seq']
+
+    def stats(self):
+        return self._json("/stats")
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        return None
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    refresh = float(sys.argv[3]) if len(sys.argv) > 3 else 60.
+    server = PriceServer(sys.argv[1], port=port, refresh=refresh).start()
+    print("[server] " + str(len(server.tickers)) + " tickers on " +
+          server.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,286 @@
+"""Columnar snapshots of a price database, for distribution and fast
+read-only loads.
+
+A snapshot file holds a block per ticker, each a compact frame (see
+pystocks.server.encode_frame: int32 day ordinals and column major
+values) of the columns that are not all null, optionally byte shuffled
+and zlib compressed, and a JSON footer indexing the blocks. Uncompressed
+snapshots are memory mapped, so opening one reads only the footer and a
+ticker only touches its own pages.
+
+A delta snapshot holds the rows written since a change log seq (see
+DBstocks.get_changes), for daily increments. Deltas are imported into a
+db as any snapshot, or applied on top of a Snapshot when reading.
+
+Usage:
+    python -m pystocks.snapshot export dbprices.db prices.pss [after] [codec]
+    python -m pystocks.snapshot import prices.pss dbprices.db
+"""
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import datetime as dt
+import numpy as np
+import pandas as pd
+from pystocks.dbstocks import DBstocks
+from pystocks.server import (FIRST, encode_frame, decode_frame, _pad,
+                             stored_tickers)
+
+#  Layout: magic and padding, 8 byte aligned blocks, JSON footer, footer
+#  length and magic.
+MAGIC = b"PSS1"
+VERSION = 1
+CODECS = (None, "zlib")
+
+
+def _shuffle(block):
+    """Bytes of block grouped by position in each 8 byte word. Exponents
+    and high mantissa bytes of nearby prices repeat, so they compress."""
+    return np.frombuffer(block, dtype=np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def _unshuffle(block):
+    return bytearray(np.frombuffer(block, dtype=np.uint8).reshape(
+                                                        8, -1).T.tobytes())
+
+
+def export_snapshot(dbs, path, after=None, codec="zlib", tickers=None,
+                    level=6):
+    """Writes the prices of tickers (default, every stored ticker) of dbs to
+    path. With after, a change log seq, only the rows written since then
+    are exported, as a delta. Returns the footer."""
+    if codec not in CODECS:
+        raise ValueError("Unknown codec " + str(codec) + ". Codecs: " +
+                         str(CODECS))
+
+    #  The log is read first: rows written meanwhile go to the next delta.
+    changes = dbs.get_changes(after=after or 0)
+    seq = changes[-1][0] if changes else (after or 0)
+    if after is None:
+        since = {i.lower(): FIRST for i in (tickers or stored_tickers(dbs))}
+    else:
+        since = {}
+        for key, ticker, start in changes:
+            since[ticker] = min(since.get(ticker, start), start)
+        if tickers is not None:
+            since = {i.lower(): since[i.lower()] for i in tickers
+                     if i.lower() in since}
+
+    footer = {'version': VERSION,
+              'kind': 'full' if after is None else 'delta',
+              'after': after,
+              'seq': seq,
+              'codec': codec,
+              'created': dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+              'columns': list(dbs.price_columns),
+              'tickers': {},
+              'events': {}}
+    adjuster = dbs.adjuster
+    for ticker in adjuster.tickers():
+        events = adjuster.get_events(ticker)
+        footer['events'][ticker] = events.values.tolist()
+
+    temp = str(path) + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(MAGIC + _pad(len(MAGIC)))
+        offset = 8
+        for ticker in sorted(since):
+            prices = dbs._read_prices(ticker, since[ticker], "9999-12-31")
+
+            #  Columns never populated (vol, start_h, ...) are not stored.
+            prices = prices.loc[:, prices.notna().any().to_numpy()]
+            block = encode_frame(prices)
+            if codec == "zlib":
+                block = zlib.compress(_shuffle(block), level)
+            f.write(block + _pad(len(block)))
+            entry = {'offset': offset, 'size': len(block),
+                     'rows': len(prices), 'columns': list(prices.columns)}
+            if len(prices):
+                entry['first'] = prices.index[0].strftime("%Y-%m-%d")
+                entry['last'] = prices.index[-1].strftime("%Y-%m-%d")
+            if after is not None:
+                entry['since'] = since[ticker]
+            footer['tickers'][ticker] = entry
+            offset += len(block) + len(_pad(len(block)))
+        data = json.dumps(footer).encode()
+        f.write(data + struct.pack("<Q", len(data)) + MAGIC)
+    os.replace(temp, path)
+    return footer
+
+
+def read_footer(path):
+    """Footer of the snapshot at path"""
+    with open(path, "rb") as f:
+        return _read_footer(f)
+
+
+def _read_footer(f):
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    f.seek(0)
+    if end < 20 or f.read(4) != MAGIC:
+        raise ValueError("Not a pystocks snapshot")
+    f.seek(end - 12)
+    size, magic = struct.unpack("<Q4s", f.read(12))
+    if magic != MAGIC:
+        raise ValueError("Truncated pystocks snapshot")
+    f.seek(end - 12 - size)
+    return json.loads(f.read(size))
+
+
+def import_snapshot(dbs, path):
+    """Upserts every ticker of the snapshot (full or delta) at path into
+    dbs. Adjusted columns are taken as stored, events are stored without
+    recomputing. Returns {ticker: counts} as DBstocks._upsert_data."""
+    counts = {}
+    with Snapshot(path) as snapshot:
+        for ticker in snapshot.tickers:
+            prices = snapshot.block(ticker)
+            columns = {i: i for i in prices.columns}
+            names, rows = dbs._frame_to_rows(prices, columns)
+            dbs.myprint("Importing " + str(len(rows)) + " rows of " + ticker)
+            counts[ticker] = dbs._upsert_rows(ticker, names, rows)
+        for ticker, events in snapshot.footer['events'].items():
+            dbs.adjuster.add_events(ticker, events, recompute=False)
+    return counts
+
+
+class Snapshot:
+    """Read-only prices of a snapshot file, with DBstocks compatible
+    get_prices / get_panel. Deltas given (or passed to apply) are applied
+    on top, in change log order."""
+
+    def __init__(self, path, deltas=()):
+        self.path = str(path)
+        self._file = open(self.path, "rb")
+        self.footer = _read_footer(self._file)
+        if self.footer['version'] > VERSION:
+            raise ValueError("Snapshot version " +
+                             str(self.footer['version']) + " not supported")
+
+        #  Uncompressed blocks are read straight from the mapped file.
+        self._buffer = None
+        if self.footer['codec'] is None:
+            self._buffer = mmap.mmap(self._file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+
+        #  Change log seq covered, moved forward by each delta.
+        self.seq = self.footer['seq']
+        self.deltas = []
+        for delta in deltas:
+            self.apply(delta)
+
+    @property
+    def tickers(self):
+        """Stored tickers, lower case"""
+        tickers = set(self.footer['tickers'])
+        for delta in self.deltas:
+            tickers.update(delta.footer['tickers'])
+        return sorted(tickers)
+
+    def has_ticker(self, ticker):
+        return ticker.lower() in self.tickers
+
+    def apply(self, delta):
+        """Applies delta, a Snapshot or a path, on top of this snapshot"""
+        if not isinstance(delta, Snapshot):
+            delta = Snapshot(delta)
+        if delta.footer['kind'] != 'delta':
+            raise ValueError(delta.path + " is not a delta snapshot")
+        if delta.footer['after'] > self.seq:
+            raise ValueError(delta.path + " starts after change " +
+                             str(delta.footer['after']) + ", this snapshot "
+                             "only covers up to " + str(self.seq))
+        self.deltas.append(delta)
+        self.seq = max(self.seq, delta.seq)
+        return self
+
+    def block(self, ticker):
+        """Stored frame of ticker, only its non null columns"""
+        entry = self.footer['tickers'][ticker.lower()]
+        start, end = entry['offset'], entry['offset'] + entry['size']
+        if self._buffer is not None:
+            return decode_frame(memoryview(self._buffer)[start:end])
+        self._file.seek(start)
+        return decode_frame(_unshuffle(zlib.decompress(
+                                            self._file.read(entry['size']))))
+
+    def frame(self, ticker):
+        """Whole history of ticker, every price column"""
+        ticker = ticker.lower()
+        parts = []
+        if ticker in self.footer['tickers']:
+            parts.append(self.block(ticker))
+        for delta in self.deltas:
+            if ticker not in delta.footer['tickers']:
+                continue
+            since = pd.Timestamp(delta.footer['tickers'][ticker]['since'])
+            parts = [i.loc[i.index < since] for i in parts]
+            parts.append(delta.block(ticker))
+        if not parts:
+            raise KeyError("Ticker " + ticker + " not in " + self.path)
+        prices = pd.concat(parts) if len(parts) > 1 else parts[0]
+        return prices.reindex(columns=self.footer['columns'])
+
+    def get_prices(self, ticker, start, end=None, dt_index=True):
+        """Prices of ticker between start and end, as DBstocks.get_prices"""
+        if end is None:
+            end = dt.datetime.now().strftime("%Y-%m-%d")
+        prices = self.frame(ticker).loc[start:end].copy()
+        if not dt_index:
+            prices.index = prices.index.strftime("%Y-%m-%d")
+            prices = prices.reset_index()
+        return prices
+
+    def get_panel(self, tickers, columns="close_h", start="1991-01-01",
+                  end=None, dtype=None):
+        """Date by ticker DataFrame, as DBstocks.get_panel"""
+        names = [columns] if isinstance(columns, str) else list(columns)
+        if end is None:
+            end = dt.datetime.now().strftime("%Y-%m-%d")
+        frames = {ticker: self.frame(ticker).loc[start:end, names]
+                  for ticker in tickers if self.has_ticker(ticker)}
+        return DBstocks._frames_panel(frames, tickers, columns, dtype=dtype)
+
+    def close(self):
+        for delta in self.deltas:
+            delta.close()
+        if self._buffer is not None:
+            try:
+                self._buffer.close()
+            except BufferError:
+                #  Frames still view the map, it is closed with them.
+                pass
+        self._file.close()
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] not in ("export", "import"):
+        raise SystemExit(__doc__)
+    if sys.argv[1] == "export":
+        after = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        codec = sys.argv[5] if len(sys.argv) > 5 else "zlib"
+        dbs = DBstocks(dbname=sys.argv[2], log=False)
+        footer = dbs.export_snapshot(sys.argv[3], after=after,
+                                     codec=None if codec == "none" else codec)
+        print("[snapshot] " + str(len(footer['tickers'])) + " tickers, " +
+              str(sum(i['rows'] for i in footer['tickers'].values())) +
+              " rows, up to change " + str(footer['seq']) + ", " +
+              str(os.path.getsize(sys.argv[3])) + " bytes")
+    else:
+        dbs = DBstocks(dbname=sys.argv[3], log=False)
+        counts = dbs.import_snapshot(sys.argv[2])
+        print("[snapshot] " + str(len(counts)) + " tickers, " +
+              str(sum(i['inserted'] + i['updated'] for i in counts.values()))
+              + " rows")
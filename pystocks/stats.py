@@ -1,16 +1,26 @@
 import pandas as pd
 import numpy as np
 from pystocks.dbstocks import DBstocks
-import matplotlib.pyplot as plt
+from pystocks.rolling import SinceStats
+from pystocks.screen import Screener
+from pystocks.instrument import timed
+
+
+def __getattr__(name):
+    """matplotlib.pyplot is only imported when a graph is made"""
+    if name == "plt":
+        import matplotlib.pyplot as plt
+        return plt
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
 
 
 class DBstats:
     """Example usage of dbstocks, make some basic stats"""
 
-    def __init__(self):
+    def __init__(self, dbs=None):
 
-        #  DB handle
-        self.dbs = DBstocks()
+        #  DB handle, the default db unless given.
+        self.dbs = DBstocks() if dbs is None else dbs
 
         #  Data for selected tickers.
         self.data = None
@@ -18,34 +28,54 @@ class DBstats:
         #  CCL provided by dbstocks.
         self.ccl = None
 
+        #  Aggregation of the CCL pairs, see DBstocks.get_ccl
+        self.ccl_method = 'median'
+
         #  Data in USD dollars for selected tickers.
         self.data_usd = None
 
         #  Dict with data selections.
         self.since = {}
 
-    def get_yprices(self, adjusted=True, crop_VALO=True, del_suspects=True):
-        """ Populates self.data with a DataFrame"""
+        #  Anchor dates for compute_var_since.
+        self.anchors = {'ytd': '2020-01-01', 'paso': '2019-08-11'}
+
+        #  Change log seq when self.data was read, and how it was read.
+        self.seq = None
+        self.source = None
+
+        #  SinceStats kept between updates, and the seq and source of the
+        #  data it last folded in.
+        self.since_stats = None
+        self.since_seq = None
+        self.since_source = None
+
+    @property
+    def instrument(self):
+        """Instrument of the DB handle, see pystocks.instrument"""
+        return self.dbs.instrument
+
+    @timed("stats.prices")
+    def get_yprices(self, adjusted=True, crop_VALO=True, del_suspects=True,
+                    quarantine=True):
+        """ Populates self.data with a DataFrame. quarantine (True or a list
+        of rules) leaves out prices flagged by the db validation."""
 
         #  Use adjusted values?
         mycol = "close"
         if adjusted:
             mycol = mycol + "_h"
 
-        #  Get all up to date prices
-        precs = []
-        for i in self.dbs.dtickers['y']:
-            _ = self.dbs.get_prices(i, start="1991-01-01")
-            precs.append(_.close_h)
-
-        #  Make a DataFrame with all the prices
-        df = pd.concat(precs, axis=1)
-        df.columns = self.dbs.dtickers['y']
-        self.data = df
+        #  Get all up to date prices in a single pass
+        self.seq = self.dbs.last_change()
+        self.source = (adjusted, crop_VALO, del_suspects, quarantine)
+        self.data = self.dbs.get_panel(self.dbs.dtickers['y'], mycol,
+                                       start="1991-01-01",
+                                       quarantine=quarantine)
 
         #  Discard VALO data before BYMA spinoff
         if crop_VALO:
-            self.data.VALO.loc[:'2017-08-07'] = np.nan
+            self.data.loc[:'2017-08-07', 'VALO'] = np.nan
 
         #  Possible cleanup needed for these tickers.
         if del_suspects:
@@ -55,6 +85,7 @@ class DBstats:
             print("WARN: deleted data for GAMI, GCLA, CGPA2")
         return None
 
+    @timed("stats.update")
     def update(self, update_db=False):
         """ Populates self.data, self.data_usd, self.since, self.ccl """
 
@@ -74,41 +105,57 @@ class DBstats:
         self.compute_var_since()
         return None
 
+    @timed("stats.ccl")
     def get_ccl(self):
         """ Populates self.ccl and self.data_usd """
-        self.ccl = self.dbs.get_ccl()
-        self.data_usd = self.data.div(self.ccl.close, axis=0)
+        self.ccl = self.dbs.get_ccl(method=self.ccl_method)
+
+        #  CCL aligned to the panel dates, a single array division.
+        ccl = self.ccl.close.reindex(self.data.index, method='ffill')
+        self.data_usd = pd.DataFrame(self.data.to_numpy(dtype=float) /
+                                     ccl.to_numpy(dtype=float)[:, None],
+                                     index=self.data.index,
+                                     columns=self.data.columns)
         return None
 
-    def compute_var_since(self, start='2017-01-01'):
-        """Populates self.since dict"""
-        data = self.data_usd.loc[start:].fillna(method='ffill')
-
-        #  Var since max
-        self.since['max'] = (100. *
-                             data.div(data.max(),
-                                      axis=1
-                                      ).subtract(1)
-                             ).dropna().iloc[-1].sort_values()
-
-        #  Var since min
-        self.since['min'] = (100. *
-                             data.div(data.min(),
-                                      axis=1
-                                      ).subtract(1)
-                             ).dropna().iloc[-1].sort_values()
-
-        #  2020
-        self.since['ytd'] = (100. *
-                              data.iloc[-1].div(data.loc['2020-01-01':].iloc[0]).subtract(1)
-                              ).dropna().sort_values()
-
-        #  Var sin PASO
-        self.since['paso'] = (100. *
-                              data.iloc[-1].div(data.loc['2019-08-11':].iloc[0]).subtract(1)
-                              ).dropna().sort_values()
+    def screener(self):
+        """Screener over self.data_usd, see pystocks.screen"""
+        return Screener(self.data_usd)
+
+    @timed("stats.var_since")
+    def compute_var_since(self, start='2017-01-01', anchors=None):
+        """Populates self.since dict. anchors is a {name: date} dict,
+        defaults to self.anchors. Only rows from the date of the previous
+        call on are processed while start, anchors, tickers and the data
+        source don't change, and no earlier row was written since."""
+        if anchors is None:
+            anchors = self.anchors
+        source = (self.source, self.ccl_method)
+        engine = self.since_stats
+        if (engine is None or engine.start != pd.Timestamp(start) or
+                engine.tickers != list(self.data_usd.columns) or
+                {i: engine.anchors[i][0] for i in engine.anchors} !=
+                {i: pd.Timestamp(anchors[i]) for i in anchors} or
+                self.since_source != source or self._revised(engine)):
+            engine = SinceStats(self.data_usd.columns, start=start,
+                                anchors=anchors)
+        self.since_stats = engine.update(self.data_usd)
+        self.since_seq = self.seq
+        self.since_source = source
+        self.since = self.since_stats.variations()
         return None
 
+    def _revised(self, engine):
+        """True if rows before the last date folded in by engine were
+        written (prices, adjustments, released flags) between its data and
+        self.data, see DBstocks.get_changes"""
+        if (engine.last_date is None or self.since_seq is None or
+                self.seq is None or self.seq <= self.since_seq):
+            return False
+        last = engine.last_date.strftime("%Y-%m-%d")
+        return any(seq <= self.seq and since[:10] < last for seq, ticker, since
+                   in self.dbs.get_changes(self.since_seq))
+
     def graph_barh(self, kind="max", xlim=None, grid=True):
         """ Make desired barh plots """
         tit = None
@@ -127,8 +174,10 @@ class DBstats:
         res = self.since[kind]
 
         #  Clear matplotlib garbage
+        import matplotlib.pyplot as plt
         plt.clf()
-        ax = res.plot(kind='barh', grid=grid, title=tit, figsize=(8, 16),xlim=xlim)
+        ax = res.plot(kind='barh', grid=grid, title=tit, figsize=(8, 16),
+                      xlim=xlim)
         for p in ax.patches:
             width = p.get_width()
             loc = width + 1.8
@@ -147,6 +196,7 @@ class DBstats:
         data.columns = ["Desde máximos", "Desde mínimos", "Desde las PASO"]
 
         #  Clear matplotlib garbage
+        import matplotlib.pyplot as plt
         plt.clf()
 
         #  Plot
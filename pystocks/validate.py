@@ -0,0 +1,371 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+
+class Validator:
+    """Data quality checks of each batch of rows before it is upserted.
+
+    Rows are written as they come; what fails a check is flagged in a
+    quarantine table (ticker, date, rule, value) and masked at read time,
+    see mask() and DBstocks.get_panel(quarantine=True). Rules:
+
+    nonpositive  a zero or negative price (value: close)
+    duplicate    a date repeated in the batch (value: repetitions)
+    jump         a close beyond sigma rolling deviations from the last one
+                 that the next close reverts, i.e. a bad print and not a
+                 devaluation (value: deviations)
+    stale        a close repeated for stale rows or more (value: run)
+    ccl          the CCL implied by a BYMA / NYSE pair off the median of
+                 the other pairs by more than ccl_tolerance (value:
+                 relative deviation)
+
+    Every check is vectorized over the batch plus the last window rows
+    stored, so a full backfill is validated at a few microseconds a row."""
+
+    #  Flags table: (ticker, date, rule, value)
+    table = "quarantine"
+
+    rules = ('nonpositive', 'duplicate', 'jump', 'stale', 'ccl')
+
+    #  Price columns that must be positive.
+    prices = ('start', 'max', 'min', 'close')
+
+    #  Seconds per row validation may take on a full backfill, see stats
+    #  and benchmarks/bench_validate.py
+    budget = 10e-6
+
+    def __init__(self, dbs, sigma=8., min_jump=0.2, revert=0.5, window=60,
+                 stale=5, ccl_tolerance=0.25, min_pairs=3):
+
+        #  DBstocks handle
+        self.dbs = dbs
+
+        #  Jumps: rolling deviations, minimum absolute log move, and the
+        #  fraction of the move the next close must revert.
+        self.sigma = sigma
+        self.min_jump = min_jump
+        self.revert = revert
+
+        #  Rows of rolling deviation, also read before each batch.
+        self.window = window
+
+        #  Repeated closes before a row is stale.
+        self.stale = stale
+
+        #  CCL mismatch, against the median of at least min_pairs pairs.
+        self.ccl_tolerance = ccl_tolerance
+        self.min_pairs = min_pairs
+
+        #  {ticker: (start, close Series)} of the CCL pairs, see written().
+        self._closes = {}
+
+        #  Tickers with stored flags, see flagged().
+        self._flagged = None
+
+        #  Rows, seconds and flags of the batches validated so far.
+        self.stats = {'rows': 0, 'seconds': 0., 'flags': 0}
+        self._lock = threading.Lock()
+
+    def create_table(self):
+        """Creates the quarantine table if needed"""
+        return self.dbs._ensure_table(self.table,
+                                      "ticker TEXT, date TEXT, rule TEXT, "
+                                      "value REAL, "
+                                      "PRIMARY KEY (ticker, date, rule)")
+
+    def validate(self, ticker, columns, rows):
+        """Checks rows of ticker (tuples ordered as columns, date first, as
+        _upsert_rows) and stores the flags, replacing those of the dates
+        in rows. Returns the flags DataFrame."""
+        clock = time.perf_counter()
+        ticker = ticker.lower()
+        if not rows:
+            return self._flags([])
+        dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+        values = {}
+        for i, column in enumerate(columns[1:], 1):
+            if column in self.prices:
+                values[column] = np.array([row[i] for row in rows],
+                                          dtype=float)
+        flags = self.check(ticker, dates, values)
+        self.store(ticker, flags, str(dates.min()), str(dates.max()))
+        elapsed = time.perf_counter() - clock
+        with self._lock:
+            self.stats['rows'] += len(rows)
+            self.stats['seconds'] += elapsed
+            self.stats['flags'] += len(flags)
+        return flags
+
+    def check(self, ticker, dates, values):
+        """Flags of a batch: dates (datetime64[D]) and {column: prices}.
+        Returns a DataFrame with date, rule and value."""
+        found = []
+
+        #  Same date more than once in the batch.
+        unique, inverse, counts = np.unique(dates, return_inverse=True,
+                                            return_counts=True)
+        repeated = counts[inverse] > 1
+        found.append((dates[repeated], 'duplicate',
+                      counts[inverse][repeated]))
+
+        close = values.get('close', np.full(len(dates), np.nan))
+        with np.errstate(invalid='ignore'):
+            bad = np.zeros(len(dates), dtype=bool)
+            for column in values:
+                bad |= values[column] <= 0
+        found.append((dates[bad], 'nonpositive', close[bad]))
+
+        #  Close series: last row of each date, after the stored context.
+        last = np.zeros(len(unique), dtype=int)
+        last[inverse] = np.arange(len(dates))
+        stored, context = self._context(ticker, str(unique[0]))
+        days = np.concatenate([stored, unique])
+        series = np.concatenate([context, close[last]])
+        with np.errstate(invalid='ignore'):
+            valid = series > 0
+        days, series = days[valid], series[valid]
+        first = np.count_nonzero(valid[:len(context)])
+
+        #  A spike is checked from the last stored row on, its reversal
+        #  may only arrive with this batch.
+        found.append(self._jumps(days, series, max(first - 1, 0)))
+        found.append(self._stale(days, series, first))
+        found.append(self._ccl(ticker, unique, close[last]))
+        return self._flags(found)
+
+    def _flags(self, found):
+        found = [i for i in found if len(i[0])]
+        if not found:
+            return pd.DataFrame({'date': np.array([], dtype="datetime64[D]"),
+                                 'rule': np.array([], dtype=object),
+                                 'value': np.array([], dtype=float)})
+        flags = pd.DataFrame({
+            'date': np.concatenate([i[0] for i in found]),
+            'rule': np.concatenate([np.full(len(i[0]), i[1], dtype=object)
+                                    for i in found]),
+            'value': np.concatenate([np.asarray(i[2], dtype=float)
+                                     for i in found])})
+        return flags.drop_duplicates(['date', 'rule'], keep='last')
+
+    def _read_close(self, ticker, start="0001-01-01", end="9999-12-31",
+                    limit=-1):
+        """(dates, closes) arrays of ticker from start and before end, the
+        last limit of them"""
+        ticker = ticker.lower()
+        if not self.dbs.has_ticker(ticker):
+            return np.array([], dtype="datetime64[D]"), np.array([])
+        with self.dbs.engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                "SELECT date, close FROM " + self.dbs._ticker_source(ticker) +
+                " AND date >= ? AND date < ? ORDER BY date DESC LIMIT " +
+                str(limit),
+                (start, end)).fetchall()[::-1]
+        return (np.array([i[0][:10] for i in rows], dtype="datetime64[D]"),
+                np.array([i[1] for i in rows], dtype=float))
+
+    def _context(self, ticker, start):
+        """Last window closes of ticker stored before start"""
+        return self._read_close(ticker, end=start, limit=self.window)
+
+    def _pair_close(self, ticker, start):
+        """(dates, closes) of a CCL pair ticker from start on, cached until
+        written"""
+        cached = self._closes.get(ticker)
+        if cached is None or cached[0] > start:
+            cached = (start, self._read_close(ticker, start=start))
+            self._closes[ticker] = cached
+        return cached[1]
+
+    def written(self, ticker):
+        """Forgets the cached closes of ticker, see DBstocks._upsert_rows"""
+        self._closes.pop(ticker.lower(), None)
+        return None
+
+    def _jumps(self, days, series, first):
+        """Spikes among rows first on of a positive close series"""
+        if len(series) < 3:
+            return days[:0], 'jump', []
+        moves = np.diff(np.log(series))
+
+        #  Deviation of the window moves before each one, with cumulative
+        #  sums. The whole series' MAD while the window fills.
+        total = np.append(0., np.cumsum(moves))
+        squares = np.append(0., np.cumsum(moves * moves))
+        end = np.arange(len(moves))
+        start = np.maximum(end - self.window, 0)
+        count = end - start
+        scale = np.full(len(moves), np.nan)
+        full = count >= 10
+        s, e, c = start[full], end[full], count[full]
+        var = ((squares[e] - squares[s]) -
+               (total[e] - total[s]) ** 2 / c) / (c - 1)
+        scale[full] = np.sqrt(np.maximum(var, 0.))
+        median = np.median(moves)
+        fallback = 1.4826 * np.median(np.abs(moves - median))
+        scale = np.where(np.isnan(scale), fallback, scale)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.abs(moves) / scale
+        after = np.append(moves[1:], np.nan)
+        with np.errstate(invalid='ignore'):
+            spike = ((score > self.sigma) &
+                     (np.abs(moves) > self.min_jump) &
+                     (np.sign(after) == -np.sign(moves)) &
+                     (np.abs(moves + after) < self.revert * np.abs(moves)))
+        spike[:max(first - 1, 0)] = False
+        return days[1:][spike], 'jump', score[spike]
+
+    def _stale(self, days, series, first):
+        """Rows first on whose close has been repeated for stale rows"""
+        same = np.append(False, series[1:] == series[:-1])
+        pos = np.arange(len(series))
+        run = pos - np.maximum.accumulate(np.where(same, 0, pos)) + 1
+        stale = run >= self.stale
+        stale[:first] = False
+        return days[stale], 'stale', run[stale]
+
+    def _ccl(self, ticker, dates, close):
+        """CCL of the pair of ticker, with the batch close, against the
+        median of the other pairs stored on the same dates"""
+        engine = self.dbs.ccl_engine
+        adrs = list(engine.pairs)
+        local = [engine.pairs[i][0] for i in adrs]
+        names = [i.lower() for i in local + adrs]
+        if ticker not in names:
+            return dates[:0], 'ccl', []
+        n = len(adrs)
+        ratio = np.array([engine.pairs[i][1] for i in adrs], dtype=float)
+        pair = names.index(ticker) % n
+
+        values = np.full((len(dates), len(names)), np.nan)
+        for i, name in enumerate(names):
+            if name == ticker:
+                values[:, i] = close
+                continue
+            days, closes = self._pair_close(name, str(dates[0]))
+            pos = np.minimum(np.searchsorted(days, dates), len(days) - 1)
+            if len(days):
+                found = days[pos] == dates
+                values[found, i] = closes[pos[found]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = values[:, :n] * ratio / values[:, n:]
+        rates[~np.isfinite(rates)] = np.nan
+
+        others = np.delete(rates, pair, axis=1)
+        enough = (~np.isnan(others)).sum(axis=1) >= self.min_pairs
+        enough &= ~np.isnan(rates[:, pair])
+        if not enough.any():
+            return dates[:0], 'ccl', []
+        reference = np.full(len(dates), np.nan)
+        reference[enough] = np.nanmedian(others[enough], axis=1)
+        with np.errstate(invalid='ignore'):
+            deviation = rates[:, pair] / reference - 1.
+            off = enough & (np.abs(deviation) > self.ccl_tolerance)
+        return dates[off], 'ccl', deviation[off]
+
+    def store(self, ticker, flags, start, end):
+        """Replaces the flags of ticker between start and end with flags"""
+        ticker = ticker.lower()
+        if not len(flags) and ticker not in self.flagged():
+            return None
+        self.create_table()
+        self.flagged().add(ticker)
+        rows = [(ticker, str(i), j, float(k)) for i, j, k in
+                zip(flags['date'].to_numpy(dtype="datetime64[D]"),
+                    flags['rule'], flags['value'])]
+        with self.dbs.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'DELETE FROM "' + self.table + '" WHERE ticker = ? AND '
+                'date BETWEEN ? AND ?', (ticker, start, end))
+            if rows:
+                conn.exec_driver_sql(
+                    self.dbs._upsert_sql(self.table,
+                                         ['ticker', 'date', 'rule', 'value'],
+                                         keys=('ticker', 'date', 'rule')),
+                    rows)
+        return None
+
+    def flagged(self):
+        """Tickers with stored flags, read once"""
+        if self._flagged is None:
+            self._flagged = set()
+            if self.dbs.has_table(self.table):
+                with self.dbs.engine.connect() as conn:
+                    self._flagged = set(i[0] for i in conn.exec_driver_sql(
+                        'SELECT DISTINCT ticker FROM "' + self.table + '"'))
+        return self._flagged
+
+    def release(self, ticker, dates=None, rules=None):
+        """Drops flags of ticker, on dates and of rules (default all) once
+        they were reviewed. Logged as a change of ticker from the first
+        date released."""
+        if not self.dbs.has_table(self.table):
+            return None
+        query = 'DELETE FROM "' + self.table + '" WHERE ticker = ?'
+        params = [ticker.lower()]
+        for column, values in (('date', dates), ('rule', rules)):
+            if values is not None:
+                values = [pd.Timestamp(i).strftime("%Y-%m-%d")
+                          if column == 'date' else i for i in values]
+                query += (" AND " + column + " IN (" +
+                          ", ".join("?" for i in values) + ")")
+                params += values
+        #  Masked panels change from the first date released on.
+        self.dbs._create_changes_table()
+        with self.dbs.engine.begin() as conn:
+            first = conn.exec_driver_sql(
+                query.replace("DELETE", "SELECT MIN(date)", 1),
+                tuple(params)).scalar()
+            if first is not None:
+                conn.exec_driver_sql(query, tuple(params))
+                self.dbs.log_change(conn, ticker, first)
+        return None
+
+    def flags(self, tickers=None, start=None, end=None, rules=None):
+        """Stored flags as a DataFrame with ticker, date (datetime), rule
+        and value"""
+        columns = ['ticker', 'date', 'rule', 'value']
+        if not self.dbs.has_table(self.table):
+            return pd.DataFrame(columns=columns)
+        query = ('SELECT ticker, date, rule, value FROM "' + self.table +
+                 '" WHERE date BETWEEN ? AND ?')
+        params = [start or "0001-01-01", end or "9999-12-31"]
+        for column, values in (('ticker', tickers), ('rule', rules)):
+            if values is not None:
+                values = [i.lower() if column == 'ticker' else i
+                          for i in values]
+                query += (" AND " + column + " IN (" +
+                          ", ".join("?" for i in values) + ")")
+                params += values
+        with self.dbs.engine.connect() as conn:
+            rows = conn.exec_driver_sql(query + " ORDER BY ticker, date",
+                                        tuple(params)).fetchall()
+        flags = pd.DataFrame(rows, columns=columns)
+        flags['date'] = pd.to_datetime(flags['date'], format="%Y-%m-%d")
+        return flags
+
+    def mask(self, tickers, index, rules=None):
+        """Boolean index by tickers DataFrame, True where flagged"""
+        tickers = list(tickers)
+        mask = np.zeros((len(index), len(tickers)), dtype=bool)
+        if len(index) and tickers:
+            flags = self.flags(tickers, index.min().strftime("%Y-%m-%d"),
+                               index.max().strftime("%Y-%m-%d"), rules)
+            rows = index.get_indexer(flags['date'])
+            columns = {}
+            for j, ticker in enumerate(tickers):
+                columns.setdefault(ticker.lower(), []).append(j)
+            for ticker, row in zip(flags['ticker'], rows):
+                if row >= 0:
+                    mask[row, columns.get(ticker, [])] = True
+        return pd.DataFrame(mask, index=index, columns=tickers)
+
+    def apply(self, panel, tickers, rules=None):
+        """panel (as DBstocks.get_panel of tickers) with NaN where
+        flagged"""
+        mask = self.mask(tickers, panel.index, rules).to_numpy()
+        if not mask.any():
+            return panel
+        repeat = panel.shape[1] // max(len(mask[0]), 1)
+        return panel.mask(np.tile(mask, repeat))